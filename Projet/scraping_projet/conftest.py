@@ -0,0 +1 @@
+# Racine des tests : rend le paquet scraping_projet importable sans installation (python -m pytest)
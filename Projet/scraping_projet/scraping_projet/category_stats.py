@@ -0,0 +1,154 @@
+"""
+Collection `category_stats` : un document par catégorie, à chaque niveau de
+`category_hierarchy`, avec les compteurs lus par le dashboard (/page2, /page3).
+
+    {_id: 'Produits > Meubles > Canapés', level: 2, name: 'Canapés',
+     path: ['Produits', 'Meubles', 'Canapés'],
+     products, reviews, rating_sum, rating_count, labels: {...}, combined_labels: {...}}
+
+Elle est tenue à jour par MongoDBPipeline : pour chaque lot écrit, la
+contribution précédente des produits (relue dans MongoDB avant l'écriture) est
+retranchée et la nouvelle ajoutée, en un `$inc` par catégorie touchée.
+`rebuild` la reconstruit entièrement à partir de la collection des produits.
+"""
+from collections import defaultdict
+
+from pymongo import UpdateOne
+
+from .messages import classify_commercial_messages
+
+PATH_SEPARATOR = ' > '
+REDUCTION_LABEL = 'Réduction'
+# Champs des produits nécessaires au calcul de leur contribution
+CONTRIBUTION_FIELDS = ('product_id', 'url', 'category_hierarchy', 'review_count', 'rating',
+                       'message_class', 'commercial_message')
+
+
+def field_key(label):
+    """Nom de champ MongoDB utilisable dans un `$inc` ('.' et '$' initial remplacés)."""
+    label = label.replace('.', '．')
+    return '＄' + label[1:] if label.startswith('$') else label
+
+
+def _as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _as_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def contribution(doc):
+    """Compteurs apportés par un produit à chaque catégorie de sa hiérarchie : {chemin: {champ: delta}}."""
+    if not doc:
+        return {}
+    hierarchy = []
+    # Niveaux valides en tête de la hiérarchie seulement : un trou décalerait les niveaux suivants
+    for name in doc.get('category_hierarchy') or []:
+        if not isinstance(name, str) or not name:
+            break
+        hierarchy.append(name)
+    if not hierarchy:
+        return {}
+    counters = {'products': 1, 'reviews': _as_int(doc.get('review_count'))}
+    rating = _as_float(doc.get('rating'))
+    if rating > 0:
+        counters['rating_sum'] = rating
+        counters['rating_count'] = 1
+    message_class = doc.get('message_class') or classify_commercial_messages(doc.get('commercial_message'))
+    if message_class['label']:
+        group = 'combined_labels' if message_class['combined'] else 'labels'
+        counters[f"{group}.{field_key(message_class['label'])}"] = 1
+    if message_class['reductions']:
+        counters[f'labels.{REDUCTION_LABEL}'] = counters.get(f'labels.{REDUCTION_LABEL}', 0) + 1
+    return {tuple(hierarchy[:level + 1]): counters for level in range(len(hierarchy))}
+
+
+def _category_update(path, increments):
+    return UpdateOne(
+        {'_id': PATH_SEPARATOR.join(path)},
+        {'$inc': increments, '$setOnInsert': {'level': len(path) - 1, 'name': path[-1], 'path': list(path)}},
+        upsert=True
+    )
+
+
+class CategoryStats:
+    """Applique à `category_stats` les deltas des produits écrits par BulkUpserter."""
+
+    name = 'category_stats'
+    fields = CONTRIBUTION_FIELDS
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def apply(self, previous, written):
+        """
+        Ajoute la différence entre la nouvelle contribution de chaque produit écrit
+        (`written` : clé -> document envoyé) et la précédente ; renvoie le nombre de
+        catégories modifiées.
+        """
+        deltas = defaultdict(lambda: defaultdict(float))
+        for key, doc in written.items():
+            old = previous.get(key)
+            # Les champs absents du document envoyé ($set partiel) gardent leur valeur précédente
+            new = {**old, **doc} if old else doc
+            for path, counters in contribution(old).items():
+                for field, value in counters.items():
+                    deltas[path][field] -= value
+            for path, counters in contribution(new).items():
+                for field, value in counters.items():
+                    deltas[path][field] += value
+        operations = []
+        for path, counters in deltas.items():
+            increments = {field: _exact(value) for field, value in counters.items() if value}
+            if increments:
+                operations.append(_category_update(path, increments))
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+        return len(operations)
+
+
+def _exact(value):
+    # Les compteurs entiers restent des entiers dans MongoDB
+    return int(value) if float(value).is_integer() else value
+
+
+def rebuild(products, collection, batch_size=1000):
+    """
+    Reconstruit `category_stats` à partir de tous les produits dans une collection
+    temporaire, puis la renomme d'un coup : les lecteurs ne voient jamais de
+    statistiques partielles. Renvoie (produits lus, catégories écrites).
+    """
+    totals = defaultdict(lambda: defaultdict(float))
+    count = 0
+    projection = {field: 1 for field in CONTRIBUTION_FIELDS}
+    for doc in products.find({}, projection, batch_size=batch_size):
+        count += 1
+        for path, counters in contribution(doc).items():
+            for field, value in counters.items():
+                totals[path][field] += value
+
+    tmp = collection.database[f'{collection.name}_rebuild']
+    tmp.drop()
+    operations = [
+        _category_update(path, {field: _exact(value) for field, value in counters.items()})
+        for path, counters in totals.items()
+    ]
+    for start in range(0, len(operations), batch_size):
+        tmp.bulk_write(operations[start:start + batch_size], ordered=False)
+    ensure_indexes(tmp)
+    if operations:
+        tmp.rename(collection.name, dropTarget=True)
+    else:
+        collection.drop()
+    return count, len(operations)
+
+
+def ensure_indexes(collection):
+    collection.create_index('level', name='level')
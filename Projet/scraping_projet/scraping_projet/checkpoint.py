@@ -0,0 +1,123 @@
+import json
+import os
+import sqlite3
+import time
+
+# Clés de meta nécessaires pour reprendre une requête (le reste est recalculé par Scrapy)
+CHECKPOINT_META_KEYS = ('category_path', 'conditional')
+
+
+def has_pending(path):
+    """Vrai si le point de reprise `path` contient des requêtes en attente : le crawl va reprendre."""
+    if not path or not os.path.exists(path):
+        return False
+    store = CrawlCheckpoint(path)
+    try:
+        return store.count_pending() > 0
+    finally:
+        store.close()
+
+
+def completed_keys(path):
+    """Clés des items déjà écrits par les bases d'après le point de reprise `path`."""
+    if not path or not os.path.exists(path):
+        return
+    store = CrawlCheckpoint(path)
+    try:
+        yield from store.completed_keys()
+    finally:
+        store.close()
+
+
+class CrawlCheckpoint:
+    """
+    Frontière du crawl persistée dans un fichier SQLite local.
+
+    Chaque requête de catégorie ou de page produit est enregistrée comme
+    « en attente » au moment où elle est émise, puis retirée quand son
+    callback a terminé (ou, pour une page produit, quand son item a été
+    écrit par les bases). Les pages produit terminées sont mémorisées à part,
+    avec la clé de déduplication de leur item.
+    Les écritures sont validées par lots : comme elles se font dans l'ordre,
+    une page n'est jamais marquée terminée sans que ses requêtes filles ne
+    soient elles aussi sur disque.
+    """
+
+    def __init__(self, path, commit_every=200, commit_interval=5.0):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+        self.pending_writes = 0
+        self.last_commit = time.monotonic()
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS pending ("
+            " fingerprint TEXT PRIMARY KEY,"
+            " url TEXT,"
+            " callback TEXT,"
+            " meta TEXT,"
+            " priority INTEGER)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS pending_url ON pending (url)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS completed (url TEXT PRIMARY KEY, item_key TEXT)")
+        self.conn.commit()
+
+    def add_pending(self, fingerprint, url, callback, meta, priority=0):
+        meta = {key: meta[key] for key in CHECKPOINT_META_KEYS if key in meta}
+        self._write(
+            "INSERT OR REPLACE INTO pending (fingerprint, url, callback, meta, priority) VALUES (?, ?, ?, ?, ?)",
+            (fingerprint, url, callback, json.dumps(meta, ensure_ascii=False), priority)
+        )
+
+    def done(self, fingerprint):
+        self._write("DELETE FROM pending WHERE fingerprint = ?", (fingerprint,))
+
+    def complete(self, url, item_key=None):
+        """Marque une page produit comme terminée (item écrit par les bases, ou écarté comme doublon)."""
+        self._write("DELETE FROM pending WHERE url = ?", (url,))
+        self._write("INSERT OR IGNORE INTO completed (url, item_key) VALUES (?, ?)", (url, item_key))
+
+    def is_completed(self, url):
+        return self.conn.execute("SELECT 1 FROM completed WHERE url = ?", (url,)).fetchone() is not None
+
+    def pending_requests(self):
+        """Renvoie les requêtes en attente : (url, callback, meta, priority)."""
+        rows = self.conn.execute("SELECT url, callback, meta, priority FROM pending ORDER BY priority DESC").fetchall()
+        for url, callback, meta, priority in rows:
+            yield url, callback, json.loads(meta), priority
+
+    def completed_keys(self):
+        """Clés de déduplication des items écrits par les bases (DuplicatesPipeline à la reprise)."""
+        for (item_key,) in self.conn.execute("SELECT item_key FROM completed WHERE item_key IS NOT NULL"):
+            yield item_key
+
+    def count_pending(self):
+        return self.conn.execute("SELECT COUNT(*) FROM pending").fetchone()[0]
+
+    def commit_if_due(self):
+        if self.pending_writes and time.monotonic() - self.last_commit >= self.commit_interval:
+            self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self.pending_writes = 0
+        self.last_commit = time.monotonic()
+
+    def clear(self):
+        """Crawl terminé normalement : la prochaine exécution repart de zéro."""
+        self.conn.execute("DELETE FROM pending")
+        self.conn.execute("DELETE FROM completed")
+        self.commit()
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+    def _write(self, query, params):
+        self.conn.execute(query, params)
+        self.pending_writes += 1
+        if self.pending_writes >= self.commit_every:
+            self.commit()
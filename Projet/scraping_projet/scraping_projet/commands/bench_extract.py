@@ -0,0 +1,135 @@
+import glob
+import json
+import os
+import time
+from collections import Counter
+
+from scrapy.commands import ScrapyCommand
+from scrapy.exceptions import UsageError
+from scrapy.http import HtmlResponse
+
+from ..extraction import extract_product, extract_product_css
+from ..fixture_server import Catalog
+
+
+def load_corpus(directory):
+    """
+    Charge les pages produit enregistrées : `<nom>.html`, avec l'URL d'origine dans
+    `<nom>.url` si présent (sinon une URL produit est reconstruite à partir du nom).
+    """
+    pages = []
+    for filename in sorted(glob.glob(os.path.join(directory, '*.html'))):
+        stem = os.path.splitext(os.path.basename(filename))[0]
+        url_file = os.path.splitext(filename)[0] + '.url'
+        if os.path.exists(url_file):
+            with open(url_file, encoding='utf-8') as f:
+                url = f.read().strip()
+        else:
+            url = f'https://www.ikea.com/fr/fr/p/{stem}/'
+        with open(filename, 'rb') as f:
+            body = f.read()
+        pages.append((url, HtmlResponse(url, body=body).text))
+    return pages
+
+
+def generate_corpus(count, page_kb):
+    catalog = Catalog(count, page_kb=page_kb)
+    return [
+        (f'https://www.ikea.com/fr/fr/p/produit-{index}-{catalog.product_id(index)}/', catalog.product_page(index))
+        for index in range(count)
+    ]
+
+
+class Command(ScrapyCommand):
+    """
+    Compare l'extracteur en un seul parcours à l'ancienne extraction CSS sur un corpus
+    de pages produit enregistrées et mesure le débit de chacun (pages/s sur un cœur).
+
+    Exemple :
+        scrapy bench_extract pages_produit/ --repeat 3
+        scrapy bench_extract --generate 500
+    """
+
+    requires_project = True
+    requires_crawler_process = False
+    default_settings = {'LOG_LEVEL': 'WARNING'}
+
+    def syntax(self):
+        return "[répertoire de pages .html] [options]"
+
+    def short_desc(self):
+        return "Vérifie et chronomètre l'extraction des pages produit (CSS vs un seul parcours)"
+
+    def add_options(self, parser):
+        super().add_options(parser)
+        parser.add_argument('--generate', type=int, default=0,
+                            help='Génère N pages synthétiques au lieu de lire un répertoire')
+        parser.add_argument('--page-kb', type=int, default=150, help='Poids des pages générées (Ko)')
+        parser.add_argument('--repeat', type=int, default=3, help='Nombre de passes chronométrées')
+        parser.add_argument('--no-structured', action='store_true',
+                            help='Ignore le JSON-LD pour vérifier l\'identité stricte avec l\'extraction CSS')
+        parser.add_argument('--json', dest='json_output', default=None,
+                            help='Écrit aussi le rapport au format JSON dans ce fichier')
+
+    def run(self, args, opts):
+        if opts.generate:
+            pages = generate_corpus(opts.generate, opts.page_kb)
+        elif args:
+            pages = load_corpus(args[0])
+        else:
+            raise UsageError("Indiquer un répertoire de pages enregistrées ou --generate N")
+        if not pages:
+            raise UsageError("Aucune page .html trouvée")
+        prefer_structured = not opts.no_structured
+
+        # Vérification : mêmes champs, mêmes valeurs
+        mismatches = Counter()
+        examples = {}
+        for url, text in pages:
+            expected = extract_product_css(HtmlResponse(url, body=text, encoding='utf-8'))
+            actual = extract_product(text, url, prefer_structured=prefer_structured)
+            for field in expected:
+                if expected[field] != actual.get(field):
+                    mismatches[field] += 1
+                    examples.setdefault(field, (url, expected[field], actual.get(field)))
+
+        timings = {
+            'css': self._time(lambda url, text: extract_product_css(HtmlResponse(url, body=text, encoding='utf-8')),
+                              pages, opts.repeat),
+            'single_pass': self._time(lambda url, text: extract_product(text, url, prefer_structured=prefer_structured),
+                                      pages, opts.repeat),
+        }
+        report = {
+            'pages': len(pages),
+            'identical_pages': len(pages) - max(mismatches.values(), default=0),
+            'mismatches': dict(mismatches),
+            'pages_per_s_per_core': timings,
+            'speedup': round(timings['single_pass'] / timings['css'], 2) if timings['css'] else None,
+        }
+
+        print(f"Pages : {report['pages']}")
+        if mismatches:
+            print("Différences par champ :")
+            for field, count in mismatches.most_common():
+                url, expected, actual = examples[field]
+                print(f"  {field:<20} {count:>6}  ex. {url} : {expected!r} != {actual!r}")
+        else:
+            print("Sortie identique à l'extraction CSS sur tout le corpus")
+        print(f"CSS (référence)  : {timings['css']:>8.1f} pages/s par cœur")
+        print(f"Un seul parcours : {timings['single_pass']:>8.1f} pages/s par cœur (x{report['speedup']})")
+        if opts.json_output:
+            with open(opts.json_output, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+        if mismatches:
+            self.exitcode = 1
+
+    def _time(self, extractor, pages, repeat):
+        # Temps CPU du processus : mesure par cœur, indépendante de la charge de la machine
+        best = None
+        for _ in range(max(repeat, 1)):
+            start = time.process_time()
+            for url, text in pages:
+                extractor(url, text)
+            elapsed = time.process_time() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return round(len(pages) / best, 1) if best else 0.0
@@ -0,0 +1,190 @@
+import json
+import resource
+import time
+from collections import defaultdict
+
+from scrapy import signals
+from scrapy.commands import ScrapyCommand
+
+from ..fixture_server import START_PATH, add_server_arguments, serve_in_process
+
+
+class CallbackProfilerMiddleware:
+    """
+    Middleware de spider qui mesure le temps CPU passé dans chaque callback.
+    Placé au plus près du spider, il ne chronomètre que l'itération du générateur
+    renvoyé par le callback.
+    """
+
+    cpu_time = defaultdict(float)
+    calls = defaultdict(int)
+
+    def process_spider_output(self, response, result, spider=None):
+        callback = self._callback_name(response)
+        iterator = iter(result)
+        while True:
+            start = time.process_time()
+            try:
+                obj = next(iterator)
+            except StopIteration:
+                self.cpu_time[callback] += time.process_time() - start
+                return
+            self.cpu_time[callback] += time.process_time() - start
+            yield obj
+
+    async def process_spider_output_async(self, response, result, spider=None):
+        callback = self._callback_name(response)
+        iterator = result.__aiter__()
+        while True:
+            start = time.process_time()
+            try:
+                obj = await iterator.__anext__()
+            except StopAsyncIteration:
+                self.cpu_time[callback] += time.process_time() - start
+                return
+            self.cpu_time[callback] += time.process_time() - start
+            yield obj
+
+    def _callback_name(self, response):
+        callback = getattr(response.request.callback, '__name__', None) or 'parse'
+        self.calls[callback] += 1
+        return callback
+
+
+class Command(ScrapyCommand):
+    """
+    Lance IkeaSpider contre le serveur de fixtures local et mesure son débit.
+
+    Exemple :
+        scrapy bench_ikea --products 10000 --latency 0.05 -s CONCURRENT_REQUESTS=64
+    """
+
+    requires_project = True
+    default_settings = {'LOG_LEVEL': 'INFO'}
+
+    def syntax(self):
+        return "[options]"
+
+    def short_desc(self):
+        return "Mesure pages/s, items/s, RSS et CPU par callback du spider ikea hors ligne"
+
+    def add_options(self, parser):
+        super().add_options(parser)
+        add_server_arguments(parser)
+        parser.add_argument('--with-pipelines', action='store_true',
+                            help='Conserve les pipelines MongoDB/Elasticsearch (désactivés par défaut)')
+        parser.add_argument('--json', dest='json_output', default=None,
+                            help='Écrit aussi le rapport au format JSON dans ce fichier')
+
+    def run(self, args, opts):
+        process, port = serve_in_process(
+            products=opts.products, latency=opts.latency, error_rate=opts.error_rate,
+            record_dir=opts.record_dir, reviews_per_product=opts.reviews, page_kb=opts.page_kb
+        )
+        # Deux noms d'hôte pour que les pages HTML et l'API aient chacune leur slot de téléchargement
+        overrides = {
+            'IKEA_START_URL': f'http://127.0.0.1:{port}{START_PATH}',
+            'REVIEWS_API_URL': f'http://localhost:{port}/tugc/public/v5/reviews/fr/fr/{{product_id}}',
+            'DOWNLOAD_SLOTS': self._local_hosts(self.settings.getdict('DOWNLOAD_SLOTS')),
+            'ADAPTIVE_CONCURRENCY_HOSTS': self._local_hosts(self.settings.getdict('ADAPTIVE_CONCURRENCY_HOSTS')),
+            'CHECKPOINT_ENABLED': False,
+            'INCREMENTAL_CRAWL': False,
+            'SPIDER_MIDDLEWARES': {
+                **self.settings.getdict('SPIDER_MIDDLEWARES'),
+                'scraping_projet.commands.bench_ikea.CallbackProfilerMiddleware': 1,
+            },
+        }
+        if not opts.with_pipelines:
+            overrides['ITEM_PIPELINES'] = {}
+        try:
+            self.settings.setdict(overrides, priority='cmdline')
+            crawler = self.crawler_process.create_crawler('ikea')
+            first_item = []
+            crawler.signals.connect(
+                lambda item, response, spider: first_item or first_item.append(time.perf_counter()),
+                signal=signals.item_scraped, weak=False
+            )
+            self.crawler_process.crawl(crawler)
+            start = time.perf_counter()
+            cpu_start = time.process_time()
+            self.crawler_process.start()
+            elapsed = time.perf_counter() - start
+            cpu_total = time.process_time() - cpu_start
+            # Processus du pool d'extraction (EXTRACTION_PROCESSES), terminés à la fermeture du spider
+            children = resource.getrusage(resource.RUSAGE_CHILDREN)
+            cpu_workers = children.ru_utime + children.ru_stime
+        finally:
+            process.terminate()
+            process.join()
+
+        stats = crawler.stats.get_stats()
+        responses = stats.get('downloader/response_count', 0)
+        items = stats.get('item_scraped_count', 0)
+        report = {
+            'products': opts.products,
+            'latency': opts.latency,
+            'error_rate': opts.error_rate,
+            'concurrent_requests': crawler.settings.getint('CONCURRENT_REQUESTS'),
+            'extraction_processes': crawler.settings.getint('EXTRACTION_PROCESSES'),
+            'elapsed_s': round(elapsed, 2),
+            'responses': responses,
+            'items': items,
+            'pages_per_s': round(responses / elapsed, 1) if elapsed else 0.0,
+            'items_per_s': round(items / elapsed, 1) if elapsed else 0.0,
+            'first_item_s': round(first_item[0] - start, 2) if first_item else None,
+            'scheduler_max': stats.get('frontier/scheduler_max'),
+            'cpu_s': round(cpu_total, 2),
+            'cpu_workers_s': round(cpu_workers, 2),
+            # ru_maxrss est exprimé en Ko sous Linux
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            'adaptive_concurrency': self._adaptive_concurrency(stats),
+            'callbacks': {
+                name: {
+                    'calls': CallbackProfilerMiddleware.calls[name],
+                    'cpu_s': round(cpu, 3),
+                    'cpu_ms_per_call': round(cpu * 1000 / max(CallbackProfilerMiddleware.calls[name], 1), 3),
+                }
+                for name, cpu in sorted(CallbackProfilerMiddleware.cpu_time.items())
+            },
+        }
+        self._print_report(report)
+        if opts.json_output:
+            with open(opts.json_output, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+
+    def _adaptive_concurrency(self, stats):
+        hosts = {}
+        for key, value in stats.items():
+            if key.startswith('adaptive_concurrency/'):
+                _, host, name = key.split('/', 2)
+                hosts.setdefault(host, {})[name] = value
+        return hosts
+
+    def _local_hosts(self, per_host):
+        # Réglages par hôte d'IKEA reportés sur les deux noms d'hôte du serveur local
+        return {
+            local: per_host[remote]
+            for local, remote in (('127.0.0.1', 'www.ikea.com'), ('localhost', 'web-api.ikea.com'))
+            if remote in per_host
+        }
+
+    def _print_report(self, report):
+        print()
+        print(f"Catalogue : {report['products']} produits, latence {report['latency']} s, "
+              f"erreurs {report['error_rate']:.0%}, CONCURRENT_REQUESTS={report['concurrent_requests']}, "
+              f"EXTRACTION_PROCESSES={report['extraction_processes']}")
+        print(f"Durée      : {report['elapsed_s']} s (CPU {report['cpu_s']} s, pool d'extraction {report['cpu_workers_s']} s)")
+        print(f"Pages      : {report['responses']} ({report['pages_per_s']} pages/s)")
+        print(f"Items      : {report['items']} ({report['items_per_s']} items/s)")
+        print(f"1er item   : {report['first_item_s']} s")
+        print(f"Frontière  : {report['scheduler_max']} requêtes au plus dans l'ordonnanceur")
+        print(f"RSS max    : {report['peak_rss_mb']} Mo")
+        for host, values in report['adaptive_concurrency'].items():
+            print(f"Concurrence {host} : {values}")
+        print("CPU par callback :")
+        if report['extraction_processes']:
+            # Le temps d'un callback asynchrone inclut ce qui s'exécute pendant qu'il attend le pool
+            print("  (parse_product_details inclut l'attente du pool d'extraction)")
+        for name, values in report['callbacks'].items():
+            print(f"  {name:<24} {values['calls']:>8} appels  {values['cpu_s']:>8.3f} s  "
+                  f"{values['cpu_ms_per_call']:>8.3f} ms/appel")
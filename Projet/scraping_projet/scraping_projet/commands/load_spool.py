@@ -0,0 +1,67 @@
+import time
+
+from scrapy.commands import ScrapyCommand
+from scrapy.exceptions import UsageError
+from scrapy.utils.log import configure_logging
+
+from ..spool import SpoolError
+from ..spool_loader import SINKS, SpoolLoader
+
+
+class Command(ScrapyCommand):
+    """
+    Charge dans une base les items écrits dans le spool par un crawl lancé avec
+    SPOOL_ENABLED=1, à partir de l'offset de cette base. Un processus par base :
+    une base lente ou indisponible ne retarde ni le crawl ni l'autre base, et
+    ses items l'attendent dans le spool.
+
+    Exemples :
+        scrapy load_spool mongodb --follow
+        scrapy load_spool elasticsearch --from-start
+    """
+
+    requires_project = True
+    requires_crawler_process = False
+    default_settings = {'LOG_LEVEL': 'INFO'}
+
+    def syntax(self):
+        return f"<{'|'.join(SINKS)}> [options]"
+
+    def short_desc(self):
+        return "Charge les items du spool local dans MongoDB ou Elasticsearch"
+
+    def add_options(self, parser):
+        super().add_options(parser)
+        parser.add_argument('--follow', action='store_true',
+                            help='Attend les nouveaux segments au lieu de s\'arrêter à la fin du spool')
+        parser.add_argument('--from-start', action='store_true',
+                            help='Relit tous les segments conservés (rejoue les crawls dans la base)')
+
+    def run(self, args, opts):
+        if len(args) != 1 or args[0] not in SINKS:
+            raise UsageError(f"Base attendue : {', '.join(SINKS)}")
+        settings = self.settings
+        directory = settings.get('SPOOL_DIR')
+        if not directory:
+            raise UsageError("SPOOL_DIR est vide")
+        loader = SpoolLoader(
+            args[0],
+            settings,
+            directory,
+            purge_sinks=settings.getlist('SPOOL_SINKS'),
+            poll_interval=settings.getfloat('SPOOL_POLL_INTERVAL', 1.0),
+            retry_delay=settings.getfloat('SPOOL_RETRY_DELAY', 5.0)
+        )
+        # Sans processus de crawl, la journalisation de Scrapy n'est pas configurée
+        configure_logging(settings)
+        if opts.from_start:
+            loader.reset()
+        start = time.monotonic()
+        try:
+            loaded = loader.run(follow=opts.follow)
+        except SpoolError as e:
+            # Trame corrompue : l'offset reste avant elle, à corriger à la main
+            print(f"Chargement interrompu : {e}")
+            self.exitcode = 1
+            return
+        print(f"{loaded} items chargés dans {args[0]} en {time.monotonic() - start:.1f} s")
@@ -0,0 +1,49 @@
+import time
+
+import pymongo
+from scrapy.commands import ScrapyCommand
+from scrapy.exceptions import UsageError
+
+from ..category_stats import rebuild
+
+
+class Command(ScrapyCommand):
+    """
+    Reconstruit la collection `category_stats` (statistiques par catégorie du
+    dashboard) à partir de tous les produits de MongoDB : après un import hors
+    scraping, une modification manuelle ou pour corriger une dérive des deltas.
+
+    Exemple :
+        scrapy rebuild_category_stats
+    """
+
+    requires_project = True
+    requires_crawler_process = False
+    default_settings = {'LOG_LEVEL': 'WARNING'}
+
+    def syntax(self):
+        return "[options]"
+
+    def short_desc(self):
+        return "Reconstruit les statistiques par catégorie à partir de la collection des produits"
+
+    def add_options(self, parser):
+        super().add_options(parser)
+        parser.add_argument('--batch-size', type=int, default=1000, help='Taille des lots de lecture et d\'écriture')
+
+    def run(self, args, opts):
+        settings = self.settings
+        collection_name = settings.get('MONGO_CATEGORY_STATS_COLLECTION')
+        if not collection_name:
+            raise UsageError("MONGO_CATEGORY_STATS_COLLECTION est vide")
+        client = pymongo.MongoClient(settings.get('MONGO_URI'), serverSelectionTimeoutMS=5000)
+        try:
+            db = client[settings.get('MONGO_DATABASE', 'ikea_db')]
+            start = time.monotonic()
+            products, categories = rebuild(
+                db[settings.get('MONGO_COLLECTION', 'products')], db[collection_name], batch_size=opts.batch_size
+            )
+        finally:
+            client.close()
+        print(f"{products} produits lus, {categories} catégories écrites dans {collection_name} "
+              f"en {time.monotonic() - start:.1f} s")
@@ -0,0 +1,168 @@
+import hashlib
+import math
+import mmap
+import os
+import struct
+
+from scrapy.exceptions import DropItem
+
+# En-tête du fichier : signature, nombre de cases de la table, nombre de clés, taille du filtre de Bloom (bits)
+MAGIC = b'IKDEDUP1'
+HEADER = struct.Struct('<8sQQQ')
+SLOT = struct.Struct('<Q')
+# Taux de remplissage maximal de la table avant doublement
+MAX_LOAD = 0.7
+
+
+class DuplicateItem(DropItem):
+    """Item écarté car son produit a déjà été vu pendant le crawl (abandon volontaire)."""
+
+
+def item_key(item):
+    """Clé de déduplication d'un item : product_id, à défaut l'URL de la page."""
+    return item.get('product_id') or item.get('url')
+
+
+def key_hash(key):
+    """Empreinte 64 bits d'une clé (0 est réservé aux cases vides)."""
+    value = int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little')
+    return value or 1
+
+
+class FingerprintSet:
+    """
+    Ensemble d'empreintes 64 bits stocké dans un fichier projeté en mémoire (mmap).
+
+    Les clés ne sont pas conservées, seulement leur empreinte blake2b sur 64 bits,
+    dans une table à adressage ouvert (sondage linéaire) : environ 14 octets par
+    clé au taux de remplissage maximal (table et filtre de Bloom compris), quelle
+    que soit la longueur de l'URL. Un filtre de Bloom optionnel
+    (`bloom_bits_per_key` bits par case) placé devant la table répond aux clés
+    inconnues sans parcourir la table. Un fichier existant est rouvert tel quel
+    (clear() le vide) ; il double de taille quand la table dépasse MAX_LOAD.
+    """
+
+    def __init__(self, path, capacity=1 << 20, bloom_bits_per_key=10):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        if not os.path.exists(path) or os.path.getsize(path) < HEADER.size:
+            # Table de taille puissance de deux : l'index de case est un simple masque
+            capacity = 1 << max(capacity - 1, 1).bit_length()
+            bloom_bits = capacity * bloom_bits_per_key
+            bloom_bits += -bloom_bits % 64
+            self._create(path, capacity, bloom_bits)
+        self._open()
+
+    @staticmethod
+    def _create(path, capacity, bloom_bits):
+        with open(path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, capacity, 0, bloom_bits))
+            f.truncate(HEADER.size + bloom_bits // 8 + capacity * SLOT.size)
+
+    def _open(self):
+        self.file = open(self.path, 'r+b')
+        self.mm = mmap.mmap(self.file.fileno(), 0)
+        magic, self.capacity, self.count, self.bloom_bits = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} n'est pas un fichier d'empreintes")
+        self.mask = self.capacity - 1
+        self.bloom_offset = HEADER.size
+        self.table_offset = HEADER.size + self.bloom_bits // 8
+        # Nombre de fonctions de hachage optimal pour le nombre de bits par case
+        self.bloom_hashes = max(1, round(self.bloom_bits / self.capacity * math.log(2))) if self.bloom_bits else 0
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, key):
+        value = key_hash(key)
+        if self.bloom_bits and not self._bloom_contains(value):
+            return False
+        return self._probe(value)[1]
+
+    def add(self, key):
+        """Ajoute la clé ; renvoie False si elle était déjà présente."""
+        value = key_hash(key)
+        if self.bloom_bits and not self._bloom_contains(value):
+            index = self._probe(value)[0]
+        else:
+            index, found = self._probe(value)
+            if found:
+                return False
+        if self.count + 1 > self.capacity * MAX_LOAD:
+            self._grow()
+            index = self._probe(value)[0]
+        self._insert(index, value)
+        return True
+
+    @property
+    def nbytes(self):
+        return len(self.mm)
+
+    def flush(self):
+        self.mm.flush()
+
+    def clear(self):
+        """Vide l'ensemble en conservant sa capacité actuelle."""
+        capacity, bloom_bits = self.capacity, self.bloom_bits
+        self.close()
+        self._create(self.path, capacity, bloom_bits)
+        self._open()
+
+    def close(self):
+        self.mm.flush()
+        self.mm.close()
+        self.file.close()
+
+    def _probe(self, value):
+        """Renvoie (case, trouvé) : la case qui contient l'empreinte ou la première case vide."""
+        index = value & self.mask
+        while True:
+            current = SLOT.unpack_from(self.mm, self.table_offset + index * SLOT.size)[0]
+            if current == 0:
+                return index, False
+            if current == value:
+                return index, True
+            index = (index + 1) & self.mask
+
+    def _insert(self, index, value):
+        SLOT.pack_into(self.mm, self.table_offset + index * SLOT.size, value)
+        if self.bloom_bits:
+            for bit in self._bloom_positions(value):
+                position = self.bloom_offset + bit // 8
+                self.mm[position] |= 1 << (bit % 8)
+        self.count += 1
+        struct.pack_into('<Q', self.mm, 16, self.count)
+
+    def _bloom_positions(self, value):
+        # Double hachage : les deux moitiés de l'empreinte 64 bits
+        low, high = value & 0xFFFFFFFF, (value >> 32) | 1
+        for i in range(self.bloom_hashes):
+            yield (low + i * high) % self.bloom_bits
+
+    def _bloom_contains(self, value):
+        mm, offset = self.mm, self.bloom_offset
+        for bit in self._bloom_positions(value):
+            if not mm[offset + bit // 8] & (1 << (bit % 8)):
+                return False
+        return True
+
+    def _grow(self):
+        """Double la table dans un nouveau fichier puis remplace l'ancien."""
+        capacity = self.capacity * 2
+        bloom_bits = self.bloom_bits * 2
+        tmp_path = self.path + '.tmp'
+        self._create(tmp_path, capacity, bloom_bits)
+        grown = FingerprintSet.__new__(FingerprintSet)
+        grown.path = tmp_path
+        grown._open()
+        for index in range(self.capacity):
+            value = SLOT.unpack_from(self.mm, self.table_offset + index * SLOT.size)[0]
+            if value:
+                grown._insert(grown._probe(value)[0], value)
+        grown.close()
+        self.close()
+        os.replace(tmp_path, self.path)
+        self._open()
@@ -0,0 +1,271 @@
+import json
+import time
+
+from elasticsearch import helpers
+from twisted.internet import defer, task, threads
+
+# Codes HTTP pour lesquels un document refusé mérite d'être renvoyé plus tard
+RETRYABLE_STATUSES = {429, 502, 503, 504}
+
+
+class BulkIndexer:
+    """
+    Tampon d'actions bulk pour Elasticsearch.
+
+    Les actions sont accumulées puis envoyées en une seule requête dès que
+    l'un des seuils est atteint : nombre de documents, taille estimée du
+    payload ou délai depuis le dernier envoi. Les documents refusés pour une
+    raison transitoire (429, 5xx, erreur réseau) sont remis dans le tampon
+    avec un délai exponentiel, au lieu d'être simplement journalisés.
+
+    Avec `threaded`, les envois déclenchés par add() et flush_if_due() passent
+    par flush_in_thread() : la requête bulk ne bloque plus le reactor pendant
+    le crawl. Sans reactor (loader du spool), les envois restent synchrones.
+    Pendant un envoi (ou les délais de retry d'un cluster lent ou indisponible),
+    le tampon continue de grossir : au-delà de deux fois `max_docs` ou
+    `max_bytes` (overloaded()), l'appelant attend wait_for_capacity() avant
+    d'ajouter d'autres actions.
+
+    Les actions ajoutées ensemble par extend() peuvent porter une étiquette
+    (l'URL de la page produit) : `on_stored` reçoit après chaque envoi les
+    étiquettes dont toutes les actions ont été indexées. Une étiquette dont une
+    action est abandonnée n'est jamais acquittée.
+    """
+
+    def __init__(self, es, max_docs=500, max_bytes=5 * 1024 * 1024, max_interval=5.0,
+                 max_retries=3, retry_backoff=1.0, logger=None, stats=None, stats_prefix='es_bulk', on_flush=None,
+                 threaded=False, on_stored=None):
+        self.es = es
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.max_interval = max_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.logger = logger
+        self.stats = stats
+        self.stats_prefix = stats_prefix
+        # Appelé avec le nombre de documents indexés après chaque envoi qui en a indexé au moins un
+        self.on_flush = on_flush
+        self.threaded = threaded
+        self.on_stored = on_stored
+        # Étiquette -> nombre d'actions pas encore indexées
+        self.tags = {}
+        # Deferred de l'envoi en cours dans le pool de threads (flush_in_thread)
+        self.in_flight = None
+
+        # Chaque entrée : [action, taille estimée, nombre de tentatives, pas avant (timestamp), étiquette]
+        self.buffer = []
+        self.buffer_bytes = 0
+        self.last_flush = time.monotonic()
+
+        self.flush_count = 0
+        self.docs_indexed = 0
+        # Documents indexés par index cible (une génération vide n'est pas promue)
+        self.indexed_by_index = {}
+        self.docs_failed = 0
+        self.total_flush_time = 0.0
+
+    def add(self, action):
+        """Ajoute une action au tampon et déclenche un envoi si un seuil est atteint."""
+        self.extend([action])
+
+    def extend(self, actions, tag=None):
+        """Ajoute plusieurs actions (celles d'un même item) avant de vérifier les seuils."""
+        for action in actions:
+            size = len(json.dumps(action, default=str).encode('utf-8'))
+            self.buffer.append([action, size, 0, 0.0, tag])
+            self.buffer_bytes += size
+            if tag is not None:
+                self.tags[tag] = self.tags.get(tag, 0) + 1
+        if len(self.buffer) >= self.max_docs or self.buffer_bytes >= self.max_bytes:
+            self._start_flush()
+
+    def flush_if_due(self):
+        """Envoie le tampon si le délai maximal depuis le dernier envoi est dépassé."""
+        if self.buffer and time.monotonic() - self.last_flush >= self.max_interval:
+            self._start_flush()
+
+    def overloaded(self):
+        """Vrai si le tampon dépasse deux fois l'un des seuils d'envoi."""
+        return len(self.buffer) >= 2 * self.max_docs or self.buffer_bytes >= 2 * self.max_bytes
+
+    @defer.inlineCallbacks
+    def wait_for_capacity(self):
+        """Deferred déclenché quand le tampon repasse sous deux fois les seuils (envois dans le pool de threads)."""
+        from twisted.internet import reactor
+
+        while self.overloaded():
+            if self.in_flight is not None:
+                yield self.in_flight
+                continue
+            wait = self.retry_wait()
+            if wait > 0:
+                yield task.deferLater(reactor, wait, lambda: None)
+            yield self.flush_in_thread()
+
+    def retry_wait(self):
+        """Secondes avant que la prochaine action du tampon soit prête (0 si l'une l'est déjà)."""
+        if not self.buffer:
+            return 0.0
+        return max(min(entry[3] for entry in self.buffer) - time.monotonic(), 0.0)
+
+    def flush(self):
+        """Envoie toutes les actions prêtes (hors attente de retry) en une requête bulk, dans le thread courant."""
+        ready = self._take_ready()
+        if not ready:
+            return
+        start = time.monotonic()
+        self._handle_results(self._send(ready), ready, start)
+
+    def flush_in_thread(self):
+        """
+        Comme flush(), mais la requête bulk est envoyée depuis le pool de threads
+        du reactor ; renvoie un Deferred. Un seul envoi à la fois : pendant qu'il
+        est en cours, les nouvelles actions attendent dans le tampon.
+        """
+        if self.in_flight is not None:
+            return self.in_flight
+        ready = self._take_ready()
+        if not ready:
+            return defer.succeed(None)
+        start = time.monotonic()
+        d = threads.deferToThread(self._send, ready)
+        d.addCallback(self._handle_results, ready, start)
+        d.addErrback(self._flush_failed)
+        d.addBoth(self._flush_done)
+        self.in_flight = d
+        return d
+
+    def close(self):
+        """Vide complètement le tampon, en attendant les délais de retry si nécessaire."""
+        while self.buffer:
+            wait = self.retry_wait()
+            if wait > 0:
+                time.sleep(wait)
+            self.flush()
+        self.report()
+
+    @defer.inlineCallbacks
+    def close_in_thread(self):
+        """Comme close(), sans bloquer le reactor : envois dans un thread, délais de retry par deferLater."""
+        from twisted.internet import reactor
+
+        while self.buffer or self.in_flight is not None:
+            if self.in_flight is not None:
+                yield self.in_flight
+                continue
+            wait = self.retry_wait()
+            if wait > 0:
+                yield task.deferLater(reactor, wait, lambda: None)
+            yield self.flush_in_thread()
+        self.report()
+
+    def _start_flush(self):
+        if self.threaded:
+            self.flush_in_thread()
+        else:
+            self.flush()
+
+    def _take_ready(self):
+        # Exécuté dans le thread du reactor : le tampon n'est jamais modifié depuis un autre thread
+        now = time.monotonic()
+        self.last_flush = now
+        ready = [entry for entry in self.buffer if entry[3] <= now]
+        if ready:
+            self.buffer = [entry for entry in self.buffer if entry[3] > now]
+            self.buffer_bytes = sum(entry[1] for entry in self.buffer)
+        return ready
+
+    def _send(self, ready):
+        # Seule étape exécutée hors du reactor par flush_in_thread() : ne touche qu'au client Elasticsearch
+        try:
+            # streaming_bulk renvoie un résultat par action, dans l'ordre d'envoi
+            return list(helpers.streaming_bulk(
+                self.es,
+                (entry[0] for entry in ready),
+                chunk_size=len(ready),
+                raise_on_error=False,
+                raise_on_exception=False,
+            ))
+        except Exception as e:
+            # Erreur hors requête (sérialisation...) : tout le lot est traité comme un échec transitoire
+            return [(False, {'index': {'status': None, 'error': str(e)}})] * len(ready)
+
+    def _handle_results(self, results, ready, start):
+        retry = []
+        indexed = 0
+        stored = []
+        for entry, (ok, info) in zip(ready, results):
+            if ok:
+                indexed += 1
+                index_name = entry[0].get('_index')
+                self.indexed_by_index[index_name] = self.indexed_by_index.get(index_name, 0) + 1
+                tag = entry[4]
+                if tag is not None and tag in self.tags:
+                    self.tags[tag] -= 1
+                    if not self.tags[tag]:
+                        del self.tags[tag]
+                        stored.append(tag)
+                continue
+            status = next(iter(info.values()), {}).get('status') if isinstance(info, dict) else None
+            transient = status in RETRYABLE_STATUSES or status == 'N/A' or status is None
+            if transient and entry[2] < self.max_retries:
+                entry[2] += 1
+                entry[3] = time.monotonic() + self.retry_backoff * (2 ** (entry[2] - 1))
+                retry.append(entry)
+            else:
+                self.docs_failed += 1
+                self._inc('docs_failed')
+                # Item incomplet dans l'index : jamais acquitté
+                self.tags.pop(entry[4], None)
+                if self.logger:
+                    self.logger.error(f"[BulkIndexer] Document abandonné après {entry[2]} tentative(s): {info}")
+        elapsed = time.monotonic() - start
+
+        self.buffer.extend(retry)
+        self.buffer_bytes += sum(entry[1] for entry in retry)
+        self.flush_count += 1
+        self.docs_indexed += indexed
+        self.total_flush_time += elapsed
+        self._inc('flushes')
+        self._inc('docs_indexed', indexed)
+        if retry:
+            self._inc('docs_retried', len(retry))
+        if self.stats is not None:
+            self.stats.max_value(f'{self.stats_prefix}/flush_latency_max', round(elapsed, 4))
+        if indexed and self.on_flush:
+            self.on_flush(indexed)
+        if stored and self.on_stored:
+            self.on_stored(stored)
+        if self.logger:
+            rate = indexed / elapsed if elapsed > 0 else 0.0
+            self.logger.debug(
+                f"[BulkIndexer] Flush de {len(ready)} actions en {elapsed * 1000:.1f} ms "
+                f"({rate:.0f} docs/s, {len(retry)} à réessayer)"
+            )
+
+    def _flush_failed(self, failure):
+        # Personne n'attend le Deferred d'un envoi déclenché par add() : l'erreur est journalisée ici
+        if self.logger:
+            self.logger.error(f"[BulkIndexer] Erreur lors de l'envoi bulk: {failure.value}")
+
+    def _flush_done(self, result):
+        self.in_flight = None
+        return result
+
+    def report(self):
+        """Publie la latence moyenne des flushs et le débit dans les stats du crawl."""
+        avg_latency = self.total_flush_time / self.flush_count if self.flush_count else 0.0
+        rate = self.docs_indexed / self.total_flush_time if self.total_flush_time > 0 else 0.0
+        if self.stats is not None:
+            self.stats.set_value(f'{self.stats_prefix}/flush_latency_avg', round(avg_latency, 4))
+            self.stats.set_value(f'{self.stats_prefix}/docs_per_second', round(rate, 1))
+        if self.logger:
+            self.logger.info(
+                f"[BulkIndexer] {self.docs_indexed} documents indexés en {self.flush_count} flushs, "
+                f"latence moyenne {avg_latency * 1000:.1f} ms, {rate:.0f} docs/s, {self.docs_failed} échecs"
+            )
+
+    def _inc(self, key, count=1):
+        if self.stats is not None:
+            self.stats.inc_value(f'{self.stats_prefix}/{key}', count)
@@ -0,0 +1,68 @@
+import time
+
+# Réglages appliqués pendant le chargement : pas de refresh ni de réplique
+BULK_LOAD_SETTINGS = {"refresh_interval": "-1", "number_of_replicas": 0}
+
+
+class IndexGenerations:
+    """
+    Gère des index Elasticsearch versionnés derrière un alias.
+
+    Chaque crawl écrit dans un nouvel index `<alias>_<timestamp>` ; l'alias
+    n'est basculé vers lui qu'une fois le chargement terminé, par un seul
+    appel `update_aliases` atomique. Les lecteurs (app.py) interrogent
+    l'alias et ne voient donc jamais un index à moitié construit.
+    """
+
+    def __init__(self, es, alias, keep=1, replicas=1, logger=None):
+        self.es = es
+        self.alias = alias
+        # Nombre d'anciennes générations conservées (retour arrière possible)
+        self.keep = keep
+        self.replicas = replicas
+        self.logger = logger
+
+    def create(self, body):
+        """Crée une nouvelle génération avec le mapping donné et les réglages de chargement."""
+        index_name = f"{self.alias}_{time.strftime('%Y%m%d%H%M%S')}"
+        body = dict(body)
+        body["settings"] = {**body.get("settings", {}), "index": BULK_LOAD_SETTINGS}
+        self.es.indices.create(index=index_name, body=body)
+        self._log(f"Nouvelle génération d'index créée : {index_name}")
+        return index_name
+
+    def promote(self, index_name):
+        """Rétablit les réglages de lecture puis bascule l'alias atomiquement vers `index_name`."""
+        self.es.indices.put_settings(index=index_name, body={
+            "index": {"refresh_interval": "1s", "number_of_replicas": self.replicas}
+        })
+        self.es.indices.refresh(index=index_name)
+
+        actions = [{"add": {"index": index_name, "alias": self.alias}}]
+        for current in self.current_indices():
+            if current != index_name:
+                actions.append({"remove": {"index": current, "alias": self.alias}})
+        # Ancien index « en dur » portant le nom de l'alias : supprimé dans la même opération
+        if self.es.indices.exists(index=self.alias) and not self.es.indices.exists_alias(name=self.alias):
+            actions.append({"remove_index": {"index": self.alias}})
+        self.es.indices.update_aliases(body={"actions": actions})
+        self._log(f"Alias {self.alias} basculé vers {index_name}")
+
+    def current_indices(self):
+        """Index actuellement désignés par l'alias."""
+        if not self.es.indices.exists_alias(name=self.alias):
+            return []
+        return list(self.es.indices.get_alias(name=self.alias).keys())
+
+    def cleanup(self):
+        """Supprime les générations hors alias au-delà des `keep` plus récentes."""
+        generations = sorted(self.es.indices.get(index=f"{self.alias}_*").keys(), reverse=True)
+        live = set(self.current_indices())
+        stale = [name for name in generations if name not in live]
+        for name in stale[self.keep:]:
+            self.es.indices.delete(index=name)
+            self._log(f"Ancienne génération supprimée : {name}")
+
+    def _log(self, message):
+        if self.logger:
+            self.logger.info(f"[IndexGenerations] {message}")
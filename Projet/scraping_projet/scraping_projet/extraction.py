@@ -0,0 +1,326 @@
+"""
+Extraction des champs d'une page produit IKEA.
+
+`extract_product` construit l'arbre lxml une seule fois et relève tous les
+champs en un seul parcours (événements start/end), au lieu d'une quinzaine
+de requêtes `response.css(...)`. Quand la page embarque des données
+structurées (JSON-LD `Product`), le prix, la note et le nombre d'avis en
+sont tirés en priorité. `extract_product_css` conserve l'ancienne
+implémentation par sélecteurs CSS, utilisée comme référence par le
+benchmark `scrapy bench_extract`.
+"""
+import json
+import re
+
+from lxml import etree
+
+PRICE_RE = re.compile(r'(\d+,\d+)')
+OFFER_RE = re.compile(r'(\d+)%')
+RATING_RE = re.compile(r'Avis:\s*([\d,\.]+)')
+REVIEW_COUNT_RE = re.compile(r'Nombre total d\'avis:\s*(\d+)')
+
+# Sélecteurs d'image par ordre de priorité (même ordre que l'ancienne implémentation)
+IMAGE_CONTAINERS = (
+    'pipf-product-gallery__thumbnail--active',
+    'pipf-product-gallery__media--active',
+    'pip-media-grid__media-container',
+)
+
+_HTML_PARSER = etree.HTMLParser(recover=True, encoding='utf8')
+
+
+def _classes(element):
+    value = element.get('class')
+    return set(value.split()) if value else ()
+
+
+def _direct_texts(element):
+    """Équivalent de `::text` : texte propre de l'élément puis queues de ses enfants."""
+    texts = [element.text] if element.text is not None else []
+    for child in element:
+        if child.tail is not None:
+            texts.append(child.tail)
+    return texts
+
+
+def _first_text(elements):
+    for element in elements:
+        texts = _direct_texts(element)
+        if texts:
+            return texts[0]
+    return None
+
+
+def _commercial_messages(parts, lowest_price, offer_message):
+    commercial_messages = [part.strip() for part in parts if part.strip()]
+    # Vérifie si le prix est mis en valeur (balise <em>) pour ajouter "Prix le plus bas"
+    if lowest_price and not any('Prix le plus bas' in msg for msg in commercial_messages):
+        commercial_messages.append('Prix le plus bas')
+    if offer_message:
+        match = OFFER_RE.search(offer_message)
+        if match:
+            commercial_messages.append(f"Réduction {match.group(1)}%")
+    # Nettoie les doublons et espaces
+    return list(dict.fromkeys([msg.strip() for msg in commercial_messages if msg.strip()]))
+
+
+def _price(price_texts):
+    for text in price_texts:
+        if text.strip().startswith('Prix'):
+            match = PRICE_RE.search(text)
+            return float(match.group(1).replace(',', '.')) if match else 0.0
+    return 0.0
+
+
+def _image(images):
+    # Même logique de repli que l'ancienne implémentation : on passe au sélecteur suivant si vide
+    image_url = None
+    for name in IMAGE_CONTAINERS:
+        image_url = images.get(name)
+        if image_url:
+            break
+    return image_url
+
+
+def _rating(rating_text):
+    if rating_text:
+        match = RATING_RE.search(rating_text)
+        if match:
+            return float(match.group(1).replace(',', '.'))
+    return 0.0
+
+
+def _review_count(review_count_text, rating_text):
+    if review_count_text:
+        try:
+            return int(review_count_text.strip('()'))
+        except (ValueError, TypeError):
+            return 0
+    # Si le sélecteur principal échoue, on essaie de l'extraire de l'aria-label
+    if rating_text:
+        match = REVIEW_COUNT_RE.search(rating_text)
+        if match:
+            return int(match.group(1))
+    return 0
+
+
+def _structured_product(scripts):
+    """Renvoie le premier objet JSON-LD de type Product, ou None."""
+    for script in scripts:
+        try:
+            data = json.loads(script)
+        except (TypeError, ValueError):
+            continue
+        candidates = data if isinstance(data, list) else [data]
+        for candidate in list(candidates):
+            if isinstance(candidate, dict) and isinstance(candidate.get('@graph'), list):
+                candidates.extend(candidate['@graph'])
+        for candidate in candidates:
+            if isinstance(candidate, dict) and candidate.get('@type') == 'Product':
+                return candidate
+    return None
+
+
+def _apply_structured(fields, product):
+    offers = product.get('offers')
+    if isinstance(offers, list):
+        offers = offers[0] if offers else None
+    if isinstance(offers, dict) and offers.get('price') not in (None, ''):
+        try:
+            fields['price'] = float(str(offers['price']).replace(',', '.'))
+        except ValueError:
+            pass
+    rating = product.get('aggregateRating')
+    if isinstance(rating, dict):
+        try:
+            if rating.get('ratingValue') is not None:
+                fields['rating'] = float(str(rating['ratingValue']).replace(',', '.'))
+            if rating.get('reviewCount') is not None:
+                fields['review_count'] = int(rating['reviewCount'])
+        except ValueError:
+            pass
+
+
+def extract_product(text, url, prefer_structured=True):
+    """
+    Extrait les champs d'une page produit (HTML décodé) en un seul parcours de l'arbre.
+    Renvoie un dict avec les mêmes clés et valeurs que l'ancienne implémentation CSS.
+    """
+    root = etree.fromstring(text.encode('utf8'), parser=_HTML_PARSER)
+
+    commercial_parts = []
+    lowest_price = False
+    offer_spans = []
+    breadcrumb_texts = []
+    name_elements = []
+    description_texts = []
+    price_texts = []
+    images = {}
+    rating_text = None
+    review_label_elements = []
+    scripts = []
+
+    # Compteurs d'ancêtres ouverts pour les sélecteurs descendants
+    open_count = {
+        'price_package': 0, 'commercial': 0, 'offer': 0, 'breadcrumb_ol': 0, 'breadcrumb_li': 0,
+        'breadcrumb_a': 0, 'h1': 0, 'description': 0, 'rating': 0,
+    }
+    image_open = {name: 0 for name in IMAGE_CONTAINERS}
+    # Pile des marqueurs ouverts par chaque élément, pour les refermer à l'événement end
+    stack = []
+
+    if root is None:
+        root_iter = ()
+    else:
+        root_iter = etree.iterwalk(root, events=('start', 'end'))
+    for event, element in root_iter:
+        if event == 'end':
+            opened = stack.pop()
+            tail = element.tail
+            if tail is not None:
+                # La queue appartient au parent : elle compte si le parent est dans la zone
+                if open_count['commercial'] - ('commercial' in opened) > 0:
+                    commercial_parts.append(tail)
+                if open_count['description'] - ('description' in opened) > 0:
+                    description_texts.append(tail)
+            for marker in opened:
+                if marker in open_count:
+                    open_count[marker] -= 1
+                else:
+                    image_open[marker] -= 1
+            continue
+
+        opened = []
+        if not isinstance(element.tag, str):
+            # Commentaire ou instruction : seul son texte de queue compte (traité à l'événement end)
+            stack.append(opened)
+            continue
+        tag = element.tag
+        classes = _classes(element)
+
+        if tag == 'script':
+            if element.get('type') == 'application/ld+json' and element.text:
+                scripts.append(element.text)
+        elif tag == 'div':
+            if 'pipf-price-package' in classes:
+                opened.append('price_package')
+            if 'pipcom-commercial-message' in classes and open_count['price_package']:
+                opened.append('commercial')
+            if 'pipcom-price-module__offer-message' in classes:
+                opened.append('offer')
+            for name in IMAGE_CONTAINERS:
+                if name in classes:
+                    opened.append(name)
+        elif tag == 'em':
+            if 'pipcom-price' in classes and open_count['price_package']:
+                lowest_price = True
+        elif tag == 'ol':
+            if 'hnf-breadcrumb__list' in classes:
+                opened.append('breadcrumb_ol')
+        elif tag == 'li':
+            if 'hnf-breadcrumb__list-item' in classes and open_count['breadcrumb_ol']:
+                opened.append('breadcrumb_li')
+        elif tag == 'a':
+            if open_count['breadcrumb_li']:
+                opened.append('breadcrumb_a')
+        elif tag == 'h1':
+            opened.append('h1')
+        elif tag == 'span':
+            if open_count['breadcrumb_a']:
+                breadcrumb_texts.extend(_direct_texts(element))
+            if 'pipcom-typography-label-l' in classes and open_count['offer']:
+                offer_spans.append(element)
+        elif tag == 'img':
+            src = element.get('src')
+            if src is not None:
+                for name in IMAGE_CONTAINERS:
+                    if image_open[name] and name not in images:
+                        images[name] = src
+
+        # Classes valables quel que soit le nom de balise
+        if classes:
+            if open_count['h1']:
+                if 'pipcom-price-module__name-decorator' in classes:
+                    name_elements.append(element)
+                if 'pipcom-price-module__description' in classes:
+                    opened.append('description')
+            if 'pipcom-price__sr-text' in classes:
+                price_texts.extend(_direct_texts(element))
+            if 'pipf-rating' in classes:
+                opened.append('rating')
+            if 'pipf-rating__stars' in classes and open_count['rating'] and rating_text is None:
+                rating_text = element.get('aria-label')
+            if 'pipf-rating__label' in classes:
+                review_label_elements.append(element)
+
+        # Texte propre de l'élément
+        if element.text is not None:
+            if open_count['commercial'] or 'commercial' in opened:
+                commercial_parts.append(element.text)
+            if open_count['description'] or 'description' in opened:
+                description_texts.append(element.text)
+
+        for marker in opened:
+            if marker in open_count:
+                open_count[marker] += 1
+            else:
+                image_open[marker] += 1
+        stack.append(opened)
+
+    name = _first_text(name_elements)
+    review_count_text = _first_text(review_label_elements)
+    rating_text_value = rating_text
+    fields = {
+        'commercial_message': _commercial_messages(commercial_parts, lowest_price, _first_text(offer_spans)),
+        'category_hierarchy': [cat.strip() for cat in breadcrumb_texts if cat.strip()],
+        'name': (name or '').strip(),
+        'description': ' '.join(part.strip() for part in description_texts if part.strip()),
+        'price': _price(price_texts),
+        'image_url': _image(images),
+        'rating': _rating(rating_text_value),
+        'review_count': _review_count(review_count_text, rating_text_value),
+        'url': url,
+    }
+    if prefer_structured and scripts:
+        product = _structured_product(scripts)
+        if product:
+            _apply_structured(fields, product)
+    return fields
+
+
+def extract_product_css(response):
+    """
+    Ancienne extraction par sélecteurs CSS (une requête par champ), conservée comme
+    référence pour vérifier que `extract_product` produit les mêmes valeurs.
+    """
+    # Message commercial (ex: "Nouveau", "Prix le plus bas")
+    commercial_message_element = response.css('div.pipf-price-package div.pipcom-commercial-message')
+    commercial_parts = commercial_message_element.css('::text').getall() if commercial_message_element else []
+    lowest_price = bool(response.css('div.pipf-price-package em.pipcom-price'))
+    offer_message = response.css('div.pipcom-price-module__offer-message span.pipcom-typography-label-l::text').get()
+
+    # Hiérarchie des catégories depuis le fil d'Ariane
+    breadcrumb_links = response.css('ol.hnf-breadcrumb__list li.hnf-breadcrumb__list-item a span::text').getall()
+
+    description_parts = response.css('h1 .pipcom-price-module__description *::text').getall()
+
+    # URL de l'image principale - première image de la galerie produit, puis sélecteurs de repli
+    image_url = response.css('div.pipf-product-gallery__thumbnail--active img::attr(src)').get()
+    if not image_url:
+        image_url = response.css('div.pipf-product-gallery__media--active img::attr(src)').get()
+    if not image_url:
+        image_url = response.css('div.pip-media-grid__media-container img::attr(src)').get()
+
+    rating_text = response.css('.pipf-rating .pipf-rating__stars::attr(aria-label)').get()
+
+    return {
+        'commercial_message': _commercial_messages(commercial_parts, lowest_price, offer_message),
+        'category_hierarchy': [cat.strip() for cat in breadcrumb_links if cat.strip()],
+        'name': response.css('h1 .pipcom-price-module__name-decorator::text').get(default='').strip(),
+        'description': ' '.join(part.strip() for part in description_parts if part.strip()),
+        'price': _price(response.css('.pipcom-price__sr-text::text').getall()),
+        'image_url': image_url,
+        'rating': _rating(rating_text),
+        'review_count': _review_count(response.css('.pipf-rating__label::text').get(), rating_text),
+        'url': response.url,
+    }
@@ -0,0 +1,89 @@
+"""
+Extraction des pages produit dans un pool de processus.
+
+Les callbacks Scrapy s'exécutent tous sur le thread du réacteur Twisted :
+le parsing HTML n'utilise donc qu'un cœur. En mode pool (EXTRACTION_PROCESSES > 0),
+le corps brut de la réponse est envoyé à un processus de travail qui exécute
+`extract_product` et renvoie le dict des champs.
+
+Contre-pression : au plus `max_pending` pages sont confiées au pool en même
+temps. Au-delà, le callback attend une place ; sa réponse reste comptée dans
+le slot du scraper, et Scrapy cesse de lancer de nouveaux téléchargements dès
+que SCRAPER_SLOT_MAX_ACTIVE_SIZE est dépassé.
+"""
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from twisted.internet import defer
+from scrapy.utils.defer import maybe_deferred_to_future
+
+from .extraction import extract_product
+
+
+def extract_product_body(body, encoding, url):
+    """Point d'entrée des processus de travail : décode le corps puis extrait les champs."""
+    return extract_product(body.decode(encoding, errors='replace'), url)
+
+
+class ExtractionPool:
+
+    def __init__(self, processes, max_pending=0, crawler=None, stats_prefix='extraction_pool'):
+        self.processes = processes
+        # Par défaut deux pages par processus : une en cours, une prête à démarrer
+        self.max_pending = max_pending or 2 * processes
+        # Les stats du crawler ne sont disponibles qu'une fois le crawl démarré : lues à la demande
+        self.crawler = crawler
+        self.stats_prefix = stats_prefix
+        # spawn : les processus de travail ne doivent pas hériter du réacteur du processus principal
+        self.executor = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'))
+        self.semaphore = defer.DeferredSemaphore(self.max_pending)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(
+            crawler.settings.getint('EXTRACTION_PROCESSES'),
+            crawler.settings.getint('EXTRACTION_MAX_PENDING', 0),
+            crawler=crawler,
+        )
+
+    async def extract(self, response):
+        """Renvoie le dict des champs de la page produit, calculé par un processus du pool."""
+        if self.semaphore.tokens == 0:
+            self._inc('backpressure_waits')
+            start = time.monotonic()
+            await maybe_deferred_to_future(self.semaphore.acquire())
+            self._inc('backpressure_wait_time', time.monotonic() - start)
+        else:
+            await maybe_deferred_to_future(self.semaphore.acquire())
+        try:
+            future = self.executor.submit(extract_product_body, response.body, response.encoding, response.url)
+            fields = await maybe_deferred_to_future(self._deferred(future))
+        finally:
+            self.semaphore.release()
+        self._inc('pages')
+        return fields
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def _deferred(self, future):
+        # Le callback du futur s'exécute dans un thread de l'exécuteur : retour au réacteur
+        from twisted.internet import reactor
+
+        d = defer.Deferred()
+
+        def resolve(done):
+            if done.cancelled():
+                d.cancel()
+            elif done.exception() is not None:
+                d.errback(done.exception())
+            else:
+                d.callback(done.result())
+
+        future.add_done_callback(lambda done: reactor.callFromThread(resolve, done))
+        return d
+
+    def _inc(self, key, value=1):
+        if self.crawler is not None:
+            self.crawler.stats.inc_value(f'{self.stats_prefix}/{key}', value)
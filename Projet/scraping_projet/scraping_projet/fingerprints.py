@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+# Champs exclus de l'empreinte : les avis ont leur propre filigrane (submissionOn le plus récent)
+FINGERPRINT_EXCLUDED_FIELDS = ('reviews', 'reviews_watermark')
+
+
+def content_hash(item):
+    """Empreinte SHA-1 des champs extraits d'une page produit."""
+    fields = {key: value for key, value in dict(item).items() if key not in FINGERPRINT_EXCLUDED_FIELDS}
+    return hashlib.sha1(json.dumps(fields, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def parse_review_date(value):
+    """Convertit une date ISO 8601 de l'API des avis en datetime, ou None."""
+    if not isinstance(value, str) or not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+
+
+def newest_submission(reviews):
+    """Renvoie la valeur `submissionOn` la plus récente d'une liste d'avis."""
+    newest, newest_date = None, None
+    for review in reviews or []:
+        value = review.get('submissionOn')
+        date = parse_review_date(value)
+        if date is not None and (newest_date is None or date > newest_date):
+            newest, newest_date = value, date
+    return newest
+
+
+class FingerprintStore:
+    """
+    Empreintes par URL persistées dans un fichier SQLite local.
+
+    Pour chaque page produit on conserve l'ETag et le Last-Modified renvoyés
+    par le serveur, l'empreinte des champs extraits et le `submissionOn` de
+    l'avis le plus récent. Le crawl incrémental s'en sert pour envoyer des
+    requêtes conditionnelles, ignorer les produits inchangés et ne demander
+    que les avis postérieurs au filigrane.
+    """
+
+    def __init__(self, path, commit_every=500):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.commit_every = commit_every
+        self.pending_writes = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS fingerprints ("
+            " url TEXT PRIMARY KEY,"
+            " etag TEXT,"
+            " last_modified TEXT,"
+            " content_hash TEXT,"
+            " review_watermark TEXT,"
+            " updated_at REAL)"
+        )
+        self.conn.commit()
+
+    def get(self, url):
+        row = self.conn.execute(
+            "SELECT etag, last_modified, content_hash, review_watermark FROM fingerprints WHERE url = ?", (url,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {'etag': row[0], 'last_modified': row[1], 'content_hash': row[2], 'review_watermark': row[3]}
+
+    def record_headers(self, url, etag, last_modified):
+        """Mémorise les validateurs HTTP d'une réponse 200."""
+        self._write(
+            "INSERT INTO fingerprints (url, etag, last_modified, updated_at) VALUES (?, ?, ?, ?)"
+            " ON CONFLICT(url) DO UPDATE SET etag = excluded.etag, last_modified = excluded.last_modified,"
+            " updated_at = excluded.updated_at",
+            (url, etag, last_modified, time.time())
+        )
+
+    def record_content(self, url, item_hash, review_watermark):
+        """Mémorise l'empreinte d'un produit traité et le filigrane de ses avis."""
+        self._write(
+            "INSERT INTO fingerprints (url, content_hash, review_watermark, updated_at) VALUES (?, ?, ?, ?)"
+            " ON CONFLICT(url) DO UPDATE SET content_hash = excluded.content_hash,"
+            " review_watermark = COALESCE(excluded.review_watermark, fingerprints.review_watermark),"
+            " updated_at = excluded.updated_at",
+            (url, item_hash, review_watermark, time.time())
+        )
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def _write(self, query, params):
+        self.conn.execute(query, params)
+        self.pending_writes += 1
+        if self.pending_writes >= self.commit_every:
+            self.conn.commit()
+            self.pending_writes = 0
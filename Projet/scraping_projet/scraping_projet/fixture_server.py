@@ -0,0 +1,289 @@
+"""
+Serveur HTTP local qui rejoue un catalogue IKEA pour mesurer le spider hors ligne.
+
+Les pages sont servies depuis un répertoire d'enregistrements si le chemin y
+existe (même arborescence que l'URL, `index.html` pour les pages qui se
+terminent par `/`, `<id>-<page>.json` pour l'API des avis), sinon elles sont
+générées de façon déterministe avec le balisage attendu par `IkeaSpider`.
+
+Lancement autonome :
+    python -m scraping_projet.fixture_server --products 10000 --port 8070
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import random
+import re
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+START_PATH = '/fr/fr/cat/produits-products/'
+REVIEWS_PATH = '/tugc/public/v5/reviews/fr/fr/'
+PRODUCTS_PER_LISTING = 24
+TOP_CATEGORIES = 10
+
+COMMERCIAL_MESSAGES = ['Nouveau', 'Prix le plus bas', 'Offre limitée', 'Meilleure vente']
+SECONDARY_LABELS = ['Qualité du produit', 'Rapport qualité-prix', 'Facilité de montage', 'Apparence']
+
+
+class Catalog:
+    """Catalogue synthétique : catégories principales, pages de liste et produits."""
+
+    def __init__(self, products, reviews_per_product=12, page_kb=150, seed=0):
+        self.products = products
+        self.reviews_per_product = reviews_per_product
+        self.page_kb = page_kb
+        self.seed = seed
+        self.listings = max(1, math.ceil(products / PRODUCTS_PER_LISTING))
+        self.tops = min(TOP_CATEGORIES, self.listings)
+        # Remplissage imitant le poids d'une vraie page produit (scripts, menus, pied de page)
+        self.filler = ''.join(
+            f'<div class="hnf-filler"><span>bloc {i}</span><a href="#l{i}">lien</a></div>'
+            for i in range(page_kb * 1024 // 64)
+        )
+
+    def product_id(self, index):
+        return str(10000000 + index)
+
+    def listing_products(self, listing):
+        start = listing * PRODUCTS_PER_LISTING
+        return range(start, min(start + PRODUCTS_PER_LISTING, self.products))
+
+    def top_listings(self, top):
+        return range(top, self.listings, self.tops)
+
+    def review_total(self, index):
+        rng = random.Random(self.seed * 1000003 + index)
+        return rng.randint(0, self.reviews_per_product * 2)
+
+    def start_page(self):
+        links = ''.join(
+            f'<a class="vn-link vn-nav__link" href="/fr/fr/cat/categorie-{top}/"><span>Catégorie {top}</span></a>'
+            for top in range(self.tops)
+        )
+        return f'<html><body><nav>{links}</nav>{self.filler[:4096]}</body></html>'
+
+    def top_page(self, top):
+        slides = '<div class="hnf-carousel-slide"><a href="/fr/fr/cat/produits-products/"><span>Tous</span></a></div>'
+        slides += ''.join(
+            f'<div class="hnf-carousel-slide"><a href="/fr/fr/cat/liste-{listing}/"><span>Sous-catégorie {listing}</span></a></div>'
+            for listing in self.top_listings(top)
+        )
+        return (
+            '<html><body><div class="plp-navigation-slot-wrapper"><div class="hnf-carousel__wrapper">'
+            f'{slides}</div></div>{self.filler[:8192]}</body></html>'
+        )
+
+    def listing_page(self, listing):
+        cards = ''.join(
+            f'<div class="plp-mastercard"><a class="plp-price-link-wrapper" '
+            f'href="/fr/fr/p/produit-{index}-{self.product_id(index)}/">Produit {index}</a></div>'
+            for index in self.listing_products(listing)
+        )
+        return f'<html><body><div id="product-list">{cards}</div>{self.filler[:16384]}</body></html>'
+
+    def product_page(self, index):
+        rng = random.Random(self.seed * 1000003 + index)
+        reviews = self.review_total(index)
+        top = (index // PRODUCTS_PER_LISTING) % self.tops
+        listing = index // PRODUCTS_PER_LISTING
+        price = f"{rng.randint(5, 900)},{rng.randint(0, 99):02d}"
+        rating = f"{rng.uniform(1, 5):.1f}"
+        message = ''
+        if rng.random() < 0.3:
+            message = f'<div class="pipcom-commercial-message">{rng.choice(COMMERCIAL_MESSAGES)}</div>'
+        lowest = '<em class="pipcom-price">bas</em>' if rng.random() < 0.1 else ''
+        offer = ''
+        if rng.random() < 0.15:
+            offer = (
+                '<div class="pipcom-price-module__offer-message"><span class="pipcom-typography-label-l">'
+                f'{rng.randint(5, 50)}% de réduction, offre valable en magasin</span></div>'
+            )
+        return (
+            '<html><body>'
+            '<ol class="hnf-breadcrumb__list">'
+            '<li class="hnf-breadcrumb__list-item"><a href="/fr/fr/cat/produits-products/"><span>Produits</span></a></li>'
+            f'<li class="hnf-breadcrumb__list-item"><a href="/fr/fr/cat/categorie-{top}/"><span>Catégorie {top}</span></a></li>'
+            f'<li class="hnf-breadcrumb__list-item"><a href="/fr/fr/cat/liste-{listing}/"><span>Sous-catégorie {listing}</span></a></li>'
+            '</ol>'
+            f'<h1><span class="pipcom-price-module__name-decorator">PRODUIT{index}</span>'
+            f'<span class="pipcom-price-module__description"><span>Meuble</span> <span>{rng.randint(40, 200)}x{rng.randint(40, 200)} cm</span></span></h1>'
+            f'<div class="pipf-price-package">{message}{lowest}<span class="pipcom-price__sr-text">Prix {price} €</span></div>'
+            f'{offer}'
+            f'<div class="pipf-product-gallery__thumbnail--active"><img src="https://www.ikea.com/images/{self.product_id(index)}.jpg"></div>'
+            f'<div class="pipf-rating"><span class="pipf-rating__stars" aria-label="Avis: {rating} sur 5 étoiles. Nombre total d\'avis: {reviews}"></span>'
+            f'<span class="pipf-rating__label">({reviews})</span></div>'
+            f'{self.filler}</body></html>'
+        )
+
+    def reviews_page(self, index, number, size):
+        total = self.review_total(index)
+        base = datetime(2024, 1, 1)
+        results = []
+        # Du plus récent au plus ancien, comme avec le tri submissionOn desc de l'API
+        for position in range((number - 1) * size, min(number * size, total)):
+            review_rng = random.Random(index * 100003 + position)
+            submitted = base - timedelta(days=position * 3 + review_rng.randint(0, 2))
+            results.append({
+                "id": f"{self.product_id(index)}-{position}",
+                "text": f"Commentaire {position} : très bon produit, montage facile et solide.",
+                "title": f"Avis {position}",
+                "sourceCountryCode": "FR",
+                "sourceLangCode": "fr",
+                "submissionOn": submitted.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                "updatedOn": submitted.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                "isRecommended": review_rng.random() < 0.8,
+                "primaryRating": {"ratingRange": 5, "ratingValue": review_rng.randint(1, 5)},
+                "secondaryRatings": [
+                    {"id": label, "label": label, "ratingRange": 5, "ratingValue": review_rng.randint(1, 5)}
+                    for label in SECONDARY_LABELS[:2]
+                ],
+            })
+        return {"results": results, "page": {"number": number, "size": size, "totalElements": total}}
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self._simulate():
+            return
+        path = self.path.split('?', 1)[0]
+        recorded = self._recorded(path, 'index.html' if path.endswith('/') else None)
+        if recorded is not None:
+            return self._send(200, recorded, 'text/html; charset=utf-8')
+        catalog = self.server.catalog
+        match = re.match(r'^/fr/fr/p/produit-(\d+)-\d+/$', path)
+        if path == START_PATH:
+            body = catalog.start_page()
+        elif re.match(r'^/fr/fr/cat/categorie-(\d+)/$', path):
+            body = catalog.top_page(int(path.rstrip('/').rsplit('-', 1)[1]))
+        elif re.match(r'^/fr/fr/cat/liste-(\d+)/$', path):
+            body = catalog.listing_page(int(path.rstrip('/').rsplit('-', 1)[1]))
+        elif match and int(match.group(1)) < catalog.products:
+            body = catalog.product_page(int(match.group(1)))
+        else:
+            return self._send(404, b'Not found', 'text/plain')
+        self._send(200, body.encode('utf-8'), 'text/html; charset=utf-8')
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        payload = json.loads(self.rfile.read(length) or b'{}')
+        if self._simulate():
+            return
+        path = self.path.split('?', 1)[0]
+        if not path.startswith(REVIEWS_PATH):
+            return self._send(404, b'Not found', 'text/plain')
+        product_id = path[len(REVIEWS_PATH):].strip('/')
+        page = payload.get('page', {})
+        recorded = self._recorded(path.rstrip('/') + f"-{page.get('number', 1)}.json")
+        if recorded is not None:
+            return self._send(200, recorded, 'application/json')
+        index = int(product_id) - 10000000 if product_id.isdigit() else -1
+        if not 0 <= index < self.server.catalog.products:
+            return self._send(404, b'{}', 'application/json')
+        body = self.server.catalog.reviews_page(index, int(page.get('number', 1)), int(page.get('size', 20)))
+        self._send(200, json.dumps(body).encode('utf-8'), 'application/json')
+
+    def _simulate(self):
+        """Latence et taux d'erreur configurables ; renvoie True si une erreur a été servie."""
+        server = self.server
+        if server.latency > 0:
+            time.sleep(random.uniform(0.5, 1.5) * server.latency)
+        if server.error_rate > 0 and random.random() < server.error_rate:
+            self._send(503, b'Service Unavailable', 'text/plain')
+            return True
+        return False
+
+    def _recorded(self, path, default_name=None):
+        record_dir = self.server.record_dir
+        if not record_dir:
+            return None
+        relative = path.lstrip('/')
+        if default_name:
+            relative = os.path.join(relative, default_name)
+        filename = os.path.normpath(os.path.join(record_dir, relative))
+        if not filename.startswith(os.path.normpath(record_dir)) or not os.path.isfile(filename):
+            return None
+        with open(filename, 'rb') as f:
+            return f.read()
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FixtureServer(ThreadingHTTPServer):
+    # File d'attente des connexions (5 par défaut) : au-delà, les SYN perdus sont réémis après 1, 3, 7... s
+    # et le débit mesuré s'effondre dès que le crawl ouvre plusieurs dizaines de connexions
+    request_queue_size = 1024
+
+
+def make_server(host='127.0.0.1', port=0, products=1000, latency=0.0, error_rate=0.0, record_dir=None,
+                reviews_per_product=12, page_kb=150, seed=0):
+    server = FixtureServer((host, port), FixtureHandler)
+    server.daemon_threads = True
+    server.catalog = Catalog(products, reviews_per_product=reviews_per_product, page_kb=page_kb, seed=seed)
+    server.latency = latency
+    server.error_rate = error_rate
+    server.record_dir = record_dir
+    return server
+
+
+def _serve(connection, kwargs):
+    server = make_server(**kwargs)
+    connection.send(server.server_address[1])
+    connection.close()
+    server.serve_forever()
+
+
+def serve_in_process(**kwargs):
+    """
+    Démarre le serveur dans un processus séparé (pour ne pas partager le GIL avec
+    le crawl mesuré) et renvoie (processus, port).
+    """
+    parent, child = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_serve, args=(child, kwargs), daemon=True)
+    process.start()
+    port = parent.recv()
+    return process, port
+
+
+def add_server_arguments(parser):
+    parser.add_argument('--products', type=int, default=1000, help='Taille du catalogue synthétique')
+    parser.add_argument('--latency', type=float, default=0.0, help='Latence moyenne par réponse (secondes)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Proportion de réponses 503')
+    parser.add_argument('--record-dir', default=None, help='Répertoire de pages enregistrées à rejouer')
+    parser.add_argument('--reviews', type=int, default=12, help='Nombre moyen d\'avis par produit')
+    parser.add_argument('--page-kb', type=int, default=150, help='Poids approximatif d\'une page produit (Ko)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8070)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+    server = make_server(
+        host=args.host, port=args.port, products=args.products, latency=args.latency,
+        error_rate=args.error_rate, record_dir=args.record_dir, reviews_per_product=args.reviews,
+        page_kb=args.page_kb
+    )
+    print(f"Serveur de fixtures sur http://{args.host}:{server.server_address[1]}{START_PATH} ({args.products} produits)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
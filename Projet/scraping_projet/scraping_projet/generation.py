@@ -0,0 +1,34 @@
+"""
+Compteur de génération des données, lu par le cache de réponses du dashboard
+(web_projet/app.py) : chaque écriture visible par le dashboard (lot MongoDB
+écrit, lot Elasticsearch indexé dans l'alias lu, bascule d'alias) l'incrémente,
+ce qui invalide les pages mises en cache.
+"""
+import time
+
+# Document unique du compteur dans la collection DATA_GENERATION_COLLECTION
+GENERATION_ID = 'generation'
+
+
+class DataGeneration:
+
+    def __init__(self, collection, logger=None, stats=None):
+        self.collection = collection
+        self.logger = logger
+        self.stats = stats
+
+    def bump(self, *args):
+        """Incrémente le compteur ; les arguments (callback de flush) sont ignorés."""
+        try:
+            self.collection.update_one(
+                {'_id': GENERATION_ID},
+                {'$inc': {'generation': 1}, '$set': {'updated_at': time.time()}},
+                upsert=True
+            )
+        except Exception as e:
+            # Le cache du dashboard expire de toute façon (TTL) : une erreur ici ne bloque pas le crawl
+            if self.logger:
+                self.logger.warning(f"[DataGeneration] Impossible d'incrémenter la génération des données: {e}")
+            return
+        if self.stats is not None:
+            self.stats.inc_value('data_generation/bumps')
@@ -0,0 +1,159 @@
+"""
+Collection `product_history` : historique des prix, notes et messages
+commerciaux, en un document (bucket) par produit et par mois.
+
+    {_id: '00263850|2024-05', product_id: '00263850', month: '2024-05',
+     category_main: 'Meubles', name, url,
+     opening: {price, rating, review_count, commercial_message, discount},
+     points: [{t, price}, {t, commercial_message, discount}, ...],
+     last: {...}, changes, price_open, price_last, price_min, price_max,
+     price_drop, price_drop_pct, discount_max, updated_at}
+
+Un point n'est écrit que si un champ suivi a changé depuis la version
+précédente du produit (relue par BulkUpserter avant l'écriture du lot) et ne
+contient que les champs modifiés : `opening` (l'état au premier changement du
+mois) suffit à reconstituer chaque valeur. L'historique d'un produit se lit en
+une requête sur l'index (product_id, month) ; les champs `price_*` et
+`discount_max`, recalculés à chaque point, servent aux requêtes de baisses de
+prix et de tendance des remises du dashboard. Comme `discount` et
+`discount_max`, `price_drop_pct` est un pourcentage (12.5 pour une baisse de
+12,5 %) ; `price_drop` est en euros.
+"""
+import re
+from datetime import datetime, timezone
+
+from pymongo import UpdateOne
+
+from .messages import classify_commercial_messages
+from .ranking import main_category
+
+# Champs des produits relus pour détecter les changements
+HISTORY_FIELDS = ('product_id', 'url', 'name', 'category_hierarchy', 'price', 'rating', 'review_count',
+                  'commercial_message')
+TRACKED_FIELDS = ('price', 'rating', 'review_count', 'commercial_message', 'discount')
+BUCKET_SEPARATOR = '|'
+PERCENT_RE = re.compile(r'(\d+(?:[.,]\d+)?)\s*%')
+
+
+def _number(value, cast):
+    try:
+        return cast(value) if value is not None and not isinstance(value, bool) else None
+    except (TypeError, ValueError):
+        return None
+
+
+def discount(messages):
+    """Remise la plus forte (en %) des messages « Réduction NN% », None sans remise."""
+    percents = []
+    for message in classify_commercial_messages(messages)['reductions']:
+        match = PERCENT_RE.search(message)
+        if match:
+            percents.append(float(match.group(1).replace(',', '.')))
+    return max(percents) if percents else None
+
+
+def tracked_state(doc):
+    """Valeurs suivies d'un produit, normalisées pour la comparaison."""
+    messages = doc.get('commercial_message')
+    if isinstance(messages, str):
+        messages = [messages]
+    elif not isinstance(messages, list):
+        messages = []
+    return {
+        'price': _number(doc.get('price'), float),
+        'rating': _number(doc.get('rating'), float),
+        'review_count': _number(doc.get('review_count'), int),
+        # L'ordre d'affichage des messages n'est pas un changement
+        'commercial_message': sorted(message for message in messages if isinstance(message, str)),
+        'discount': discount(messages),
+    }
+
+
+def changed_fields(old_state, new_state):
+    """Champs suivis modifiés : {champ: nouvelle valeur}, tous les champs pour un nouveau produit."""
+    if old_state is None:
+        return dict(new_state)
+    return {field: new_state[field] for field in TRACKED_FIELDS if new_state[field] != old_state[field]}
+
+
+def bucket_id(product, month):
+    return f'{product}{BUCKET_SEPARATOR}{month}'
+
+
+def _literal(value):
+    # Valeurs insérées telles quelles dans un pipeline de mise à jour (une chaîne « $... » serait un champ)
+    return {'$literal': value}
+
+
+def _bucket_update(doc, key, old_state, new_state, changes, now):
+    month = now.strftime('%Y-%m')
+    product = key.get('product_id') or key.get('url')
+    new_price = new_state['price']
+    old_price = old_state['price'] if old_state else None
+    first_stage = {
+        'product_id': _literal(doc.get('product_id')),
+        'url': _literal(doc.get('url')),
+        'name': _literal(doc.get('name')),
+        'category_main': _literal(main_category(doc.get('category_hierarchy'))),
+        'month': month,
+        # État avant le premier changement du mois (le premier relevé pour un nouveau produit)
+        'opening': {'$ifNull': ['$opening', _literal(old_state or new_state)]},
+        'points': {'$concatArrays': [{'$ifNull': ['$points', []]}, [_literal({'t': now, **changes})]]},
+        'last': _literal(new_state),
+        'changes': {'$add': [{'$ifNull': ['$changes', 0]}, 1]},
+        # $min et $max ignorent les valeurs nulles ou absentes
+        'price_min': {'$min': ['$price_min', _literal(old_price), _literal(new_price)]},
+        'price_max': {'$max': ['$price_max', _literal(old_price), _literal(new_price)]},
+        'discount_max': {'$max': ['$discount_max', _literal(new_state['discount'])]},
+        'updated_at': now,
+    }
+    second_stage = {
+        'price_open': '$opening.price',
+        'price_last': '$last.price',
+        'price_drop': {'$subtract': ['$opening.price', '$last.price']},
+        # En pourcentage du prix d'ouverture, comme les remises
+        'price_drop_pct': {'$cond': [
+            {'$and': [{'$gt': ['$opening.price', 0]}, {'$ne': ['$last.price', None]}]},
+            {'$multiply': [{'$divide': [{'$subtract': ['$opening.price', '$last.price']}, '$opening.price']}, 100]},
+            None
+        ]},
+    }
+    return UpdateOne({'_id': bucket_id(product, month)}, [{'$set': first_stage}, {'$set': second_stage}], upsert=True)
+
+
+class PriceHistory:
+    """Ajoute à `product_history` un point par produit écrit dont un champ suivi a changé."""
+
+    name = 'history'
+    fields = HISTORY_FIELDS
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def apply(self, previous, written, now=None):
+        """
+        Compare chaque produit écrit (`written` : clé -> document envoyé) à sa version
+        précédente ; renvoie le nombre de points ajoutés.
+        """
+        now = now or datetime.now(timezone.utc)
+        operations = []
+        for key, doc in written.items():
+            old = previous.get(key)
+            # Les champs absents du document envoyé ($set partiel) gardent leur valeur précédente
+            new = {**old, **doc} if old else doc
+            old_state = tracked_state(old) if old else None
+            new_state = tracked_state(new)
+            changes = changed_fields(old_state, new_state)
+            if changes:
+                operations.append(_bucket_update(new, dict(key), old_state, new_state, changes, now))
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+        return len(operations)
+
+
+def ensure_indexes(collection):
+    # Historique d'un produit, baisses de prix du mois, tendance des remises par catégorie
+    collection.create_index([('product_id', 1), ('month', 1)], name='product_month')
+    collection.create_index([('month', 1), ('price_drop_pct', -1)], name='month_price_drop')
+    collection.create_index([('category_main', 1), ('month', 1), ('price_drop_pct', -1)],
+                            name='category_month_price_drop')
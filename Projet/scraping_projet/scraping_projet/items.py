@@ -15,4 +15,8 @@ class IkeaProductItem(scrapy.Item):
     is_new = scrapy.Field()
     commercial_message = scrapy.Field()
     reviews = scrapy.Field()
+    # Agrégats des notes des avis (count, sum, mean) et score de classement bayésien (ranking.py)
+    review_stats = scrapy.Field()
+    # Renseigné en crawl incrémental : `reviews` ne contient alors que les avis postérieurs à cette date
+    reviews_watermark = scrapy.Field()
     sourceCountryCode = scrapy.Field()
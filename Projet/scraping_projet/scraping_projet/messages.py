@@ -0,0 +1,31 @@
+"""
+Classement des messages commerciaux d'un produit, stocké avec le produit dans
+MongoDB (`message_class`) pour que le dashboard (/page1) n'ait qu'à compter.
+"""
+
+
+def is_reduction(message):
+    """Message de remise du type « Réduction 20% »."""
+    return isinstance(message, str) and message.strip().startswith('Réduction') and '%' in message
+
+
+def classify_commercial_messages(messages):
+    """
+    Renvoie {label, combined, reductions} :
+    - reductions : les messages « Réduction NN% » du produit ;
+    - label : l'unique autre message, ou « A & B » (ordre alphabétique) s'il y en a deux,
+      None sinon ; combined vaut True dans le second cas.
+    """
+    if isinstance(messages, str):
+        messages = [messages]
+    elif not isinstance(messages, list):
+        messages = []
+    reductions = [message.strip() for message in messages if is_reduction(message)]
+    others = [message for message in messages if isinstance(message, str) and not is_reduction(message)]
+    label = None
+    if len(others) == 1:
+        label = others[0]
+    elif len(others) == 2:
+        first, second = sorted(others)
+        label = f'{first} & {second}'
+    return {'label': label, 'combined': len(others) == 2, 'reductions': reductions}
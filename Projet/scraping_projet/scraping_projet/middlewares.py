@@ -0,0 +1,543 @@
+import heapq
+import os
+import pickle
+import shutil
+import time
+
+from queuelib import LifoDiskQueue, PriorityQueue
+
+from itemadapter import is_item
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider, IgnoreRequest, NotConfigured
+from scrapy.http import Request
+from scrapy.utils.request import request_from_dict
+
+from .checkpoint import CrawlCheckpoint
+from .dedup import DuplicateItem, item_key
+from .storage_acks import StoredItems
+
+# Envoyé par FrontierReleaseMiddleware (request) : requête de découverte sortie du téléchargement
+# sans avoir atteint le téléchargeur (IgnoreRequest d'un middleware, réponse du cache HTTP...)
+discovery_request_done = object()
+
+
+class ConditionalRequestMiddleware:
+    """
+    Requêtes conditionnelles pour le crawl incrémental.
+
+    Les requêtes marquées `meta['conditional']` reçoivent les en-têtes
+    If-None-Match / If-Modified-Since mémorisés lors du crawl précédent.
+    Une réponse 304 est abandonnée avant d'atteindre le callback : la page
+    produit n'est ni parsée ni renvoyée aux pipelines.
+    """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.stats = crawler.stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('INCREMENTAL_CRAWL'):
+            raise NotConfigured
+        return cls(crawler)
+
+    def process_request(self, request, spider=None):
+        store = getattr(self.crawler.spider, 'fingerprints', None)
+        if store is None or not request.meta.get('conditional'):
+            return None
+        previous = store.get(request.url)
+        if previous:
+            if previous['etag']:
+                request.headers.setdefault('If-None-Match', previous['etag'])
+            if previous['last_modified']:
+                request.headers.setdefault('If-Modified-Since', previous['last_modified'])
+        return None
+
+    def process_response(self, request, response, spider=None):
+        store = getattr(self.crawler.spider, 'fingerprints', None)
+        if store is None or not request.meta.get('conditional'):
+            return response
+        if response.status == 304:
+            self.stats.inc_value('incremental/not_modified')
+            raise IgnoreRequest(f"Page inchangée (304) : {request.url}")
+        if response.status == 200:
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+            if etag or last_modified:
+                store.record_headers(
+                    response.url,
+                    etag.decode('latin-1') if etag else None,
+                    last_modified.decode('latin-1') if last_modified else None
+                )
+        return response
+
+
+class CheckpointMiddleware:
+    """
+    Reprise du crawl après un arrêt brutal du conteneur.
+
+    Les requêtes de catégories et de pages produit sont enregistrées sur
+    disque (CrawlCheckpoint) avec leur `category_path`. Au redémarrage, si
+    des requêtes sont encore en attente, elles remplacent les start_urls et
+    les pages produit déjà terminées ne sont pas re-téléchargées. Le point de
+    reprise est effacé quand le crawl se termine normalement.
+
+    Une page produit n'est terminée qu'une fois son item acquitté par chacune
+    des bases ouvertes (storage_acks.StoredItems) : un item encore dans le
+    tampon de BulkUpserter, BulkIndexer ou du spool au moment d'un arrêt brutal
+    est re-téléchargé à la reprise. Un item écarté comme doublon (DuplicateItem)
+    termine sa page sans écriture ; un item écarté pour une autre raison ou en
+    erreur la laisse en attente.
+    """
+
+    # Callbacks dont les requêtes constituent la frontière du crawl
+    CHECKPOINT_CALLBACKS = ('parse_sub_categories', 'parse_product_details')
+
+    def __init__(self, crawler, path):
+        self.crawler = crawler
+        self.store = CrawlCheckpoint(path)
+        # URL de l'item -> [clé de déduplication, clé de la page], jusqu'à son acquittement par les bases
+        self.unacked = {}
+        self.stored_items = StoredItems(crawler, self.item_stored)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('CHECKPOINT_ENABLED'):
+            raise NotConfigured
+        middleware = cls(crawler, crawler.settings.get('CHECKPOINT_PATH'))
+        crawler.signals.connect(middleware.item_dropped, signal=signals.item_dropped)
+        crawler.signals.connect(middleware.item_error, signal=signals.item_error)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    async def process_start(self, start):
+        resumed = self._resumed_requests()
+        if resumed:
+            for request in resumed:
+                yield request
+            return
+        async for request in start:
+            yield request
+
+    def process_start_requests(self, start_requests, spider=None):
+        # Versions de Scrapy antérieures à process_start
+        resumed = self._resumed_requests()
+        yield from resumed if resumed else start_requests
+
+    def process_spider_output(self, response, result, spider=None):
+        state = {'parent_key': response.meta.get('checkpoint_key'), 'chained': False}
+        for obj in result:
+            if self._track(obj, state):
+                yield obj
+        self._finish(state)
+
+    async def process_spider_output_async(self, response, result, spider=None):
+        state = {'parent_key': response.meta.get('checkpoint_key'), 'chained': False}
+        async for obj in result:
+            if self._track(obj, state):
+                yield obj
+        self._finish(state)
+
+    def item_stored(self, url):
+        entry = self.unacked.pop(url, None)
+        if entry is not None:
+            self._complete(url, entry[1], entry[0])
+            self.store.commit_if_due()
+
+    def item_dropped(self, item, spider, exception=None, **kwargs):
+        entry = self.unacked.pop(item.get('url'), None)
+        if entry is not None and isinstance(exception, DuplicateItem):
+            # Produit déjà écrit (ou en cours d'écriture) via une autre URL : pas de clé, voir DuplicatesPipeline
+            self._complete(item['url'], entry[1])
+
+    def item_error(self, item, spider, **kwargs):
+        # La page reste en attente : re-téléchargée à la reprise
+        self.unacked.pop(item.get('url'), None)
+
+    def spider_closed(self, spider, reason):
+        if reason == 'finished':
+            self.store.clear()
+        else:
+            spider.logger.info(f"[Checkpoint] Crawl interrompu ({reason}), {self.store.count_pending()} requêtes en attente conservées "
+                               f"(dont {len(self.unacked)} items non acquittés par les bases)")
+        self.store.close()
+
+    def _track(self, obj, state):
+        """Enregistre une requête sortante ; renvoie False si elle doit être abandonnée."""
+        if not isinstance(obj, Request):
+            url = obj.get('url') if is_item(obj) else None
+            if url:
+                # La page reste en attente jusqu'à l'acquittement de son item par les bases
+                self.unacked[url] = [item_key(obj), state['parent_key']]
+                state['chained'] = True
+            return True
+        if not self._checkpointable(obj):
+            # Requête API des avis : la page produit reste en attente jusqu'à l'acquittement de l'item
+            state['chained'] = True
+            return True
+        if obj.callback.__name__ == 'parse_product_details' and self.store.is_completed(obj.url):
+            self.crawler.stats.inc_value('checkpoint/skipped_completed')
+            return False
+        obj.meta['checkpoint_key'] = self._key(obj)
+        self.store.add_pending(obj.meta['checkpoint_key'], obj.url, obj.callback.__name__, obj.meta, obj.priority)
+        return True
+
+    def _finish(self, state):
+        # La clé suit la requête à travers les redirections (meta copiée)
+        if state['parent_key'] and not state['chained']:
+            self.store.done(state['parent_key'])
+        self.store.commit_if_due()
+
+    def _complete(self, url, parent_key, key=None):
+        self.store.complete(url, key)
+        if parent_key:
+            # Page redirigée : l'URL de l'item n'est pas celle de la requête
+            self.store.done(parent_key)
+
+    def _resumed_requests(self):
+        spider = self.crawler.spider
+        requests = []
+        for url, callback, meta, priority in self.store.pending_requests():
+            request = Request(url, callback=getattr(spider, callback), meta=meta, priority=priority)
+            request.meta['checkpoint_key'] = self._key(request)
+            requests.append(request)
+        if requests:
+            spider.logger.info(f"[Checkpoint] Reprise du crawl : {len(requests)} requêtes en attente")
+            self.crawler.stats.set_value('checkpoint/resumed', len(requests))
+        return requests
+
+    def _checkpointable(self, request):
+        callback = getattr(request, 'callback', None)
+        return request.method == 'GET' and getattr(callback, '__name__', None) in self.CHECKPOINT_CALLBACKS
+
+    def _key(self, request):
+        return self.crawler.request_fingerprinter.fingerprint(request).hex()
+
+
+class AdaptiveConcurrencyMiddleware:
+    """
+    Concurrence adaptative par hôte (slot de téléchargement).
+
+    Chaque hôte démarre avec la concurrence de son slot (DOWNLOAD_SLOTS) et
+    évolue entre les bornes `min` / `max` d'ADAPTIVE_CONCURRENCY_HOSTS :
+    - une réponse 429 divise immédiatement la concurrence par deux ;
+    - à la fin de chaque fenêtre de réponses, un taux de 429/5xx (ou
+      d'exceptions) supérieur à ADAPTIVE_CONCURRENCY_ERROR_RATE la divise
+      par deux, une latence moyenne supérieure à
+      ADAPTIVE_CONCURRENCY_LATENCY_FACTOR fois la meilleure latence observée
+      la réduit de un, sinon elle augmente de un.
+    Les diminutions sont espacées d'au moins ADAPTIVE_CONCURRENCY_COOLDOWN
+    secondes. Les décisions sont visibles dans les stats
+    `adaptive_concurrency/<hôte>/...`.
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.crawler = crawler
+        self.hosts = settings.getdict('ADAPTIVE_CONCURRENCY_HOSTS')
+        self.default_limits = {
+            'min': settings.getint('ADAPTIVE_CONCURRENCY_MIN', 1),
+            'max': settings.getint('ADAPTIVE_CONCURRENCY_MAX', 16),
+        }
+        self.error_rate = settings.getfloat('ADAPTIVE_CONCURRENCY_ERROR_RATE', 0.05)
+        self.latency_factor = settings.getfloat('ADAPTIVE_CONCURRENCY_LATENCY_FACTOR', 2.0)
+        self.window = settings.getint('ADAPTIVE_CONCURRENCY_WINDOW', 20)
+        self.cooldown = settings.getfloat('ADAPTIVE_CONCURRENCY_COOLDOWN', 5.0)
+        self.states = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('ADAPTIVE_CONCURRENCY_ENABLED'):
+            raise NotConfigured
+        return cls(crawler)
+
+    def process_response(self, request, response, spider=None):
+        throttled = response.status == 429 or response.status >= 500
+        self._observe(request, request.meta.get('download_latency'), throttled, response.status == 429)
+        return response
+
+    def process_exception(self, request, exception, spider=None):
+        # Délai dépassé, connexion refusée... : compté comme un signe de saturation
+        self._observe(request, None, True, False)
+        return None
+
+    def _observe(self, request, latency, throttled, rate_limited):
+        key, slot = self._slot(request)
+        if slot is None:
+            return
+        state = self.states.get(key)
+        if state is None:
+            limits = {**self.default_limits, **self.hosts.get(key, {})}
+            state = self.states[key] = {
+                'concurrency': min(max(slot.concurrency, limits['min']), limits['max']),
+                'min': limits['min'],
+                'max': limits['max'],
+                'latency': None,
+                'best_latency': None,
+                'responses': 0,
+                'throttled': 0,
+                'last_decrease': 0.0,
+            }
+
+        if latency is not None:
+            state['latency'] = latency if state['latency'] is None else 0.8 * state['latency'] + 0.2 * latency
+            if state['best_latency'] is None or state['latency'] < state['best_latency']:
+                state['best_latency'] = state['latency']
+        state['responses'] += 1
+        if throttled:
+            state['throttled'] += 1
+            self._inc(key, 'throttled')
+
+        if rate_limited:
+            self._decrease(key, state, state['concurrency'] // 2, 'réponse 429')
+        elif state['responses'] >= max(self.window, state['concurrency']):
+            rate = state['throttled'] / state['responses']
+            if rate > self.error_rate:
+                self._decrease(key, state, state['concurrency'] // 2, f"429/5xx {rate:.0%}")
+            elif state['latency'] is not None and state['latency'] > self.latency_factor * state['best_latency']:
+                self._decrease(key, state, state['concurrency'] - 1,
+                               f"latence {state['latency'] * 1000:.0f} ms, meilleure {state['best_latency'] * 1000:.0f} ms")
+            elif state['concurrency'] < state['max']:
+                state['concurrency'] += 1
+                self._inc(key, 'increases')
+            state['responses'] = state['throttled'] = 0
+
+        # Le slot peut avoir été recréé (slots inactifs supprimés par le downloader) : on réapplique
+        slot.concurrency = state['concurrency']
+        stats = self.crawler.stats
+        stats.set_value(f'adaptive_concurrency/{key}/concurrency', state['concurrency'])
+        stats.max_value(f'adaptive_concurrency/{key}/concurrency_max', state['concurrency'])
+        if state['latency'] is not None:
+            stats.set_value(f'adaptive_concurrency/{key}/latency_ms', round(state['latency'] * 1000, 1))
+
+    def _decrease(self, key, state, target, reason):
+        now = time.monotonic()
+        target = max(target, state['min'])
+        if target >= state['concurrency'] or now - state['last_decrease'] < self.cooldown:
+            return
+        self.crawler.spider.logger.info(
+            f"[AdaptiveConcurrency] {key} : concurrence {state['concurrency']} -> {target} ({reason})"
+        )
+        state['concurrency'] = target
+        state['last_decrease'] = now
+        self._inc(key, 'decreases')
+        self.crawler.stats.min_value(f'adaptive_concurrency/{key}/concurrency_min', target)
+
+    def _slot(self, request):
+        downloader = self.crawler.engine.downloader
+        key = request.meta.get('download_slot') or downloader.get_slot_key(request)
+        return key, downloader.slots.get(key)
+
+    def _inc(self, key, name):
+        self.crawler.stats.inc_value(f'adaptive_concurrency/{key}/{name}')
+
+
+class FrontierBackpressureMiddleware:
+    """
+    Plafond de la frontière du crawl.
+
+    Les requêtes de découverte (priorité inférieure à FRONTIER_HOLD_BELOW_PRIORITY,
+    c'est-à-dire les pages de catégorie et de liste) sont admises dans
+    l'ordonnanceur au compte-gouttes : au plus FRONTIER_MAX_DISCOVERY à la fois,
+    et aucune tant que l'ordonnanceur contient FRONTIER_MAX_PENDING requêtes ou
+    plus. Les autres sont mises de côté (Request.to_dict : callback, errback,
+    en-têtes, cookies, cb_kwargs, dont_filter... ; l'objet Request lui-même si
+    son callback n'est pas une méthode du spider) puis relâchées, les plus
+    prioritaires (les plus profondes) d'abord, à mesure que les pages de
+    découverte partent au téléchargement. Les pages produit et
+    les appels à l'API des avis ne sont jamais retenus : ce sont eux qui vident
+    la frontière. Sa taille dépend ainsi du plafond, pas de celle du catalogue.
+
+    Au plus FRONTIER_MAX_HELD requêtes retenues sont gardées en mémoire ; les
+    suivantes sont écrites dans une file sur disque par priorité (pickle, une
+    file LIFO par priorité dans FRONTIER_SPILL_DIR, vidée à chaque crawl), si
+    bien que la mémoire reste bornée même quand la découverte dépasse de loin
+    la capacité de l'ordonnanceur. Les requêtes non sérialisables restent en
+    mémoire.
+
+    Une requête de découverte libère sa place dès qu'elle quitte l'ordonnanceur :
+    en atteignant le téléchargeur, abandonnée par l'ordonnanceur, ou rejetée
+    avant le téléchargeur par un middleware (voir FrontierReleaseMiddleware).
+    Quand le crawl est inactif, plus aucune n'est en cours : le compteur est
+    remis à zéro et les requêtes retenues relâchées ; le spider n'est maintenu
+    ouvert que si l'une d'elles a pu être admise.
+    """
+
+    def __init__(self, crawler, max_pending, max_discovery, hold_below_priority, max_held=10000, spill_dir=None):
+        self.crawler = crawler
+        self.max_pending = max_pending
+        self.max_discovery = max_discovery
+        self.hold_below_priority = hold_below_priority
+        self.max_held = max_held
+        self.spill_dir = spill_dir
+        self.held = []
+        # File sur disque des requêtes retenues au-delà de max_held (clé : priorité inversée, comme le tas)
+        self.spilled = None
+        self.sequence = 0
+        # Requêtes de découverte admises dans l'ordonnanceur et pas encore téléchargées
+        self.discovery_scheduled = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        max_pending = crawler.settings.getint('FRONTIER_MAX_PENDING')
+        if max_pending <= 0:
+            raise NotConfigured
+        middleware = cls(
+            crawler,
+            max_pending,
+            crawler.settings.getint('FRONTIER_MAX_DISCOVERY', 16),
+            crawler.settings.getint('FRONTIER_HOLD_BELOW_PRIORITY', 20),
+            crawler.settings.getint('FRONTIER_MAX_HELD', 10000),
+            crawler.settings.get('FRONTIER_SPILL_DIR'),
+        )
+        crawler.signals.connect(middleware.request_left_scheduler, signal=signals.request_reached_downloader)
+        crawler.signals.connect(middleware.request_left_scheduler, signal=signals.request_dropped)
+        crawler.signals.connect(middleware.request_left_scheduler, signal=discovery_request_done)
+        crawler.signals.connect(middleware.response_received, signal=signals.response_received)
+        crawler.signals.connect(middleware.spider_idle, signal=signals.spider_idle)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def process_spider_output(self, response, result, spider=None):
+        for obj in result:
+            if not self._hold(obj):
+                yield obj
+
+    async def process_spider_output_async(self, response, result, spider=None):
+        async for obj in result:
+            if not self._hold(obj):
+                yield obj
+
+    def request_left_scheduler(self, request, spider=None, **kwargs):
+        if request.meta.pop('frontier_discovery', False):
+            self.discovery_scheduled -= 1
+
+    def response_received(self, response, request, spider):
+        self.crawler.stats.max_value('frontier/scheduler_max', self._pending())
+        self._release()
+
+    def spider_idle(self, spider):
+        # Ordonnanceur et téléchargeur vides : une place perdue en route ne bloque pas la découverte
+        self.discovery_scheduled = 0
+        if not self._held_count():
+            return
+        if self._release():
+            raise DontCloseSpider
+        spider.logger.warning(f"[Frontier] {self._held_count()} requêtes retenues ne peuvent pas être admises, crawl terminé")
+
+    def spider_closed(self, spider, reason):
+        # Requêtes retenues non relâchées : reprises, le cas échéant, depuis le point de reprise du crawl
+        if self.spilled is not None:
+            self.spilled.close()
+            self.spilled = None
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+    def _hold(self, obj):
+        if not self._is_discovery(obj):
+            return False
+        if not self._held_count() and self._admissible():
+            self._admit(obj)
+            return False
+        try:
+            held = obj.to_dict(spider=self.crawler.spider)
+        except ValueError:
+            # Callback ou errback qui n'est pas une méthode du spider (lambda...) : non sérialisable
+            held = obj
+        if len(self.held) >= self.max_held and self.spill_dir and not isinstance(held, Request) and self._spill(obj, held):
+            self.crawler.stats.inc_value('frontier/spilled')
+        else:
+            # Tas min sur la priorité inversée : la requête la plus prioritaire sort la première
+            heapq.heappush(self.held, (-obj.priority, self.sequence, held))
+            self.sequence += 1
+        self.crawler.stats.inc_value('frontier/held')
+        self.crawler.stats.max_value('frontier/held_max', self._held_count())
+        self.crawler.stats.max_value('frontier/held_memory_max', len(self.held))
+        return True
+
+    def _spill(self, obj, held):
+        """Écrit la requête retenue dans la file sur disque ; False si elle n'est pas sérialisable."""
+        try:
+            data = pickle.dumps(held, protocol=4)
+        except Exception:
+            return False
+        if self.spilled is None:
+            # File d'un crawl précédent interrompu : ses requêtes sont dans le point de reprise, pas ici
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            os.makedirs(self.spill_dir, exist_ok=True)
+            self.spilled = PriorityQueue(lambda priority: LifoDiskQueue(os.path.join(self.spill_dir, f'p{priority}')))
+        self.spilled.push(data, -obj.priority)
+        return True
+
+    def _pop_held(self):
+        # La plus prioritaire des deux files (à priorité égale, celle en mémoire, plus récente)
+        if self.held and (not self.spilled or self.held[0][0] <= self.spilled.curprio):
+            return heapq.heappop(self.held)[2]
+        return pickle.loads(self.spilled.pop())
+
+    def _held_count(self):
+        return len(self.held) + (len(self.spilled) if self.spilled is not None else 0)
+
+    def _release(self):
+        """Relâche les requêtes retenues admissibles ; renvoie leur nombre."""
+        spider = self.crawler.spider
+        released = 0
+        while self._held_count() and self._admissible():
+            held = self._pop_held()
+            request = held if isinstance(held, Request) else request_from_dict(held, spider=spider)
+            self._admit(request)
+            self.crawler.engine.crawl(request)
+            self.crawler.stats.inc_value('frontier/released')
+            released += 1
+        return released
+
+    def _admit(self, request):
+        request.meta['frontier_discovery'] = True
+        self.discovery_scheduled += 1
+
+    def _admissible(self):
+        return self.discovery_scheduled < self.max_discovery and self._pending() < self.max_pending
+
+    def _is_discovery(self, obj):
+        return (
+            isinstance(obj, Request)
+            and obj.priority < self.hold_below_priority
+            and obj.method == 'GET'
+        )
+
+    def _pending(self):
+        scheduler = self.crawler.engine.scheduler
+        return len(scheduler) if scheduler is not None else 0
+
+
+class FrontierReleaseMiddleware:
+    """
+    Pendant de FrontierBackpressureMiddleware côté téléchargement.
+
+    Une requête de découverte rejetée par un middleware de téléchargement avant
+    d'atteindre le téléchargeur (IgnoreRequest du filtre hors domaine ou de
+    robots.txt, réponse servie par le cache HTTP...) ne déclenche ni
+    request_reached_downloader ni request_dropped : le signal
+    `discovery_request_done` libère alors sa place dans la frontière.
+    """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if crawler.settings.getint('FRONTIER_MAX_PENDING') <= 0:
+            raise NotConfigured
+        return cls(crawler)
+
+    def process_response(self, request, response, spider=None):
+        self._done(request)
+        return response
+
+    def process_exception(self, request, exception, spider=None):
+        self._done(request)
+        return None
+
+    def _done(self, request):
+        # Marque retirée par request_reached_downloader : rien à faire si la requête l'a atteint
+        if request.meta.get('frontier_discovery'):
+            self.crawler.signals.send_catch_log(discovery_request_done, request=request, spider=self.crawler.spider)
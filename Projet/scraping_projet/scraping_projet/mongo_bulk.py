@@ -0,0 +1,281 @@
+import time
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+from twisted.internet import defer, task
+
+
+def merge_updates(old, new):
+    """
+    Fusionne deux mises à jour d'un même produit en une seule : les champs de `new`
+    remplacent ceux de `old`, ses avis passent devant ceux de `old` et ses agrégats
+    s'y ajoutent. Une version complète (sans $push) remplace tout ce qui précède.
+    """
+    if '$push' not in new:
+        return new
+    merged = {'$set': {**old['$set'], **new['$set']}}
+    new_reviews = new['$push']['reviews']['$each']
+    new_inc = new.get('$inc', {})
+    if '$push' in old:
+        merged['$push'] = {'reviews': {'$each': new_reviews + old['$push']['reviews']['$each'], '$position': 0}}
+        inc = dict(old.get('$inc', {}))
+        for field, value in new_inc.items():
+            inc[field] = inc.get(field, 0) + value
+        if inc:
+            merged['$inc'] = inc
+        return merged
+    # Version complète suivie d'avis nouveaux : tout reste dans $set (un même champ ne peut être à la fois $set et $push)
+    merged['$set']['reviews'] = new_reviews + (old['$set'].get('reviews') or [])
+    stats = old['$set'].get('review_stats')
+    if stats and new_inc:
+        merged['$set']['review_stats'] = {
+            **stats,
+            'count': stats.get('count', 0) + new_inc.get('review_stats.count', 0),
+            'sum': stats.get('sum', 0) + new_inc.get('review_stats.sum', 0),
+        }
+    return merged
+
+
+def product_key(doc):
+    """Clé d'unicité d'un produit : product_id, à défaut l'URL de la page."""
+    if doc.get('product_id'):
+        return {'product_id': doc['product_id']}
+    if doc.get('url'):
+        return {'url': doc['url']}
+    return None
+
+
+class BulkUpserter:
+    """
+    Regroupe les écritures MongoDB en lots `bulk_write` non ordonnés.
+
+    Chaque document devient un `UpdateOne(..., upsert=True)` sur sa clé
+    produit, si bien qu'un re-crawl met à jour le document existant au lieu
+    d'en insérer un doublon. Le lot est envoyé dès qu'il atteint `batch_size`
+    ou que `flush_interval` secondes se sont écoulées depuis le dernier envoi.
+    Les `observers` (CategoryStats, PriceHistory) reçoivent après chaque lot la
+    version précédente des produits écrits, relue en une seule requête avant
+    l'écriture, et les documents envoyés : `observer.fields` donne les champs à
+    relire, `observer.apply(previous, written)` le nombre de mises à jour faites.
+
+    Deux versions d'un même produit dans le lot n'en font qu'une (merge_updates) :
+    en crawl incrémental, leurs nouveaux avis et leurs agrégats se cumulent.
+
+    Un lot reste en attente tant qu'il n'a pas été écrit : après une erreur de
+    connexion (AutoReconnect, délai dépassé...), il est renvoyé avec un délai
+    exponentiel, comme dans BulkIndexer, puis abandonné (et compté) au-delà de
+    `max_retries` tentatives. Les documents ajoutés pendant ce temps forment le
+    lot suivant et ne sont pas abandonnés avec lui ; au-delà de deux fois
+    `batch_size` documents non écrits (overloaded()), l'appelant attend
+    wait_for_capacity() avant d'en ajouter d'autres. `on_stored` reçoit après
+    chaque lot les URL des documents effectivement écrits (point de reprise du
+    crawl).
+    """
+
+    def __init__(self, collection, batch_size=500, flush_interval=5.0, logger=None, stats=None,
+                 stats_prefix='mongo_bulk', observers=(), on_flush=None, max_retries=3, retry_backoff=1.0,
+                 on_stored=None):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.logger = logger
+        self.stats = stats
+        self.stats_prefix = stats_prefix
+        self.observers = list(observers)
+        # Appelé avec le nombre de documents écrits après chaque lot (compteur de génération du dashboard)
+        self.on_flush = on_flush
+        self.on_stored = on_stored
+        # Dictionnaire clé -> mise à jour : deux versions d'un même produit dans un lot n'en font qu'une
+        self.pending = {}
+        # Dictionnaire clé -> document envoyé, transmis aux observers
+        self.pending_docs = {}
+        # Dictionnaire clé -> URL des pages dont le document est dans le lot (plusieurs pour des variantes)
+        self.pending_urls = {}
+        # Lot déjà envoyé une fois et en attente d'une nouvelle tentative : (mises à jour, documents, URL)
+        self.batch = None
+        self.last_flush = time.monotonic()
+        # Tentatives échouées du lot en attente et instant de la prochaine
+        self.attempts = 0
+        self.retry_at = 0.0
+
+        self.flush_count = 0
+        self.docs_written = 0
+        self.docs_failed = 0
+        self.total_flush_time = 0.0
+
+    def add(self, doc):
+        """Ajoute un document au lot courant ; renvoie False s'il n'a aucune clé exploitable."""
+        key = product_key(doc)
+        if key is None:
+            return False
+        if doc.pop('reviews_watermark', None):
+            # Crawl incrémental : seuls les nouveaux avis sont fournis, on les ajoute en tête
+            new_reviews = doc.pop('reviews', None) or []
+            stats = doc.pop('review_stats', None)
+            update = {'$set': doc, '$push': {'reviews': {'$each': new_reviews, '$position': 0}}}
+            if stats:
+                # Agrégats des seuls nouveaux avis : cumulés, moyenne et score recalculés en fin de crawl
+                update['$inc'] = {'review_stats.count': stats['count'], 'review_stats.sum': stats['sum']}
+        else:
+            update = {'$set': doc}
+        key = tuple(key.items())
+        previous = self.pending.get(key)
+        self.pending[key] = merge_updates(previous, update) if previous else update
+        if self.observers:
+            self.pending_docs[key] = self.pending[key]['$set']
+        if self.on_stored and doc.get('url'):
+            self.pending_urls.setdefault(key, []).append(doc['url'])
+        if len(self.pending) >= self.batch_size and self.retry_wait() <= 0:
+            self.flush()
+        return True
+
+    def flush_if_due(self):
+        if self.backlog() and time.monotonic() - self.last_flush >= self.flush_interval and self.retry_wait() <= 0:
+            self.flush()
+
+    def backlog(self):
+        """Nombre de documents pas encore écrits (lot en attente de retry compris)."""
+        return len(self.pending) + (len(self.batch[0]) if self.batch else 0)
+
+    def overloaded(self):
+        """Vrai si deux fois `batch_size` documents attendent d'être écrits."""
+        return self.backlog() >= 2 * self.batch_size
+
+    @defer.inlineCallbacks
+    def wait_for_capacity(self):
+        """Deferred déclenché quand les documents non écrits repassent sous deux fois `batch_size`."""
+        from twisted.internet import reactor
+
+        while self.overloaded():
+            wait = self.retry_wait()
+            if wait > 0:
+                yield task.deferLater(reactor, wait, lambda: None)
+            self.flush()
+
+    def retry_wait(self):
+        """Secondes avant la prochaine tentative du lot en attente (0 hors délai de retry)."""
+        return max(self.retry_at - time.monotonic(), 0.0)
+
+    def flush(self):
+        """
+        Écrit le lot en attente d'un retry s'il y en a un, sinon les documents ajoutés depuis le dernier
+        lot ; après une erreur de connexion, le lot est conservé pour une nouvelle tentative.
+        """
+        self.last_flush = time.monotonic()
+        if self.batch is None:
+            if not self.pending:
+                return
+            self.batch = (self.pending, self.pending_docs, self.pending_urls)
+            self.pending = {}
+            self.pending_docs = {}
+            self.pending_urls = {}
+        updates, docs, urls = self.batch
+        keys = list(updates)
+        operations = [UpdateOne(dict(key), update, upsert=True) for key, update in updates.items()]
+        docs = dict(docs)
+        urls = dict(urls)
+
+        start = time.monotonic()
+        try:
+            previous = self.previous([dict(key) for key in keys]) if docs else {}
+            result = self.collection.bulk_write(operations, ordered=False)
+            written = result.upserted_count + result.matched_count
+        except BulkWriteError as e:
+            details = e.details or {}
+            errors = details.get('writeErrors', [])
+            written = details.get('nUpserted', 0) + details.get('nMatched', 0)
+            self._inc('write_errors', len(errors))
+            # Les produits non écrits ne sont pas transmis aux observers
+            for error in errors:
+                docs.pop(keys[error['index']], None)
+                urls.pop(keys[error['index']], None)
+            if self.logger:
+                self.logger.error(f"[BulkUpserter] {len(errors)} erreur(s) d'écriture MongoDB, première : {errors[:1]}")
+        except PyMongoError as e:
+            self._retry_later(len(operations), e)
+            return
+        self.batch = None
+        self.attempts = 0
+        self.retry_at = 0.0
+        if urls:
+            self.on_stored([url for key_urls in urls.values() for url in key_urls])
+        if docs:
+            for observer in self.observers:
+                try:
+                    self._inc(f'{observer.name}_updates', observer.apply(previous, docs))
+                except Exception as e:
+                    self._inc(f'{observer.name}_errors')
+                    if self.logger:
+                        self.logger.error(f"[BulkUpserter] Erreur de mise à jour {observer.name}: {e}")
+        if written and self.on_flush:
+            self.on_flush(written)
+        elapsed = time.monotonic() - start
+
+        self.flush_count += 1
+        self.docs_written += written
+        self.total_flush_time += elapsed
+        self._inc('flushes')
+        self._inc('docs_written', written)
+        if self.logger:
+            rate = written / elapsed if elapsed > 0 else 0.0
+            self.logger.debug(
+                f"[BulkUpserter] Lot de {len(operations)} upserts en {elapsed * 1000:.1f} ms ({rate:.0f} docs/s)"
+            )
+
+    def previous(self, keys):
+        """Version actuelle (avant écriture) des produits désignés par leurs clés, champs des observers seulement."""
+        product_ids = [key['product_id'] for key in keys if 'product_id' in key]
+        urls = [key['url'] for key in keys if 'url' in key]
+        clauses = []
+        if product_ids:
+            clauses.append({'product_id': {'$in': product_ids}})
+        if urls:
+            clauses.append({'url': {'$in': urls}})
+        if not clauses:
+            return {}
+        projection = {field: 1 for observer in self.observers for field in observer.fields}
+        docs = {}
+        for doc in self.collection.find({'$or': clauses}, projection):
+            key = product_key(doc)
+            if key is not None:
+                docs[tuple(key.items())] = doc
+        return docs
+
+    def _retry_later(self, count, error):
+        self.attempts += 1
+        if self.attempts > self.max_retries:
+            self.docs_failed += count
+            self._inc('docs_failed', count)
+            if self.logger:
+                self.logger.error(f"[BulkUpserter] Lot de {count} documents abandonné après {self.max_retries} nouvelles tentatives: {error}")
+            # Seul le lot envoyé est abandonné : les documents ajoutés depuis forment le suivant
+            self.batch = None
+            self.attempts = 0
+            self.retry_at = 0.0
+            return
+        delay = self.retry_backoff * (2 ** (self.attempts - 1))
+        self.retry_at = time.monotonic() + delay
+        self._inc('retries')
+        if self.logger:
+            self.logger.warning(f"[BulkUpserter] Écriture MongoDB impossible ({error}), lot de {count} documents "
+                                f"renvoyé dans {delay:.1f} s")
+
+    def close(self):
+        """Dernier envoi (sans attendre les délais de retry, voir MongoDBPipeline.close_spider) et bilan."""
+        self.flush()
+        avg_latency = self.total_flush_time / self.flush_count if self.flush_count else 0.0
+        rate = self.docs_written / self.total_flush_time if self.total_flush_time > 0 else 0.0
+        if self.stats is not None:
+            self.stats.set_value(f'{self.stats_prefix}/flush_latency_avg', round(avg_latency, 4))
+            self.stats.set_value(f'{self.stats_prefix}/docs_per_second', round(rate, 1))
+        if self.logger:
+            self.logger.info(
+                f"[BulkUpserter] {self.docs_written} documents écrits en {self.flush_count} lots, "
+                f"latence moyenne {avg_latency * 1000:.1f} ms, {rate:.0f} docs/s"
+            )
+
+    def _inc(self, key, count=1):
+        if self.stats is not None:
+            self.stats.inc_value(f'{self.stats_prefix}/{key}', count)
@@ -1,79 +1,298 @@
 import pymongo
-from scrapy.exceptions import DropItem
-from elasticsearch import Elasticsearch, helpers
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.defer import maybe_deferred_to_future
+from elasticsearch import Elasticsearch
+from twisted.internet import defer, task
+import json
 import os
 import time
 
-class ElasticsearchPipeline:
-    def __init__(self, es_hosts):
-        self.es = Elasticsearch(es_hosts)
-        self.index_name = 'ikea_reviews'
+from .es_bulk import BulkIndexer
+from .generation import DataGeneration
+from .mongo_bulk import BulkUpserter
+from .es_index import IndexGenerations
+from .checkpoint import completed_keys, has_pending
+from .storage_acks import items_stored, sink_opened
+from .dedup import MAX_LOAD, DuplicateItem, FingerprintSet, item_key
+from .category_stats import CategoryStats, ensure_indexes as ensure_category_indexes
+from .history import PriceHistory, ensure_indexes as ensure_history_indexes
+from .messages import classify_commercial_messages
+from .reviews import normalize_review, review_id
+from .spool import SpoolWriter
+from .ranking import bayesian_score, es_rescore, main_category, mongo_rescore, review_stats
 
-    @classmethod
-    def from_crawler(cls, crawler):
-        return cls(
-            es_hosts=crawler.settings.get('ELASTICSEARCH_HOSTS')
-        )
-
-    def open_spider(self, spider):
-        # Supprime l'index s'il existe pour garantir le mapping
-        if self.es.indices.exists(index=self.index_name):
-            self.es.indices.delete(index=self.index_name)
-        self.es.indices.create(index=self.index_name, body={
-            "mappings": {
+# Mapping des documents produit (un document par produit, avis imbriqués)
+PRODUCT_INDEX_BODY = {
+    "mappings": {
+        "properties": {
+            "category_hierarchy": {"type": "keyword"},
+            "category_main": {"type": "keyword"},
+            "name": {"type": "keyword"},
+            "description": {"type": "text"},
+            "image_url": {"type": "keyword"},
+            "price": {"type": "float"},
+            "product_id": {"type": "keyword"},
+            "commercial_message": {"type": "keyword"},
+            "rating": {"type": "float"},
+            "review_count": {"type": "integer"},
+            "review_stats": {
                 "properties": {
-                    "category_hierarchy": {"type": "keyword"},
-                    "category_main": {"type": "keyword"},
-                    "name": {"type": "keyword"},
-                    "description": {"type": "text"},
-                    "image_url": {"type": "keyword"},
-                    "price": {"type": "float"},
-                    "product_id": {"type": "keyword"},
-                    "commercial_message": {"type": "keyword"},
+                    "count": {"type": "integer"},
+                    "sum": {"type": "float"},
+                    "mean": {"type": "float"},
+                    "score": {"type": "float"}
+                }
+            },
+            "reviews": {
+                "type": "nested",
+                "properties": {
+                    "id": {"type": "keyword"},
+                    "title": {"type": "text"},
+                    "text": {"type": "text"},
                     "rating": {"type": "float"},
-                    "review_count": {"type": "integer"},
-                    "reviews": {
-                        "type": "nested",
-                        "properties": {
-                            "id": {"type": "keyword"},
-                            "text": {"type": "text"},
-                            "comment": {"type": "text"},
-                            "title": {"type": "text"},
-                            "sourceCountryCode": {"type": "keyword"},
-                            "sourceLangCode": {"type": "keyword"},
-                            "submissionOn": {"type": "date"},
-                            "updatedOn": {"type": "date"},
-                            "isRecommended": {"type": "boolean"},
-                            "primaryRating": {
-                                "properties": {
-                                    "ratingRange": {"type": "integer"},
-                                    "ratingValue": {"type": "float"}
-                                }
-                            },
-                            "secondaryRatings": {
-                                "type": "nested",
-                                "properties": {
-                                    "id": {"type": "keyword"},
-                                    "label": {"type": "keyword"},
-                                    "ratingRange": {"type": "integer"},
-                                    "ratingValue": {"type": "float"}
-                                }
-                            }
-                        }
-                    },
-                    "secondaryRatings": {
+                    "secondary_ratings": {
                         "type": "nested",
                         "properties": {
                             "label": {"type": "keyword"},
-                            "ratingValue": {"type": "float"}
+                            "rating": {"type": "float"}
                         }
-                    }
+                    },
+                    "language": {"type": "keyword"},
+                    "country": {"type": "keyword"},
+                    "submitted_at": {"type": "date"},
+                    "updated_at": {"type": "date"}
                 }
             }
-        })
+        }
+    }
+}
 
-    def process_item(self, item, spider):
-        actions = []
+# Mapping de l'index des avis : un document par avis, avec le produit dénormalisé
+REVIEW_INDEX_BODY = {
+    "mappings": {
+        "properties": {
+            "id": {"type": "keyword"},
+            # Copie du _id du document : départage unique du tri de la recherche (search_after)
+            "doc_id": {"type": "keyword"},
+            "product_id": {"type": "keyword"},
+            "product_name": {"type": "keyword"},
+            "category_main": {"type": "keyword"},
+            "category_hierarchy": {"type": "keyword"},
+            "title": {"type": "text"},
+            "text": {"type": "text"},
+            "rating": {"type": "float"},
+            "secondary_ratings": {
+                "properties": {
+                    "label": {"type": "keyword"},
+                    "rating": {"type": "float"}
+                }
+            },
+            "language": {"type": "keyword"},
+            "country": {"type": "keyword"},
+            "submitted_at": {"type": "date"},
+            "updated_at": {"type": "date"}
+        }
+    }
+}
+
+# Script painless du crawl incrémental : met à jour les champs produit, ajoute les nouveaux avis
+# et cumule leurs agrégats (moyenne et score sont recalculés en fin de crawl)
+APPEND_REVIEWS_SCRIPT = (
+    "for (entry in params.doc.entrySet()) { ctx._source[entry.getKey()] = entry.getValue(); } "
+    "if (ctx._source.reviews == null) { ctx._source.reviews = []; } "
+    "ctx._source.reviews.addAll(0, params.reviews); "
+    "if (params.stats != null) { "
+    "if (ctx._source.review_stats == null) { ctx._source.review_stats = params.stats; } "
+    "else { ctx._source.review_stats.count += params.stats.count; ctx._source.review_stats.sum += params.stats.sum; } }"
+)
+
+class ElasticsearchPipeline:
+    def __init__(self, es_hosts, bulk_max_docs=500, bulk_max_bytes=5 * 1024 * 1024,
+                 bulk_flush_interval=5.0, bulk_max_retries=3, bulk_retry_backoff=1.0, bulk_threaded=True, stats=None,
+                 index_alias='ikea_reviews', keep_generations=1, replicas=1, incremental=False,
+                 review_index_alias='ikea_review_docs', prior_weight=10.0, prior_mean=4.0,
+                 mongo_uri=None, mongo_db='ikea_db', generation_collection='dashboard_meta', signals=None):
+        self.es = Elasticsearch(es_hosts)
+        # Signaux du crawler : acquittement des items écrits (storage_acks)
+        self.signals = signals
+        self.incremental = incremental
+        self.index_alias = index_alias
+        self.index_name = None
+        self.review_index_alias = review_index_alias
+        self.review_index_name = None
+        self.prior_weight = prior_weight
+        self.prior_mean = prior_mean
+        # Compteur de génération du dashboard, dans MongoDB à côté des produits
+        self.mongo_uri = mongo_uri
+        self.mongo_db = mongo_db
+        self.generation_collection = generation_collection
+        self.mongo_client = None
+        self.data_generation = None
+        self.keep_generations = keep_generations
+        self.replicas = replicas
+        self.generations = None
+        self.review_generations = None
+        self.bulk_max_docs = bulk_max_docs
+        self.bulk_max_bytes = bulk_max_bytes
+        self.bulk_flush_interval = bulk_flush_interval
+        self.bulk_max_retries = bulk_max_retries
+        self.bulk_retry_backoff = bulk_retry_backoff
+        self.bulk_threaded = bulk_threaded
+        self.stats = stats
+        self.indexer = None
+        self.flush_loop = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if crawler.settings.getbool('SPOOL_ENABLED'):
+            # Les items passent par le spool : `scrapy load_spool elasticsearch` les indexe
+            raise NotConfigured("SPOOL_ENABLED : indexation par le loader du spool")
+        pipeline = cls(
+            es_hosts=crawler.settings.get('ELASTICSEARCH_HOSTS'),
+            bulk_max_docs=crawler.settings.getint('ES_BULK_MAX_DOCS', 500),
+            bulk_max_bytes=crawler.settings.getint('ES_BULK_MAX_BYTES', 5 * 1024 * 1024),
+            bulk_flush_interval=crawler.settings.getfloat('ES_BULK_FLUSH_INTERVAL', 5.0),
+            bulk_max_retries=crawler.settings.getint('ES_BULK_MAX_RETRIES', 3),
+            bulk_retry_backoff=crawler.settings.getfloat('ES_BULK_RETRY_BACKOFF', 1.0),
+            bulk_threaded=crawler.settings.getbool('ES_BULK_THREADED', True),
+            stats=crawler.stats,
+            index_alias=crawler.settings.get('ES_INDEX_ALIAS', 'ikea_reviews'),
+            keep_generations=crawler.settings.getint('ES_INDEX_KEEP_GENERATIONS', 1),
+            replicas=crawler.settings.getint('ES_INDEX_REPLICAS', 1),
+            incremental=crawler.settings.getbool('INCREMENTAL_CRAWL'),
+            review_index_alias=crawler.settings.get('ES_REVIEW_INDEX_ALIAS', 'ikea_review_docs'),
+            prior_weight=crawler.settings.getfloat('REVIEW_PRIOR_WEIGHT', 10.0),
+            prior_mean=crawler.settings.getfloat('REVIEW_PRIOR_MEAN', 4.0),
+            mongo_uri=crawler.settings.get('MONGO_URI'),
+            mongo_db=crawler.settings.get('MONGO_DATABASE', 'ikea_db'),
+            generation_collection=crawler.settings.get('DATA_GENERATION_COLLECTION', 'dashboard_meta'),
+            signals=crawler.signals
+        )
+        # La bascule d'alias a besoin de la raison de fermeture, absente de close_spider
+        crawler.signals.connect(pipeline.spider_closed, signal=signals.spider_closed)
+        return pipeline
+
+    def open_spider(self, spider):
+        self.generations = IndexGenerations(
+            self.es, self.index_alias, keep=self.keep_generations, replicas=self.replicas, logger=spider.logger
+        )
+        self.review_generations = IndexGenerations(
+            self.es, self.review_index_alias, keep=self.keep_generations, replicas=self.replicas, logger=spider.logger
+        )
+        self.index_name = self._target_index(self.generations, PRODUCT_INDEX_BODY)
+        self.review_index_name = self._target_index(self.review_generations, REVIEW_INDEX_BODY)
+        if self.mongo_uri and self.generation_collection:
+            self.mongo_client = pymongo.MongoClient(self.mongo_uri, serverSelectionTimeoutMS=5000)
+            self.data_generation = DataGeneration(
+                self.mongo_client[self.mongo_db][self.generation_collection], logger=spider.logger, stats=self.stats
+            )
+        self.indexer = BulkIndexer(
+            self.es,
+            max_docs=self.bulk_max_docs,
+            max_bytes=self.bulk_max_bytes,
+            max_interval=self.bulk_flush_interval,
+            max_retries=self.bulk_max_retries,
+            retry_backoff=self.bulk_retry_backoff,
+            logger=spider.logger,
+            stats=self.stats,
+            on_flush=self._on_flush,
+            threaded=self.bulk_threaded,
+            on_stored=self._on_stored if self.signals else None
+        )
+        if self.signals:
+            self.signals.send_catch_log(sink_opened, sink='elasticsearch')
+        # Vide le tampon régulièrement même si les items arrivent lentement
+        self.flush_loop = task.LoopingCall(self._flush_if_due, spider)
+        self.flush_loop.start(max(self.bulk_flush_interval / 2, 0.5), now=False)
+
+    def close_spider(self, spider):
+        if self.flush_loop and self.flush_loop.running:
+            self.flush_loop.stop()
+        if not self.indexer:
+            return
+        if self.bulk_threaded:
+            # Derniers envois dans le pool de threads : spider_closed (bascule d'alias) attend leur fin
+            d = self.indexer.close_in_thread()
+            d.addErrback(lambda failure: spider.logger.error(
+                f"Erreur lors du flush final sur Elasticsearch: {failure.value}"))
+            return maybe_deferred_to_future(d)
+        try:
+            self.indexer.close()
+        except Exception as e:
+            spider.logger.error(f"Erreur lors du flush final sur Elasticsearch: {e}")
+
+    def spider_closed(self, spider, reason):
+        # Les moyennes de catégorie ne sont connues qu'en fin de crawl : recalcul des scores avant la bascule
+        if self.index_name and (reason == 'finished' or self.index_name == self.index_alias):
+            try:
+                priors, updated = es_rescore(self.es, self.index_name, self.prior_weight, self.prior_mean)
+                spider.logger.info(f"[Classement] {updated} scores recalculés avec les moyennes de {len(priors)} catégories")
+                if updated:
+                    self._on_flush(updated)
+            except Exception as e:
+                spider.logger.error(f"Erreur lors du recalcul des scores Elasticsearch: {e}")
+        promoted = False
+        for generations, index_name in ((self.generations, self.index_name), (self.review_generations, self.review_index_name)):
+            if not index_name or index_name == generations.alias:
+                continue
+            if reason != 'finished':
+                # Crawl interrompu : l'alias reste sur la dernière génération complète
+                spider.logger.warning(f"Crawl terminé ({reason}), l'alias {generations.alias} n'est pas basculé vers {index_name}")
+                continue
+            if not self.indexer or not self.indexer.indexed_by_index.get(index_name):
+                # Aucun document écrit dans cette génération : l'alias reste sur la précédente
+                spider.logger.warning(f"Aucun document indexé dans {index_name}, l'alias {generations.alias} n'est pas basculé")
+                continue
+            try:
+                generations.promote(index_name)
+                promoted = True
+                generations.cleanup()
+            except Exception as e:
+                spider.logger.error(f"Erreur lors de la bascule de l'alias Elasticsearch: {e}")
+        if promoted and self.data_generation:
+            self.data_generation.bump()
+        if self.mongo_client:
+            self.mongo_client.close()
+
+    def _on_flush(self, indexed):
+        # Une nouvelle génération d'index n'est visible qu'après la bascule d'alias
+        visible = self.index_name == self.index_alias or self.review_index_name == self.review_index_alias
+        if visible and self.data_generation:
+            self.data_generation.bump()
+
+    def _on_stored(self, urls):
+        self.signals.send_catch_log(items_stored, sink='elasticsearch', urls=urls)
+
+    def _target_index(self, generations, body):
+        if self.incremental and self.es.indices.exists_alias(name=generations.alias):
+            # Crawl incrémental : seuls les produits modifiés sont renvoyés, on complète l'index en ligne
+            # (les champs ajoutés au mapping depuis sa création, comme doc_id, y sont déclarés)
+            self.es.indices.put_mapping(index=generations.alias, body=body["mappings"])
+            return generations.alias
+        # Nouvelle génération d'index : l'alias lu par le dashboard reste sur l'ancienne pendant le crawl
+        return generations.create(body)
+
+    def _flush_if_due(self, spider):
+        try:
+            self.indexer.flush_if_due()
+        except Exception as e:
+            spider.logger.error(f"Erreur lors de l'indexation sur Elasticsearch: {e}")
+
+    async def process_item(self, item, spider):
+        self.write_item(item, spider)
+        if self.bulk_threaded and self.indexer.overloaded():
+            # Cluster lent ou indisponible : l'item attend que le tampon se vide (mémoire bornée)
+            if self.stats is not None:
+                self.stats.inc_value('es_bulk/backpressure_waits')
+            try:
+                await maybe_deferred_to_future(self.indexer.wait_for_capacity())
+            except Exception as e:
+                spider.logger.error(f"Erreur lors de l'indexation sur Elasticsearch: {e}")
+        return item
+
+    def write_item(self, item, spider):
+        """Ajoute les actions de l'item au tampon bulk, sans attendre (aussi utilisé par le loader du spool)."""
         category_hierarchy = item.get('category_hierarchy', [])
         category_main = category_hierarchy[1] if len(category_hierarchy) > 1 else None
         reviews = item.get('reviews', [])
@@ -89,39 +308,97 @@ class ElasticsearchPipeline:
             "commercial_message": item.get('commercial_message'),
             "rating": item.get('rating'),
             "review_count": item.get('review_count'),
+            "review_stats": item.get('review_stats'),
             "reviews": reviews
         }
-        # On collecte tous les secondaryRatings au niveau top-level pour l'agrégation
-        secondary_ratings = []
-        for review in reviews:
-            if review and review.get('secondaryRatings'):
-                secondary_ratings.extend(review['secondaryRatings'])
-        if secondary_ratings:
-            source["secondaryRatings"] = secondary_ratings
-        action = {
-            "_index": self.index_name,
-            "_source": source
+        if item.get('reviews_watermark') and item.get('product_id'):
+            # Crawl incrémental : mise à jour du document existant, les nouveaux avis sont ajoutés en tête
+            action = {
+                "_op_type": "update",
+                "_index": self.index_name,
+                "_id": item.get('product_id'),
+                "script": {
+                    "source": APPEND_REVIEWS_SCRIPT,
+                    "params": {
+                        "doc": {key: value for key, value in source.items() if key not in ('reviews', 'review_stats')},
+                        "reviews": reviews,
+                        "stats": item.get('review_stats')
+                    }
+                },
+                "upsert": source
+            }
+        else:
+            action = {
+                "_index": self.index_name,
+                "_source": source
+            }
+            # Un _id stable rend les renvois idempotents en cas de retry
+            if item.get('product_id'):
+                action["_id"] = item.get('product_id')
+        try:
+            # Un document par avis : un avis nouveau ou modifié ne réindexe que lui-même
+            actions = [action] + [self._review_action(review, item, category_main) for review in reviews]
+            self.indexer.extend(actions, tag=item.get('url'))
+        except Exception as e:
+            spider.logger.error(f"Erreur lors de l'indexation sur Elasticsearch: {e}")
+
+    def _review_action(self, review, item, category_main):
+        # normalize_review garantit un id ; à défaut (avis non normalisé), l'empreinte est calculée ici
+        doc_id = review.get('id') or review_id(review, item.get('product_id'))
+        return {
+            "_index": self.review_index_name,
+            "_id": doc_id,
+            "_source": {
+                **review,
+                "doc_id": doc_id,
+                "product_id": item.get('product_id'),
+                "product_name": item.get('name'),
+                "category_main": category_main,
+                "category_hierarchy": item.get('category_hierarchy', []),
+            }
         }
-        actions.append(action)
-        if actions:
-            try:
-                helpers.bulk(self.es, actions)
-            except Exception as e:
-                spider.logger.error(f"Erreur lors de l'indexation sur Elasticsearch: {e}")
-        return item
 
 class MongoDBPipeline:
-    def __init__(self, mongo_uri, mongo_db, collection_name):
+    def __init__(self, mongo_uri, mongo_db, collection_name, batch_size=500, flush_interval=5.0, stats=None,
+                 prior_weight=10.0, category_stats_collection='category_stats', generation_collection='dashboard_meta',
+                 history_collection='product_history', max_retries=3, retry_backoff=1.0, signals=None):
         self.mongo_uri = mongo_uri
         self.mongo_db = mongo_db
         self.collection_name = collection_name
+        self.category_stats_collection = category_stats_collection
+        self.generation_collection = generation_collection
+        self.history_collection = history_collection
+        self.data_generation = None
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.stats = stats
+        self.prior_weight = prior_weight
+        # Signaux du crawler : acquittement des items écrits (storage_acks)
+        self.signals = signals
+        self.writer = None
+        self.flush_loop = None
 
     @classmethod
     def from_crawler(cls, crawler):
+        if crawler.settings.getbool('SPOOL_ENABLED'):
+            # Les items passent par le spool : `scrapy load_spool mongodb` les écrit
+            raise NotConfigured("SPOOL_ENABLED : écriture par le loader du spool")
         return cls(
             mongo_uri=crawler.settings.get('MONGO_URI'),
             mongo_db=crawler.settings.get('MONGO_DATABASE', 'items'),
-            collection_name=crawler.settings.get('MONGO_COLLECTION', 'ikea_products')
+            collection_name=crawler.settings.get('MONGO_COLLECTION', 'ikea_products'),
+            batch_size=crawler.settings.getint('MONGO_BATCH_SIZE', 500),
+            flush_interval=crawler.settings.getfloat('MONGO_FLUSH_INTERVAL', 5.0),
+            stats=crawler.stats,
+            prior_weight=crawler.settings.getfloat('REVIEW_PRIOR_WEIGHT', 10.0),
+            category_stats_collection=crawler.settings.get('MONGO_CATEGORY_STATS_COLLECTION', 'category_stats'),
+            generation_collection=crawler.settings.get('DATA_GENERATION_COLLECTION', 'dashboard_meta'),
+            history_collection=crawler.settings.get('MONGO_HISTORY_COLLECTION', 'product_history'),
+            max_retries=crawler.settings.getint('MONGO_MAX_RETRIES', 3),
+            retry_backoff=crawler.settings.getfloat('MONGO_RETRY_BACKOFF', 1.0),
+            signals=crawler.signals
         )
 
     def open_spider(self, spider):
@@ -135,28 +412,416 @@ class MongoDBPipeline:
             spider.logger.error(f"[MongoDBPipeline] Erreur de connexion à MongoDB: {e}")
             self.client = None
             self.collection = None
+            return
+
+        # Un seul document par produit : index unique sur product_id, index simple sur l'URL (clé de repli)
+        try:
+            self.collection.create_index(
+                'product_id', unique=True, name='product_id_unique',
+                partialFilterExpression={'product_id': {'$type': 'string'}}
+            )
+            self.collection.create_index('url', name='url')
+        except Exception as e:
+            spider.logger.error(f"[MongoDBPipeline] Impossible de créer l'index unique (doublons existants ?): {e}")
+
+        # Statistiques par catégorie du dashboard, mises à jour par deltas à chaque lot
+        observers = []
+        if self.category_stats_collection:
+            category_stats = CategoryStats(self.db[self.category_stats_collection])
+            try:
+                ensure_category_indexes(category_stats.collection)
+            except Exception as e:
+                spider.logger.error(f"[MongoDBPipeline] Impossible de créer l'index de {self.category_stats_collection}: {e}")
+            observers.append(category_stats)
+
+        # Historique mensuel des prix et des notes : un point seulement quand un champ suivi change
+        if self.history_collection:
+            history = PriceHistory(self.db[self.history_collection])
+            try:
+                ensure_history_indexes(history.collection)
+            except Exception as e:
+                spider.logger.error(f"[MongoDBPipeline] Impossible de créer les index de {self.history_collection}: {e}")
+            observers.append(history)
+
+        if self.generation_collection:
+            self.data_generation = DataGeneration(self.db[self.generation_collection], logger=spider.logger, stats=self.stats)
+
+        self.writer = BulkUpserter(
+            self.collection,
+            batch_size=self.batch_size,
+            flush_interval=self.flush_interval,
+            logger=spider.logger,
+            stats=self.stats,
+            observers=observers,
+            on_flush=self.data_generation.bump if self.data_generation else None,
+            max_retries=self.max_retries,
+            retry_backoff=self.retry_backoff,
+            on_stored=self._on_stored if self.signals else None
+        )
+        if self.signals:
+            self.signals.send_catch_log(sink_opened, sink='mongodb')
+        self.flush_loop = task.LoopingCall(self._flush_if_due, spider)
+        self.flush_loop.start(max(self.flush_interval / 2, 0.5), now=False)
 
     def close_spider(self, spider):
+        if self.flush_loop and self.flush_loop.running:
+            self.flush_loop.stop()
+        if self.writer and self.writer.backlog():
+            # Lot en attente d'une nouvelle tentative : attendue sans bloquer le reactor
+            d = self._drain(spider)
+            d.addBoth(lambda _: self._finish(spider))
+            return maybe_deferred_to_future(d)
+        self._finish(spider)
+
+    @defer.inlineCallbacks
+    def _drain(self, spider):
+        from twisted.internet import reactor
+        while self.writer.backlog():
+            wait = self.writer.retry_wait()
+            if wait > 0:
+                yield task.deferLater(reactor, wait, lambda: None)
+            try:
+                self.writer.flush()
+            except Exception as e:
+                spider.logger.error(f"Erreur lors du flush final MongoDB: {e}")
+                return
+
+    def _finish(self, spider):
+        if self.writer:
+            try:
+                self.writer.close()
+            except Exception as e:
+                spider.logger.error(f"Erreur lors du flush final MongoDB: {e}")
+            try:
+                priors, updated = mongo_rescore(self.collection, self.prior_weight)
+                spider.logger.info(f"[MongoDBPipeline] {updated} scores recalculés avec les moyennes de {len(priors)} catégories")
+                if updated and self.data_generation:
+                    self.data_generation.bump()
+            except Exception as e:
+                spider.logger.error(f"Erreur lors du recalcul des scores MongoDB: {e}")
         if self.client:
             self.client.close()
 
-    def process_item(self, item, spider):
-        if self.collection is not None:
+    def _flush_if_due(self, spider):
+        try:
+            self.writer.flush_if_due()
+        except Exception as e:
+            spider.logger.error(f"Erreur lors de l'écriture MongoDB: {e}")
+
+    def _on_stored(self, urls):
+        self.signals.send_catch_log(items_stored, sink='mongodb', urls=urls)
+
+    async def process_item(self, item, spider):
+        self.write_item(item, spider)
+        if self.writer is not None and self.writer.overloaded():
+            # Lot en attente d'une nouvelle tentative : l'item attend que les écritures reprennent (mémoire bornée)
+            if self.stats is not None:
+                self.stats.inc_value('mongo_bulk/backpressure_waits')
             try:
-                self.collection.insert_one(dict(item))
-                spider.logger.debug(f"Item inséré dans MongoDB: {item.get('url')}")
+                await maybe_deferred_to_future(self.writer.wait_for_capacity())
             except Exception as e:
-                spider.logger.error(f"Erreur lors de l'insertion MongoDB: {e}")
+                spider.logger.error(f"Erreur lors de l'écriture MongoDB: {e}")
+        return item
+
+    def write_item(self, item, spider):
+        """Met l'item dans le lot d'upserts, sans attendre (aussi utilisé par le loader du spool)."""
+        if self.writer is None:
+            return
+        try:
+            doc = dict(item)
+            # Classement des messages commerciaux stocké avec le produit (agrégation de /page1)
+            doc['message_class'] = classify_commercial_messages(item.get('commercial_message'))
+            if self.writer.add(doc):
+                spider.logger.debug(f"Item mis en file pour MongoDB: {item.get('url')}")
+            else:
+                spider.logger.warning("Item sans product_id ni url, non écrit dans MongoDB")
+        except Exception as e:
+            spider.logger.error(f"Erreur lors de l'écriture MongoDB: {e}")
+
+class ReviewNormalizationPipeline:
+    """
+    Remplace les avis bruts de l'API par le schéma fixe de reviews.normalize_review
+    avant l'écriture dans MongoDB et Elasticsearch, et mesure la taille des avis
+    (JSON) avant et après normalisation.
+    """
+
+    def __init__(self, stats=None):
+        self.stats = stats
+        self.bytes_before = 0
+        self.bytes_after = 0
+        self.products = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(stats=crawler.stats)
+
+    def process_item(self, item, spider):
+        reviews = item.get('reviews')
+        if not reviews:
+            return item
+        normalized = [normalize_review(review, item.get('product_id')) for review in reviews if isinstance(review, dict)]
+        self.bytes_before += len(json.dumps(reviews, ensure_ascii=False, default=str).encode('utf-8'))
+        self.bytes_after += len(json.dumps(normalized, ensure_ascii=False).encode('utf-8'))
+        self.products += 1
+        item['reviews'] = normalized
+        return item
+
+    def close_spider(self, spider):
+        if not self.products:
+            return
+        report = {
+            'review_normalization/products': self.products,
+            'review_normalization/bytes_before': self.bytes_before,
+            'review_normalization/bytes_after': self.bytes_after,
+            'review_normalization/bytes_per_product_before': round(self.bytes_before / self.products),
+            'review_normalization/bytes_per_product_after': round(self.bytes_after / self.products),
+        }
+        if self.stats is not None:
+            for key, value in report.items():
+                self.stats.set_value(key, value)
+        spider.logger.info(
+            f"[Avis] {self.products} produits : {report['review_normalization/bytes_per_product_before']} -> "
+            f"{report['review_normalization/bytes_per_product_after']} octets d'avis par produit "
+            f"({1 - self.bytes_after / self.bytes_before:.0%} de moins)"
+        )
+
+
+class ReviewStatsPipeline:
+    """
+    Calcule à l'ingestion les agrégats des notes de chaque produit (nombre, somme,
+    moyenne) et son score de classement bayésien (ranking.py), stockés dans
+    `review_stats` par MongoDB et Elasticsearch : le dashboard classe les produits
+    par un simple tri au lieu de relire tous les avis.
+
+    La moyenne de la catégorie utilisée ici est celle des produits déjà vus pendant
+    le crawl (REVIEW_PRIOR_MEAN tant qu'il n'y en a pas) ; les pipelines de stockage
+    recalculent les scores avec les moyennes finales en fin de crawl.
+    """
+
+    def __init__(self, prior_weight=10.0, prior_mean=4.0, stats=None):
+        self.prior_weight = prior_weight
+        self.prior_mean = prior_mean
+        self.stats = stats
+        # Catégorie -> [nombre d'avis, somme des notes]
+        self.categories = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(
+            prior_weight=crawler.settings.getfloat('REVIEW_PRIOR_WEIGHT', 10.0),
+            prior_mean=crawler.settings.getfloat('REVIEW_PRIOR_MEAN', 4.0),
+            stats=crawler.stats
+        )
+
+    def process_item(self, item, spider):
+        stats = review_stats(item.get('reviews'))
+        totals = self.categories.setdefault(main_category(item.get('category_hierarchy')), [0, 0.0])
+        prior = totals[1] / totals[0] if totals[0] else self.prior_mean
+        stats['score'] = bayesian_score(stats['count'], stats['sum'], prior, self.prior_weight)
+        totals[0] += stats['count']
+        totals[1] += stats['sum']
+        item['review_stats'] = stats
+        if self.stats is not None:
+            self.stats.inc_value('review_stats/products')
+            self.stats.inc_value('review_stats/reviews', stats['count'])
         return item
 
+    def close_spider(self, spider):
+        if self.stats is not None:
+            self.stats.set_value('review_stats/categories', len(self.categories))
+
+
+class SpoolPipeline:
+    """
+    Écrit les items dans le spool local (spool.py) au lieu de MongoDB et
+    Elasticsearch, dont les pipelines sont alors désactivés : le débit du crawl
+    ne dépend plus de la latence des bases, et `scrapy load_spool <base>` les
+    charge dans un processus séparé, chaque base à son rythme. Le début et la
+    fin du crawl (avec sa raison) sont écrits dans le spool pour que le loader
+    recalcule les scores et bascule les alias au même moment qu'un crawl direct.
+    """
+
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024, frame_records=200, frame_interval=1.0,
+                 compresslevel=6, fsync=True, incremental=False, stats=None, signals=None):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.frame_records = frame_records
+        self.frame_interval = frame_interval
+        self.compresslevel = compresslevel
+        self.fsync = fsync
+        self.incremental = incremental
+        self.stats = stats
+        # Signaux du crawler : acquittement des items écrits (storage_acks)
+        self.signals = signals
+        self.writer = None
+        self.flush_loop = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('SPOOL_ENABLED'):
+            raise NotConfigured("SPOOL_ENABLED désactivé")
+        pipeline = cls(
+            directory=crawler.settings.get('SPOOL_DIR'),
+            segment_bytes=crawler.settings.getint('SPOOL_SEGMENT_BYTES', 64 * 1024 * 1024),
+            frame_records=crawler.settings.getint('SPOOL_FRAME_RECORDS', 200),
+            frame_interval=crawler.settings.getfloat('SPOOL_FRAME_INTERVAL', 1.0),
+            compresslevel=crawler.settings.getint('SPOOL_COMPRESSLEVEL', 6),
+            fsync=crawler.settings.getbool('SPOOL_FSYNC', True),
+            incremental=crawler.settings.getbool('INCREMENTAL_CRAWL'),
+            stats=crawler.stats,
+            signals=crawler.signals
+        )
+        # Le marqueur de fin porte la raison de fermeture, absente de close_spider
+        crawler.signals.connect(pipeline.spider_closed, signal=signals.spider_closed)
+        return pipeline
+
+    def open_spider(self, spider):
+        self.writer = SpoolWriter(
+            self.directory,
+            segment_bytes=self.segment_bytes,
+            frame_records=self.frame_records,
+            frame_interval=self.frame_interval,
+            compresslevel=self.compresslevel,
+            fsync=self.fsync,
+            logger=spider.logger,
+            stats=self.stats,
+            on_stored=self._on_stored if self.signals else None
+        )
+        self.writer.open()
+        if self.signals:
+            self.signals.send_catch_log(sink_opened, sink='spool')
+        self.writer.append({
+            'type': 'start',
+            'crawl_id': f'{spider.name}-{int(time.time())}',
+            'spider': spider.name,
+            'incremental': self.incremental,
+            'started_at': time.time()
+        })
+        self.flush_loop = task.LoopingCall(self._flush_if_due, spider)
+        self.flush_loop.start(max(self.frame_interval / 2, 0.5), now=False)
+
+    def close_spider(self, spider):
+        if self.flush_loop and self.flush_loop.running:
+            self.flush_loop.stop()
+        if self.writer is not None:
+            # Derniers items acquittés avant que le point de reprise ne soit fermé (spider_closed)
+            self._flush_if_due(spider, force=True)
+
+    def spider_closed(self, spider, reason):
+        if self.writer is None:
+            return
+        try:
+            self.writer.append({'type': 'end', 'reason': reason, 'finished_at': time.time()})
+            self.writer.close()
+        except Exception as e:
+            spider.logger.error(f"[SpoolPipeline] Erreur lors de la fermeture du spool: {e}")
+
+    def _flush_if_due(self, spider, force=False):
+        try:
+            if force:
+                self.writer.write_frame()
+            else:
+                self.writer.flush_if_due()
+        except Exception as e:
+            spider.logger.error(f"[SpoolPipeline] Erreur d'écriture dans le spool: {e}")
+
+    def _on_stored(self, urls):
+        self.signals.send_catch_log(items_stored, sink='spool', urls=urls)
+
+    def process_item(self, item, spider):
+        try:
+            self.writer.append({'type': 'item', 'item': dict(item)}, tag=item.get('url'))
+        except Exception as e:
+            spider.logger.error(f"[SpoolPipeline] Erreur d'écriture dans le spool: {e}")
+            if self.stats is not None:
+                self.stats.inc_value('spool/write_errors')
+        return item
+
+
 class DuplicatesPipeline:
-    def __init__(self):
-        self.urls_seen = set()
+    """
+    Écarte les produits déjà vus, identifiés par leur `product_id` (l'URL à défaut) :
+    les URL de variantes d'un même produit partagent le même identifiant.
+
+    Les empreintes sont conservées dans un fichier projeté en mémoire (FingerprintSet)
+    plutôt que dans un set d'URL : la mémoire ne dépend pas de la longueur des URL.
+    Le fichier ne couvre qu'un crawl et il est vidé à son ouverture : un re-crawl
+    renvoie chaque produit aux pipelines de stockage, qui rafraîchissent prix,
+    notes, avis et historique (les produits inchangés sont écartés plus tôt par
+    le crawl incrémental). Quand un crawl interrompu reprend (CHECKPOINT_PATH,
+    requêtes en attente), il est rempli avec les clés des produits que le point
+    de reprise sait écrits par les bases.
+    """
+
+    def __init__(self, path, capacity=1 << 20, bloom_bits_per_key=10, stats=None, checkpoint_path=None):
+        self.path = path
+        self.capacity = capacity
+        self.bloom_bits_per_key = bloom_bits_per_key
+        self.stats = stats
+        # Point de reprise du crawl : ses requêtes en attente indiquent un crawl repris
+        self.checkpoint_path = checkpoint_path
+        self.seen = None
+        self.lookups = 0
+        self.lookup_time = 0.0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        pipeline = cls(
+            path=crawler.settings.get('DEDUP_STORE_PATH'),
+            capacity=crawler.settings.getint('DEDUP_INITIAL_CAPACITY', 1 << 20),
+            bloom_bits_per_key=crawler.settings.getint('DEDUP_BLOOM_BITS_PER_KEY', 10),
+            stats=crawler.stats,
+            checkpoint_path=crawler.settings.get('CHECKPOINT_PATH') if crawler.settings.getbool('CHECKPOINT_ENABLED') else None,
+        )
+        crawler.signals.connect(pipeline.spider_closed, signal=signals.spider_closed)
+        return pipeline
+
+    def open_spider(self, spider):
+        self.seen = FingerprintSet(self.path, self.capacity, self.bloom_bits_per_key)
+        if len(self.seen):
+            # Empreintes du crawl précédent (ou de l'exécution interrompue, reconstruites ci-dessous)
+            self.seen.clear()
+        if not has_pending(self.checkpoint_path):
+            return
+        # Reprise : seuls les produits acquittés par les bases sont des doublons, ceux qui étaient
+        # encore dans les tampons d'écriture au moment de l'arrêt sont re-téléchargés et réécrits
+        for key in completed_keys(self.checkpoint_path):
+            self.seen.add(key)
+        spider.logger.info(f"[Dedup] Reprise du crawl : {len(self.seen)} produits déjà écrits repris depuis {self.checkpoint_path}")
 
     def process_item(self, item, spider):
-        if 'url' in item and item['url'] in self.urls_seen:
-            raise DropItem(f"Duplicate item found: {item['url']}")
-        else:
-            self.urls_seen.add(item['url'])
+        key = item_key(item)
+        if not key:
             return item
+        start = time.perf_counter()
+        added = self.seen.add(key)
+        self.lookup_time += time.perf_counter() - start
+        self.lookups += 1
+        if not added:
+            raise DuplicateItem(f"Duplicate item found: {key}")
+        return item
+
+    def spider_closed(self, spider, reason):
+        if self.seen is None:
+            return
+        keys = len(self.seen)
+        report = {
+            'dedup/keys': keys,
+            'dedup/file_bytes': self.seen.nbytes,
+            'dedup/capacity': self.seen.capacity,
+            'dedup/bytes_per_key': round(self.seen.nbytes / keys, 1) if keys else 0,
+            # Coût par clé une fois la table remplie (avant doublement)
+            'dedup/bytes_per_key_at_capacity': round(self.seen.nbytes / (self.seen.capacity * MAX_LOAD), 1),
+            'dedup/lookup_us_avg': round(self.lookup_time * 1e6 / self.lookups, 2) if self.lookups else 0,
+        }
+        if self.stats is not None:
+            for key, value in report.items():
+                self.stats.set_value(key, value)
+        spider.logger.info(
+            f"[Dedup] {keys} clés, {report['dedup/bytes_per_key']} octets par clé "
+            f"({report['dedup/bytes_per_key_at_capacity']} à pleine capacité), "
+            f"{report['dedup/lookup_us_avg']} µs par recherche"
+        )
+        self.seen.close()
+        self.seen = None
 
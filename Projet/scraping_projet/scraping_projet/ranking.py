@@ -0,0 +1,105 @@
+"""
+Agrégats d'avis par produit (nombre, somme, moyenne) et score de classement
+bayésien : la note moyenne du produit est tirée vers la moyenne de sa catégorie
+(`category_main`) d'autant plus fort qu'il a peu d'avis.
+
+    score = (poids * moyenne_catégorie + somme_des_notes) / (poids + nombre_d_avis)
+"""
+
+# Script painless de recalcul de la moyenne et du score avec les moyennes finales des catégories
+ES_RESCORE_SCRIPT = (
+    "def stats = ctx._source.review_stats; "
+    "if (stats == null) { ctx.op = 'noop'; return; } "
+    "def prior = params.priors.getOrDefault(ctx._source.category_main, params.default_mean); "
+    "stats.mean = stats.count > 0 ? stats.sum / stats.count : null; "
+    "stats.score = (params.weight * prior + stats.sum) / (params.weight + stats.count);"
+)
+
+
+def review_stats(reviews):
+    """Nombre, somme et moyenne des notes d'une liste d'avis normalisés (avis sans note ignorés)."""
+    ratings = [review['rating'] for review in reviews or () if isinstance(review, dict) and review.get('rating') is not None]
+    total = float(sum(ratings))
+    return {
+        'count': len(ratings),
+        'sum': total,
+        'mean': round(total / len(ratings), 4) if ratings else None,
+    }
+
+
+def bayesian_score(count, total, prior_mean, prior_weight):
+    return round((prior_weight * prior_mean + total) / (prior_weight + count), 4)
+
+
+def main_category(hierarchy):
+    return hierarchy[1] if hierarchy and len(hierarchy) > 1 else None
+
+
+def es_category_priors(es, index):
+    """Moyenne des notes de chaque catégorie, calculée sur tout l'index."""
+    res = es.search(index=index, size=0, aggs={
+        "categories": {
+            "terms": {"field": "category_main", "size": 10000},
+            "aggs": {
+                "count": {"sum": {"field": "review_stats.count"}},
+                "sum": {"sum": {"field": "review_stats.sum"}}
+            }
+        }
+    })
+    return {
+        bucket['key']: bucket['sum']['value'] / bucket['count']['value']
+        for bucket in res['aggregations']['categories']['buckets'] if bucket['count']['value']
+    }
+
+
+def es_rescore(es, index, prior_weight, default_mean):
+    """Recalcule le score de tous les produits de l'index avec les moyennes de catégorie finales."""
+    es.indices.refresh(index=index)
+    priors = es_category_priors(es, index)
+    res = es.update_by_query(index=index, conflicts='proceed', refresh=True, body={
+        "query": {"exists": {"field": "review_stats"}},
+        "script": {
+            "source": ES_RESCORE_SCRIPT,
+            "params": {"priors": priors, "weight": prior_weight, "default_mean": default_mean}
+        }
+    })
+    return priors, res.get('updated', 0)
+
+
+def mongo_category_priors(collection):
+    """Moyenne des notes de chaque catégorie (2e niveau de category_hierarchy) de la collection."""
+    pipeline = [
+        {"$match": {"review_stats.count": {"$gt": 0}}},
+        {"$group": {
+            "_id": {"$arrayElemAt": ["$category_hierarchy", 1]},
+            "count": {"$sum": "$review_stats.count"},
+            "sum": {"$sum": "$review_stats.sum"}
+        }}
+    ]
+    return {doc['_id']: doc['sum'] / doc['count'] for doc in collection.aggregate(pipeline) if doc['count']}
+
+
+def mongo_rescore(collection, prior_weight):
+    """
+    Recalcule moyenne et score côté serveur (une mise à jour par catégorie) ; les
+    produits des catégories sans aucun avis gardent le score calculé à l'ingestion.
+    """
+    priors = mongo_category_priors(collection)
+    updated = 0
+    for category, prior in priors.items():
+        result = collection.update_many(
+            {"category_hierarchy.1": category, "review_stats": {"$type": "object"}},
+            [{"$set": {
+                "review_stats.mean": {"$cond": [
+                    {"$gt": ["$review_stats.count", 0]},
+                    {"$round": [{"$divide": ["$review_stats.sum", "$review_stats.count"]}, 4]},
+                    None
+                ]},
+                "review_stats.score": {"$round": [{"$divide": [
+                    {"$add": [prior_weight * prior, "$review_stats.sum"]},
+                    {"$add": [prior_weight, "$review_stats.count"]}
+                ]}, 4]}
+            }}]
+        )
+        updated += result.modified_count
+    return priors, updated
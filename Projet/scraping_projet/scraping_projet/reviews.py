@@ -0,0 +1,132 @@
+"""
+Fonctions utilitaires autour des réponses de l'API des avis IKEA (tugc v5).
+"""
+import hashlib
+import json
+from datetime import timezone
+
+from .fingerprints import parse_review_date
+
+# Clés sous lesquelles l'API peut renvoyer la liste des avis
+REVIEW_LIST_KEYS = ('results', 'reviews', 'data', 'items', 'content')
+# Clés possibles du nombre total d'avis, à la racine ou dans le bloc de pagination
+REVIEW_TOTAL_KEYS = ('totalElements', 'totalResults', 'totalCount', 'total', 'count')
+
+
+def extract_reviews(payload):
+    """Renvoie la liste des avis contenue dans une réponse de l'API (liste brute ou enveloppe)."""
+    if isinstance(payload, list):
+        return [review for review in payload if isinstance(review, dict)]
+    if isinstance(payload, dict):
+        for key in REVIEW_LIST_KEYS:
+            value = payload.get(key)
+            if isinstance(value, list):
+                return [review for review in value if isinstance(review, dict)]
+    return []
+
+
+def extract_total(payload):
+    """Renvoie le nombre total d'avis annoncé par l'API, ou None s'il est absent."""
+    if not isinstance(payload, dict):
+        return None
+    for container in (payload, payload.get('page'), payload.get('pagination'), payload.get('meta')):
+        if not isinstance(container, dict):
+            continue
+        for key in REVIEW_TOTAL_KEYS:
+            value = container.get(key)
+            if isinstance(value, int) and not isinstance(value, bool):
+                return value
+    return None
+
+
+def merge_review_pages(pages):
+    """Concatène les pages d'avis dans l'ordre en supprimant les doublons (même id)."""
+    merged = []
+    seen = set()
+    for number in sorted(pages):
+        for review in pages[number]:
+            review_id = review.get('id')
+            if review_id is not None:
+                if review_id in seen:
+                    continue
+                seen.add(review_id)
+            merged.append(review)
+    return merged
+
+
+# Champs possibles de l'API pour chaque champ du schéma normalisé (le nom normalisé en dernier :
+# normaliser un avis déjà normalisé le laisse inchangé)
+REVIEW_TEXT_KEYS = ('text', 'comment', 'reviewText')
+REVIEW_LANGUAGE_KEYS = ('sourceLangCode', 'languageCode', 'language')
+REVIEW_COUNTRY_KEYS = ('sourceCountryCode', 'countryCode', 'country')
+REVIEW_SUBMITTED_KEYS = ('submissionOn', 'submittedOn', 'submissionTime', 'submitted_at')
+REVIEW_UPDATED_KEYS = ('updatedOn', 'lastModifiedOn', 'updated_at')
+
+
+def _first(review, keys):
+    for key in keys:
+        value = review.get(key)
+        if value not in (None, ''):
+            return value
+    return None
+
+
+def _as_float(value):
+    if isinstance(value, dict):
+        value = value.get('ratingValue')
+    if isinstance(value, bool) or value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _as_str(value):
+    return str(value) if value not in (None, '') else None
+
+
+def _as_date(value):
+    """Date ISO 8601 normalisée en UTC (`2024-01-31T12:00:00Z`), ou None."""
+    date = parse_review_date(value)
+    if date is None:
+        return None
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc)
+    return date.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def review_id(review, product_id=None):
+    """
+    Identifiant de l'avis : celui de l'API, sinon une empreinte stable de l'avis brut et
+    de son produit (jamais None : clé _id et départage du tri de la recherche).
+    """
+    value = _as_str(review.get('id'))
+    if value is not None:
+        return value
+    raw = json.dumps([product_id, review], sort_keys=True, ensure_ascii=False, default=str)
+    return 'h-' + hashlib.blake2b(raw.encode('utf-8'), digest_size=12).hexdigest()
+
+
+def normalize_review(review, product_id=None):
+    """
+    Convertit un avis brut de l'API en schéma fixe :
+    id, title, text, rating, secondary_ratings [{label, rating}], language, country,
+    submitted_at, updated_at. Les autres champs de l'API sont abandonnés ; un avis
+    sans id reçoit une empreinte calculée par review_id.
+    """
+    secondary = review.get('secondaryRatings') or review.get('secondary_ratings') or []
+    return {
+        'id': review_id(review, product_id),
+        'title': _as_str(review.get('title')),
+        'text': _as_str(_first(review, REVIEW_TEXT_KEYS)),
+        'rating': _as_float(review.get('primaryRating') or review.get('rating')),
+        'secondary_ratings': [
+            {'label': _as_str(rating.get('label') or rating.get('id')), 'rating': _as_float(rating.get('ratingValue', rating.get('rating')))}
+            for rating in secondary if isinstance(rating, dict)
+        ],
+        'language': _as_str(_first(review, REVIEW_LANGUAGE_KEYS)),
+        'country': _as_str(_first(review, REVIEW_COUNTRY_KEYS)),
+        'submitted_at': _as_date(_first(review, REVIEW_SUBMITTED_KEYS)),
+        'updated_at': _as_date(_first(review, REVIEW_UPDATED_KEYS)),
+    }
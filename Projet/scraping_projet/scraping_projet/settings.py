@@ -6,11 +6,94 @@ BOT_NAME = "scraping_projet"
 
 SPIDER_MODULES = ["scraping_projet.spiders"]
 NEWSPIDER_MODULE = "scraping_projet.spiders"
+COMMANDS_MODULE = "scraping_projet.commands"
 
 ROBOTSTXT_OBEY = True
 
+# Points d'entrée du crawl (surchargés par le benchmark pour viser le serveur de fixtures local)
+IKEA_START_URL = None
+REVIEWS_API_URL = "https://web-api.ikea.com/tugc/public/v5/reviews/fr/fr/{product_id}"
+
+# Pagination des avis : taille de page et nombre de pages demandées en parallèle pour un même produit
+REVIEWS_PAGE_SIZE = 20
+REVIEWS_CONCURRENCY_PER_PRODUCT = 4
+# Concurrence globale, puis concurrence de départ de chaque hôte (un slot de téléchargement par hôte) :
+# l'API JSON des avis supporte bien plus de requêtes simultanées que le site HTML
+CONCURRENT_REQUESTS = 96
+CONCURRENT_REQUESTS_PER_DOMAIN = 8
+DOWNLOAD_SLOTS = {
+   "www.ikea.com": {"concurrency": 8},
+   "web-api.ikea.com": {"concurrency": 16},
+}
+# Ajustement de la concurrence de chaque hôte selon la latence observée et le taux de 429/5xx
+# (voir AdaptiveConcurrencyMiddleware ; décisions dans les stats adaptive_concurrency/<hôte>/...)
+ADAPTIVE_CONCURRENCY_ENABLED = True
+ADAPTIVE_CONCURRENCY_HOSTS = {
+   "www.ikea.com": {"min": 1, "max": 16},
+   "web-api.ikea.com": {"min": 2, "max": 64},
+}
+ADAPTIVE_CONCURRENCY_MIN = 1
+ADAPTIVE_CONCURRENCY_MAX = 16
+ADAPTIVE_CONCURRENCY_ERROR_RATE = 0.05
+ADAPTIVE_CONCURRENCY_LATENCY_FACTOR = 2.0
+ADAPTIVE_CONCURRENCY_WINDOW = 20
+ADAPTIVE_CONCURRENCY_COOLDOWN = 5.0
+
+# Extraction des pages produit dans un pool de processus (0 = dans le processus Scrapy)
+# et nombre maximal de pages confiées au pool en même temps (0 = deux par processus)
+EXTRACTION_PROCESSES = int(os.environ.get('EXTRACTION_PROCESSES', '0'))
+EXTRACTION_MAX_PENDING = 0
+
+# Crawl incrémental : requêtes conditionnelles et empreintes par URL (scrapy crawl ikea -s INCREMENTAL_CRAWL=1)
+INCREMENTAL_CRAWL = os.environ.get('INCREMENTAL_CRAWL', '0') == '1'
+FINGERPRINT_STORE_PATH = os.environ.get('FINGERPRINT_STORE_PATH', 'state/fingerprints.sqlite')
+
+# Point de reprise sur disque : un conteneur relancé reprend le crawl là où il s'est arrêté
+CHECKPOINT_ENABLED = os.environ.get('CHECKPOINT_ENABLED', '1') == '1'
+CHECKPOINT_PATH = os.environ.get('CHECKPOINT_PATH', 'state/checkpoint.sqlite')
+
+# Déduplication des produits (product_id) : empreintes 64 bits dans un fichier projeté en mémoire,
+# propre au crawl en cours : vidé à l'ouverture, puis rempli avec les produits déjà écrits quand un crawl
+# interrompu reprend (point de reprise non vide)
+DEDUP_STORE_PATH = os.environ.get('DEDUP_STORE_PATH', 'state/dedup.bin')
+DEDUP_INITIAL_CAPACITY = 1 << 20
+DEDUP_BLOOM_BITS_PER_KEY = 10
+
+# Score de classement des produits : note moyenne tirée vers la moyenne de la catégorie,
+# avec un poids équivalent à REVIEW_PRIOR_WEIGHT avis (REVIEW_PRIOR_MEAN si la catégorie n'a aucun avis)
+REVIEW_PRIOR_WEIGHT = 10
+REVIEW_PRIOR_MEAN = 4.0
+
+# Frontière du crawl : les pages de catégorie et de liste (priorité < FRONTIER_HOLD_BELOW_PRIORITY)
+# entrent dans l'ordonnanceur au plus FRONTIER_MAX_DISCOVERY à la fois, et aucune au-delà de
+# FRONTIER_MAX_PENDING requêtes en attente : les pages produit et les avis se vident d'abord.
+# Les pages retenues en attendant leur tour restent en mémoire jusqu'à FRONTIER_MAX_HELD, puis
+# sont écrites sur disque dans FRONTIER_SPILL_DIR : la mémoire ne dépend pas de la taille du catalogue
+FRONTIER_MAX_PENDING = 2000
+FRONTIER_MAX_DISCOVERY = 16
+FRONTIER_HOLD_BELOW_PRIORITY = 20
+FRONTIER_MAX_HELD = 10000
+FRONTIER_SPILL_DIR = os.environ.get('FRONTIER_SPILL_DIR', 'state/frontier')
+# Les priorités des requêtes (avis > produits > listes > catégories) sont fixées par le spider ;
+# à priorité égale, la file mémoire LIFO poursuit la branche en cours
+SCHEDULER_MEMORY_QUEUE = "scrapy.squeues.LifoMemoryQueue"
+
+SPIDER_MIDDLEWARES = {
+   "scraping_projet.middlewares.CheckpointMiddleware": 950,
+   "scraping_projet.middlewares.FrontierBackpressureMiddleware": 50,
+}
+
+DOWNLOADER_MIDDLEWARES = {
+   "scraping_projet.middlewares.FrontierReleaseMiddleware": 50,
+   "scraping_projet.middlewares.ConditionalRequestMiddleware": 580,
+   "scraping_projet.middlewares.AdaptiveConcurrencyMiddleware": 590,
+}
+
 ITEM_PIPELINES = {
    "scraping_projet.pipelines.DuplicatesPipeline": 300,
+   "scraping_projet.pipelines.ReviewNormalizationPipeline": 350,
+   "scraping_projet.pipelines.ReviewStatsPipeline": 360,
+   "scraping_projet.pipelines.SpoolPipeline": 390,
    "scraping_projet.pipelines.MongoDBPipeline": 400,
    "scraping_projet.pipelines.ElasticsearchPipeline": 500,
 }
@@ -19,7 +102,51 @@ ITEM_PIPELINES = {
 MONGO_URI = os.environ.get('MONGO_URI', 'mongodb://mongodb:27017/')
 MONGO_DATABASE = 'ikea_db'
 MONGO_COLLECTION = 'products'
+# Upserts MongoDB regroupés par lots (taille maximale et délai maximal entre deux envois)
+MONGO_BATCH_SIZE = 500
+MONGO_FLUSH_INTERVAL = 5.0
+# Lot renvoyé après une erreur de connexion (délai doublé à chaque tentative), puis abandonné
+MONGO_MAX_RETRIES = 3
+MONGO_RETRY_BACKOFF = 1.0
+# Statistiques par catégorie lues par le dashboard (vide pour désactiver), reconstruites par `scrapy rebuild_category_stats`
+MONGO_CATEGORY_STATS_COLLECTION = 'category_stats'
+# Historique mensuel des prix, notes et messages commerciaux (un point par changement ; vide pour désactiver)
+MONGO_HISTORY_COLLECTION = 'product_history'
+# Compteur de génération des données incrémenté après chaque écriture visible : invalide le cache du dashboard
+DATA_GENERATION_COLLECTION = 'dashboard_meta'
+# Instantanés Parquet écrits par `scrapy snapshot_parquet` (lus par le dashboard si DASHBOARD_BACKEND=parquet)
+PARQUET_SNAPSHOT_DIR = os.environ.get('PARQUET_SNAPSHOT_DIR', 'snapshots')
+
+# Spool local entre le crawl et les bases (SPOOL_ENABLED=1) : le crawl écrit les items dans des segments
+# compressés, `scrapy load_spool mongodb|elasticsearch` les charge dans chaque base avec son propre offset
+SPOOL_ENABLED = os.environ.get('SPOOL_ENABLED', '0') == '1'
+SPOOL_DIR = os.environ.get('SPOOL_DIR', 'state/spool')
+SPOOL_SEGMENT_BYTES = 64 * 1024 * 1024
+# Items regroupés et compressés par trame (nombre maximal, délai maximal en secondes)
+SPOOL_FRAME_RECORDS = 200
+SPOOL_FRAME_INTERVAL = 1.0
+SPOOL_COMPRESSLEVEL = 6
+SPOOL_FSYNC = True
+# Bases chargées depuis le spool : un segment est supprimé quand toutes l'ont lu
+SPOOL_SINKS = ['mongodb', 'elasticsearch']
+SPOOL_POLL_INTERVAL = 1.0
+SPOOL_RETRY_DELAY = 5.0
 
 # Elasticsearch settings
 ELASTICSEARCH_HOSTS = os.environ.get('ELASTICSEARCH_HOSTS', 'http://localhost:9200')
+# Chaque crawl écrit dans un index versionné ; l'alias lu par le dashboard est basculé en fin de crawl
+ES_INDEX_ALIAS = 'ikea_reviews'
+# Index des avis à plat (un document par avis, produit dénormalisé), versionné de la même façon
+ES_REVIEW_INDEX_ALIAS = 'ikea_review_docs'
+ES_INDEX_KEEP_GENERATIONS = 1
+ES_INDEX_REPLICAS = 1
+
 
+# Indexation bulk Elasticsearch : envoi par lots (nombre de documents, taille ou délai)
+ES_BULK_MAX_DOCS = 500
+ES_BULK_MAX_BYTES = 5 * 1024 * 1024
+ES_BULK_FLUSH_INTERVAL = 5.0
+ES_BULK_MAX_RETRIES = 3
+ES_BULK_RETRY_BACKOFF = 1.0
+# Requêtes bulk envoyées depuis le pool de threads du reactor (False : dans le thread du reactor)
+ES_BULK_THREADED = True
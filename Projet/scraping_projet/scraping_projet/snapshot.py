@@ -0,0 +1,186 @@
+"""
+Instantané Parquet des produits et des avis normalisés, pour les analyses du
+dashboard hors de MongoDB (web_projet/parquet_backend.py).
+
+    <sortie>/products/crawl_date=2024-05-01/category_main=Meubles/part-0.parquet
+    <sortie>/reviews/crawl_date=2024-05-01/category_main=Meubles/part-0.parquet
+
+Les documents sont lus par lots au fil du curseur MongoDB et écrits par lots
+Arrow : la mémoire ne dépend pas de la taille de la collection. Réécrire un
+instantané à la même date remplace tout son répertoire `crawl_date=`, y
+compris les catégories disparues depuis.
+"""
+import os
+import shutil
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+except ImportError:  # dépendance optionnelle, vérifiée par la commande snapshot_parquet
+    pa = ds = None
+
+from .messages import classify_commercial_messages
+from .ranking import main_category
+
+# Champs MongoDB lus pour l'instantané des produits (les avis sont lus dans une seconde passe)
+SNAPSHOT_PRODUCT_FIELDS = ('product_id', 'name', 'price', 'url', 'category_hierarchy', 'rating', 'review_count',
+                           'commercial_message', 'message_class', 'review_stats')
+
+
+def _schemas():
+    partition_fields = [pa.field('crawl_date', pa.string()), pa.field('category_main', pa.string())]
+    products = pa.schema([
+        pa.field('product_id', pa.string()),
+        pa.field('name', pa.string()),
+        pa.field('price', pa.float64()),
+        pa.field('url', pa.string()),
+        pa.field('category_hierarchy', pa.list_(pa.string())),
+        # Niveaux 2 et 3 de la hiérarchie à plat, pour les regroupements de /page2
+        pa.field('category_2', pa.string()),
+        pa.field('category_3', pa.string()),
+        pa.field('rating', pa.float64()),
+        pa.field('review_count', pa.int64()),
+        pa.field('commercial_message', pa.list_(pa.string())),
+        pa.field('message_label', pa.string()),
+        pa.field('message_combined', pa.bool_()),
+        pa.field('reductions', pa.list_(pa.string())),
+        pa.field('review_stats_count', pa.int64()),
+        pa.field('review_stats_sum', pa.float64()),
+        pa.field('review_stats_mean', pa.float64()),
+        pa.field('review_stats_score', pa.float64()),
+        *partition_fields,
+    ])
+    reviews = pa.schema([
+        pa.field('product_id', pa.string()),
+        pa.field('id', pa.string()),
+        pa.field('title', pa.string()),
+        pa.field('text', pa.string()),
+        pa.field('rating', pa.float64()),
+        pa.field('secondary_ratings', pa.list_(pa.struct([pa.field('label', pa.string()), pa.field('rating', pa.float64())]))),
+        pa.field('language', pa.string()),
+        pa.field('country', pa.string()),
+        pa.field('submitted_at', pa.string()),
+        pa.field('updated_at', pa.string()),
+        *partition_fields,
+    ])
+    partitioning = ds.partitioning(pa.schema(partition_fields), flavor='hive')
+    return products, reviews, partitioning
+
+
+def _float(value):
+    try:
+        return float(value) if value is not None and not isinstance(value, bool) else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _int(value):
+    try:
+        return int(value) if value is not None and not isinstance(value, bool) else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _str(value):
+    return str(value) if value not in (None, '') else None
+
+
+def _level(hierarchy, level):
+    return _str(hierarchy[level]) if len(hierarchy) > level else None
+
+
+def product_row(doc, crawl_date):
+    hierarchy = [_str(name) for name in doc.get('category_hierarchy') or []]
+    messages = doc.get('commercial_message')
+    message_class = doc.get('message_class') or classify_commercial_messages(messages)
+    if isinstance(messages, str):
+        messages = [messages]
+    stats = doc.get('review_stats') or {}
+    return {
+        'product_id': _str(doc.get('product_id')),
+        'name': _str(doc.get('name')),
+        'price': _float(doc.get('price')),
+        'url': _str(doc.get('url')),
+        'category_hierarchy': hierarchy,
+        'category_2': _level(hierarchy, 2),
+        'category_3': _level(hierarchy, 3),
+        'rating': _float(doc.get('rating')),
+        'review_count': _int(doc.get('review_count')),
+        'commercial_message': [message for message in messages or [] if isinstance(message, str)],
+        'message_label': message_class['label'],
+        'message_combined': message_class['combined'],
+        'reductions': message_class['reductions'],
+        'review_stats_count': _int(stats.get('count')),
+        'review_stats_sum': _float(stats.get('sum')),
+        'review_stats_mean': _float(stats.get('mean')),
+        'review_stats_score': _float(stats.get('score')),
+        'crawl_date': crawl_date,
+        'category_main': main_category(hierarchy),
+    }
+
+
+def review_rows(doc, crawl_date):
+    hierarchy = doc.get('category_hierarchy') or []
+    for review in doc.get('reviews') or []:
+        if not isinstance(review, dict):
+            continue
+        yield {
+            'product_id': _str(doc.get('product_id')),
+            'id': _str(review.get('id')),
+            'title': _str(review.get('title')),
+            'text': _str(review.get('text')),
+            'rating': _float(review.get('rating')),
+            'secondary_ratings': [
+                {'label': _str(rating.get('label')), 'rating': _float(rating.get('rating'))}
+                for rating in review.get('secondary_ratings') or [] if isinstance(rating, dict)
+            ],
+            'language': _str(review.get('language')),
+            'country': _str(review.get('country')),
+            'submitted_at': _str(review.get('submitted_at')),
+            'updated_at': _str(review.get('updated_at')),
+            'crawl_date': crawl_date,
+            'category_main': _str(main_category(hierarchy)),
+        }
+
+
+def write_snapshot(products, output, crawl_date, batch_size=5000):
+    """
+    Écrit l'instantané des produits et des avis de la date `crawl_date` (AAAA-MM-JJ)
+    sous `output` ; renvoie {'products': n, 'reviews': n}.
+    """
+    product_schema, review_schema, partitioning = _schemas()
+    counts = {'products': 0, 'reviews': 0}
+
+    def batches(kind, schema):
+        # Deux passes sur la collection (une par jeu de données) : aucun des deux n'est gardé en mémoire
+        rows = []
+        fields = ('product_id', 'category_hierarchy', 'reviews') if kind == 'reviews' else SNAPSHOT_PRODUCT_FIELDS
+        projection = {field: 1 for field in fields}
+        for doc in products.find({}, projection, batch_size=batch_size):
+            if kind == 'products':
+                rows.append(product_row(doc, crawl_date))
+            else:
+                rows.extend(review_rows(doc, crawl_date))
+            if len(rows) >= batch_size:
+                counts[kind] += len(rows)
+                yield pa.RecordBatch.from_pylist(rows, schema=schema)
+                rows = []
+        if rows:
+            counts[kind] += len(rows)
+            yield pa.RecordBatch.from_pylist(rows, schema=schema)
+
+    for kind, schema in (('products', product_schema), ('reviews', review_schema)):
+        # delete_matching ne remplacerait que les catégories réécrites : une catégorie vidée resterait lisible
+        previous = os.path.join(output, kind, f'crawl_date={crawl_date}')
+        if os.path.isdir(previous):
+            shutil.rmtree(previous)
+        ds.write_dataset(
+            batches(kind, schema),
+            f'{output}/{kind}',
+            schema=schema,
+            format='parquet',
+            partitioning=partitioning,
+            existing_data_behavior='overwrite_or_ignore',
+            basename_template='part-{i}.parquet',
+        )
+    return counts
@@ -1,8 +1,16 @@
 import scrapy
+from scrapy import signals
 from scrapy.http import Request
 from ..items import IkeaProductItem
+from ..extraction import extract_product
+from ..extraction_pool import ExtractionPool
+from ..reviews import extract_reviews, extract_total, merge_review_pages
+from ..fingerprints import FingerprintStore, content_hash, newest_submission, parse_review_date
+from ..storage_acks import StoredItems
 import json
+import math
 import re
+from urllib.parse import urlparse
 
 class IkeaSpider(scrapy.Spider):
     # Debug flag
@@ -20,6 +28,41 @@ class IkeaSpider(scrapy.Spider):
     name = "ikea"
     allowed_domains = ["ikea.com", "web-api.ikea.com"]
     start_urls = ["https://www.ikea.com/fr/fr/cat/produits-products/"]
+    REVIEWS_API_URL = "https://web-api.ikea.com/tugc/public/v5/reviews/fr/fr/{product_id}"
+    # Empreintes par URL, ouvertes uniquement en mode incrémental (INCREMENTAL_CRAWL)
+    fingerprints = None
+    # URL -> (empreinte, filigrane des avis) des items renvoyés, mémorisés une fois écrits par les bases
+    pending_fingerprints = None
+    # Pool de processus pour l'extraction des pages produit (EXTRACTION_PROCESSES > 0)
+    extraction_pool = None
+    # Priorités : on termine un produit (avis) avant d'en ouvrir un autre, et on descend dans
+    # l'arbre des catégories (parcours en profondeur) avant d'en découvrir de nouvelles.
+    # Les pages de liste sont les feuilles de l'arbre : plus une catégorie est profonde,
+    # plus elle est prioritaire, sans jamais dépasser les pages produit.
+    PRIORITY_REVIEWS = 30
+    PRIORITY_PRODUCT = 20
+    PRIORITY_LISTING = 10
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        # Point d'entrée alternatif (serveur de fixtures du benchmark par exemple)
+        start_url = crawler.settings.get('IKEA_START_URL')
+        if start_url:
+            spider.start_urls = [start_url]
+            spider.allowed_domains = spider.allowed_domains + [urlparse(start_url).hostname]
+        api_host = urlparse(crawler.settings.get('REVIEWS_API_URL', '')).hostname
+        if api_host and api_host not in spider.allowed_domains:
+            spider.allowed_domains = spider.allowed_domains + [api_host]
+        if crawler.settings.getbool('INCREMENTAL_CRAWL'):
+            spider.fingerprints = FingerprintStore(crawler.settings.get('FINGERPRINT_STORE_PATH'))
+            spider.pending_fingerprints = {}
+            spider.stored_items = StoredItems(crawler, spider.item_stored)
+            crawler.signals.connect(spider.item_not_stored, signal=signals.item_dropped)
+            crawler.signals.connect(spider.item_not_stored, signal=signals.item_error)
+        if crawler.settings.getint('EXTRACTION_PROCESSES') > 0:
+            spider.extraction_pool = ExtractionPool.from_crawler(crawler)
+        return spider
 
     def parse(self, response, **kwargs):
         """
@@ -46,7 +89,8 @@ class IkeaSpider(scrapy.Spider):
                 yield Request(
                     url=response.urljoin(category_url),
                     callback=self.parse_sub_categories,
-                    meta={'category_path': [category_name.strip()]}
+                    meta={'category_path': [category_name.strip()]},
+                    priority=self.category_priority(1)
                 )
 
     def parse_sub_categories(self, response):
@@ -75,7 +119,8 @@ class IkeaSpider(scrapy.Spider):
                     yield Request(
                         url=response.urljoin(sub_cat_url),
                         callback=self.parse_sub_categories,
-                        meta={'category_path': new_category_path}
+                        meta={'category_path': new_category_path},
+                        priority=self.category_priority(len(new_category_path))
                     )
         if not found_subcat:
             if self.DEBUG:
@@ -98,128 +143,36 @@ class IkeaSpider(scrapy.Spider):
 
         for link in product_links:
             # Pour chaque lien, on suit vers la page de détails du produit.
-            yield response.follow(link, self.parse_product_details, meta=response.meta)
+            # Les pages produit sont éligibles aux requêtes conditionnelles du mode incrémental
+            yield response.follow(link, self.parse_product_details, meta={'category_path': response.meta.get('category_path'), 'conditional': True},
+                                  priority=self.PRIORITY_PRODUCT)
+
+    def category_priority(self, depth):
+        """Priorité d'une page de catégorie : croît avec la profondeur, plafonnée à celle des pages de liste."""
+        return min(depth, self.PRIORITY_LISTING)
 
-    def parse_product_details(self, response):
+    async def parse_product_details(self, response):
         """
         Cette fonction parse la page d'un produit pour en extraire les détails.
-        Elle utilise des sélecteurs CSS robustes pour gérer différentes mises en page.
+        L'extraction des champs est déléguée à extraction.extract_product, exécutée
+        dans un processus du pool si EXTRACTION_PROCESSES > 0.
         """
         if self.DEBUG:
             self.logger.info(f"[SCRAP] Page produit : {response.url}")
         self.message_counts['produit'] += 1
-        
-        item = IkeaProductItem()
-
-        # Message commercial (ex: "Nouveau", "Prix le plus bas")
-        commercial_message_element = response.css('div.pipf-price-package div.pipcom-commercial-message')
-        commercial_messages = []
-        if commercial_message_element:
-            # Récupère tout le texte contenu dans la balise, y compris les sous-éléments
-            commercial_message_parts = commercial_message_element.css('::text').getall()
-            for part in commercial_message_parts:
-                msg = part.strip()
-                if msg:
-                    commercial_messages.append(msg)
-
-        # Vérifie si le prix est mis en valeur (balise <em>) pour ajouter "Prix le plus bas"
-        if response.css('div.pipf-price-package em.pipcom-price'):
-            if not any('Prix le plus bas' in msg for msg in commercial_messages):
-                commercial_messages.append('Prix le plus bas')
-
-        # Test pour la détection de réduction via le message d'offre
-        try:
-            offer_message = response.css('div.pipcom-price-module__offer-message span.pipcom-typography-label-l::text').get()
-            if offer_message:
-                # Extrait le pourcentage du message, ex: "21% de réduction, ..."
-                match = re.search(r'(\d+)%', offer_message)
-                if match:
-                    reduction_percent = match.group(1)
-                    commercial_messages.append(f"Réduction {reduction_percent}%")
-        except Exception as e:
-            if self.DEBUG:
-                self.logger.info(f"Erreur détection réduction (offre): {e}")
-
-        # Nettoie les doublons et espaces
-        commercial_messages = list(dict.fromkeys([msg.strip() for msg in commercial_messages if msg.strip()]))
-        item['commercial_message'] = commercial_messages
-
-        # Hiérarchie des catégories depuis le fil d'Ariane
-        breadcrumb_links = response.css('ol.hnf-breadcrumb__list li.hnf-breadcrumb__list-item a span::text').getall()
-        categories = [cat.strip() for cat in breadcrumb_links if cat.strip()]
-        item['category_hierarchy'] = categories
-
-        # Nom du produit
-        item['name'] = response.css('h1 .pipcom-price-module__name-decorator::text').get(default='').strip()
-
-        # Description
-        description_parts = response.css('h1 .pipcom-price-module__description *::text').getall()
-        item['description'] = ' '.join(part.strip() for part in description_parts if part.strip())
-
-        # Prix
-        price_text_list = response.css('.pipcom-price__sr-text::text').getall()
-        price_text = None
-        for text in price_text_list:
-            if text.strip().startswith('Prix'):
-                price_text = text
-                break
-        
-        if price_text:
-            price_match = re.search(r'(\d+,\d+)', price_text)
-            if price_match:
-                item['price'] = float(price_match.group(1).replace(',', '.'))
-            else:
-                item['price'] = 0.0
-        else:
-            item['price'] = 0.0
 
-        # URL de l'image principale - première image de la galerie produit
-        # Cherche d'abord dans la galerie avec le thumbnail actif
-        image_url = response.css('div.pipf-product-gallery__thumbnail--active img::attr(src)').get()
-        
-        # Si la galerie n'existe pas, on essaie d'autres sélecteurs
-        if not image_url:
-            image_url = response.css('div.pipf-product-gallery__media--active img::attr(src)').get()
-        
-        # Fallback sur l'ancien sélecteur si nécessaire
-        if not image_url:
-            image_url = response.css('div.pip-media-grid__media-container img::attr(src)').get()
-        
-        item['image_url'] = image_url
-
-        # Évaluation (Rating)
-        rating_text = response.css('.pipf-rating .pipf-rating__stars::attr(aria-label)').get()
-        if rating_text:
-            # Extrait la note de "Avis: 4.4 sur 5 étoiles..."
-            rating_match = re.search(r'Avis:\s*([\d,\.]+)', rating_text)
-            if rating_match:
-                item['rating'] = float(rating_match.group(1).replace(',', '.'))
-            else:
-                item['rating'] = 0.0
-        else:
-            item['rating'] = 0.0
-            
-        # Nombre d'avis (Review Count)
-        review_count_text = response.css('.pipf-rating__label::text').get()
-        if review_count_text:
-            try:
-                item['review_count'] = int(review_count_text.strip('()'))
-            except (ValueError, TypeError):
-                item['review_count'] = 0
+        # Tous les champs sont relevés en un seul parcours de l'arbre HTML (voir extraction.py)
+        if self.extraction_pool is not None:
+            fields = await self.extraction_pool.extract(response)
         else:
-            # Si le sélecteur principal échoue, on essaie de l'extraire de l'aria-label
-            if rating_text:
-                review_match = re.search(r'Nombre total d\'avis:\s*(\d+)', rating_text)
-                if review_match:
-                    item['review_count'] = int(review_match.group(1))
-                else:
-                    item['review_count'] = 0
-            else:
-                item['review_count'] = 0
-
-        # URL de la page
-        item['url'] = response.url
+            fields = extract_product(response.text, response.url)
+        for result in self._product_results(IkeaProductItem(**fields), response):
+            yield result
 
+    def _product_results(self, item, response):
+        """
+        Complète l'item extrait (product_id, mode incrémental) et enchaîne la requête des avis.
+        """
         # Initialise reviews à une liste vide par défaut
         item['reviews'] = []
 
@@ -234,34 +187,23 @@ class IkeaSpider(scrapy.Spider):
 
             if product_id:
                 item['product_id'] = product_id
-                api_url = f"https://web-api.ikea.com/tugc/public/v5/reviews/fr/fr/{product_id}"
-
-                headers = {
-                    "Content-Type": "application/json",
-                    "Accept": "application/json, text/plain, */*",
-                    "x-client-id": "a1047798-0fc4-446e-9616-0afe3256d0d7",
-                    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/144.0.0.0 Safari/537.36"
-                }
 
-                payload = {
-                    "filter": {"and": [], "not": []},
-                    "sort": [{"field": "submissionOn", "direction": "desc"}],
-                    "page": {"size": 20, "number": 1}
-                }
+                if self.fingerprints is not None:
+                    previous = self.fingerprints.get(response.url)
+                    if previous and previous['content_hash'] == content_hash(item):
+                        # Champs identiques (y compris review_count) : ni avis ni pipelines à relancer
+                        self.crawler.stats.inc_value('incremental/unchanged')
+                        return
+                    if previous and previous['review_watermark']:
+                        # Seuls les avis postérieurs au dernier crawl seront demandés
+                        item['reviews_watermark'] = previous['review_watermark']
 
                 if self.DEBUG:
                     self.logger.info(f"[DEBUG] ID produit utilisé pour l'API : {product_id}")
-                    self.logger.info(f"[DEBUG] URL API : {api_url}")
                     self.logger.info(f"[DEBUG] Envoi requête POST avis pour {item['name']} (ID: {product_id})")
 
-                yield Request(
-                    url=api_url,
-                    method='POST',
-                    headers=headers,
-                    body=json.dumps(payload),
-                    callback=self.parse_reviews,
-                    meta={'item': item}
-                )
+                # Première page des avis : elle donne le total et déclenche la suite de la pagination
+                yield self.review_request(item, 1)
             else:
                 if self.DEBUG:
                     self.logger.warning(f"Product ID nettoyé est vide pour l'URL : {response.url}")
@@ -272,32 +214,133 @@ class IkeaSpider(scrapy.Spider):
                 self.logger.warning(f"Aucun product_id trouvé pour l'URL : {response.url}")
             yield item
 
+    def review_request(self, item, page, state=None):
+        """
+        Construit la requête POST vers l'API des avis pour une page donnée.
+        """
+        api_url = self.settings.get('REVIEWS_API_URL', self.REVIEWS_API_URL).format(product_id=item['product_id'])
+
+        headers = {
+            "Content-Type": "application/json",
+            "Accept": "application/json, text/plain, */*",
+            "x-client-id": "a1047798-0fc4-446e-9616-0afe3256d0d7",
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/144.0.0.0 Safari/537.36"
+        }
+
+        payload = {
+            "filter": {"and": [], "not": []},
+            "sort": [{"field": "submissionOn", "direction": "desc"}],
+            "page": {"size": self.settings.getint('REVIEWS_PAGE_SIZE', 20), "number": page}
+        }
+
+        return Request(
+            url=api_url,
+            method='POST',
+            headers=headers,
+            body=json.dumps(payload),
+            callback=self.parse_reviews,
+            errback=self.reviews_error,
+            meta={'item': item, 'review_page': page, 'reviews_state': state},
+            priority=self.PRIORITY_REVIEWS
+        )
+
     def parse_reviews(self, response):
         """
         Cette fonction parse la réponse JSON de l'API des avis.
+        La première page donne le nombre total d'avis : les pages restantes sont alors
+        demandées en parallèle (au plus REVIEWS_CONCURRENCY_PER_PRODUCT à la fois pour
+        un produit) et fusionnées dans l'item avant de le renvoyer.
         """
         item = response.meta['item']
         if self.DEBUG:
-            self.logger.info(f"[DEBUG] parse_reviews appelée pour {item.get('name', 'inconnu')} (ID: {item.get('product_id', 'N/A')})")
+            self.logger.info(f"[DEBUG] parse_reviews appelée pour {item.get('name', 'inconnu')} (ID: {item.get('product_id', 'N/A')}), page {response.meta.get('review_page', 1)}")
             self.logger.info(f"[DEBUG] Status code: {response.status}")
             self.logger.info(f"[DEBUG] Réponse brute API: {response.text}")
-        # Ajout log en dehors du try/except pour voir si parse_reviews est appelée même en cas d'erreur
-        self.logger.info(f"[DEBUG] parse_reviews: callback exécuté pour {item.get('name', 'inconnu')}")
         try:
-            # On stocke directement le JSON des avis
             reviews_data = json.loads(response.body)
-            self.logger.info(f"[DEBUG] Réponse brute API (parse_reviews): {reviews_data}")
-            if reviews_data:
-                item['reviews'] = reviews_data
-            else:
-                item['reviews'] = []
         except json.JSONDecodeError:
             self.logger.error(f"Impossible de parser le JSON des avis depuis {response.url}")
-            item['reviews'] = [] # Assure que le champ est une liste vide en cas d'erreur
+            reviews_data = None
+        yield from self._collect_review_page(response.meta, reviews_data)
+
+    def reviews_error(self, failure):
+        """
+        Une page d'avis en échec est comptée comme vide : l'item est tout de même renvoyé.
+        """
+        meta = failure.request.meta
+        self.logger.error(f"Échec de la récupération des avis (page {meta.get('review_page', 1)}) : {failure.value}")
+        yield from self._collect_review_page(meta, None)
+
+    def _collect_review_page(self, meta, reviews_data):
+        item = meta['item']
+        page = meta.get('review_page', 1)
+        state = meta.get('reviews_state')
+        reviews = extract_reviews(reviews_data)
+        page_size = self.settings.getint('REVIEWS_PAGE_SIZE', 20)
+
+        # Mode incrémental : les avis sont triés du plus récent au plus ancien, on s'arrête au filigrane
+        watermark = parse_review_date(item.get('reviews_watermark'))
+        watermark_reached = False
+        if watermark is not None:
+            fresh = [r for r in reviews if (parse_review_date(r.get('submissionOn')) or watermark) > watermark]
+            watermark_reached = len(fresh) < len(reviews)
+            page_full = len(reviews) >= page_size
+            reviews = fresh
+        else:
+            page_full = len(reviews) >= page_size
+
+        if state is None:
+            # Première page : le total annoncé par l'API prime sur celui lu dans la page produit
+            total = extract_total(reviews_data) or item.get('review_count') or 0
+            page_count = math.ceil(total / page_size) if page_size > 0 else 1
+            if page_count <= 1 or not page_full or watermark_reached:
+                item['reviews'] = reviews
+                yield self._finalize_item(item)
+                return
+            state = {'pages': {1: reviews}, 'queue': list(range(2, page_count + 1)), 'in_flight': 0}
+        else:
+            state['pages'][page] = reviews
+            state['in_flight'] -= 1
+            if watermark_reached:
+                state['queue'] = []
+
+        # Relance des pages en attente dans la limite de concurrence par produit
+        # (une page à la fois en mode incrémental, pour s'arrêter dès le filigrane atteint)
+        limit = 1 if watermark is not None else max(self.settings.getint('REVIEWS_CONCURRENCY_PER_PRODUCT', 4), 1)
+        while state['queue'] and state['in_flight'] < limit:
+            state['in_flight'] += 1
+            yield self.review_request(item, state['queue'].pop(0), state)
+
+        if not state['queue'] and state['in_flight'] == 0:
+            item['reviews'] = merge_review_pages(state['pages'])
+            if self.DEBUG:
+                self.logger.info(f"[DEBUG] {len(item['reviews'])} avis récupérés sur {len(state['pages'])} pages pour {item.get('product_id')}")
+            yield self._finalize_item(item)
+
+    def _finalize_item(self, item):
+        """
+        Calcule l'empreinte du produit et le filigrane de ses avis avant de le renvoyer.
+        Ils ne sont mémorisés qu'une fois l'item écrit par les bases (item_stored) : un
+        item perdu dans un tampon d'écriture n'est pas pris pour inchangé au crawl suivant.
+        """
+        if self.fingerprints is not None and item.get('url'):
+            self.pending_fingerprints[item['url']] = (content_hash(item), newest_submission(item.get('reviews')))
+        return item
+
+    def item_stored(self, url):
+        fingerprint = self.pending_fingerprints.pop(url, None)
+        if fingerprint is not None:
+            self.fingerprints.record_content(url, *fingerprint)
 
-        yield item
+    def item_not_stored(self, item, **kwargs):
+        # Item écarté ou en erreur dans les pipelines : rien à mémoriser
+        self.pending_fingerprints.pop(item.get('url'), None)
 
     def close(self, reason):
+        if self.fingerprints is not None:
+            self.fingerprints.close()
+        if self.extraction_pool is not None:
+            self.extraction_pool.close()
         if self.DEBUG:
             self.logger.info("\nRésumé des messages printés :")
             self.logger.info(f"Catégories principales : {self.message_counts['cat_principale']}")
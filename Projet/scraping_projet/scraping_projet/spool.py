@@ -0,0 +1,238 @@
+"""
+Spool local en ajout seul entre le crawl et les bases (MongoDB, Elasticsearch).
+
+SpoolPipeline y écrit les items au lieu de les envoyer aux bases ; le loader
+(`scrapy load_spool <sink>`, voir spool_loader.py) relit les segments et les
+charge dans chaque base, qui garde son propre offset.
+
+    <SPOOL_DIR>/segments/00000000000000000001.seg
+    <SPOOL_DIR>/offsets/mongodb.json        {"segment": 1, "position": 48213, ...}
+
+Un segment est une suite de trames :
+
+    longueur (4 octets, big-endian) | crc32 (4 octets) | lignes JSON compressées (zlib)
+
+Chaque ligne est un enregistrement : {"type": "item", "item": {...}}, ou un
+marqueur de début ({"type": "start", "crawl_id", "incremental", ...}) et de
+fin ({"type": "end", "reason"}) de crawl. Un segment n'est plus modifié une
+fois le suivant créé : une trame incomplète à la fin du dernier segment est en
+cours d'écriture, dans un segment plus ancien elle vient d'un crawl interrompu
+et elle est ignorée.
+"""
+import json
+import os
+import struct
+import time
+import zlib
+
+HEADER = struct.Struct('>II')
+SEGMENT_SUFFIX = '.seg'
+
+
+class SpoolError(Exception):
+    """Trame corrompue (somme de contrôle ou contenu illisible)."""
+
+
+def segments_dir(directory):
+    return os.path.join(directory, 'segments')
+
+
+def segment_path(directory, number):
+    return os.path.join(segments_dir(directory), f'{number:020d}{SEGMENT_SUFFIX}')
+
+
+def list_segments(directory):
+    """Numéros des segments existants, dans l'ordre d'écriture."""
+    try:
+        names = os.listdir(segments_dir(directory))
+    except FileNotFoundError:
+        return []
+    return sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in names
+                  if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit())
+
+
+def _fsync_dir(path):
+    # Rend durable la création ou le renommage d'un fichier du répertoire
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class SpoolWriter:
+    """
+    Ajoute des enregistrements au spool. Ils sont regroupés en trames de
+    `frame_records` enregistrements (ou toutes les `frame_interval` secondes),
+    compressées et écrites en un seul `write` ; un nouveau segment est commencé
+    au-delà de `segment_bytes`. Chaque processus écrit dans ses propres segments.
+    `on_stored` reçoit après chaque trame écrite (et synchronisée sur disque avec
+    `fsync`) les étiquettes passées à append() pour ses enregistrements.
+    """
+
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024, frame_records=200, frame_interval=1.0,
+                 compresslevel=6, fsync=True, logger=None, stats=None, stats_prefix='spool', on_stored=None):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.frame_records = frame_records
+        self.frame_interval = frame_interval
+        self.compresslevel = compresslevel
+        self.fsync = fsync
+        self.logger = logger
+        self.stats = stats
+        self.stats_prefix = stats_prefix
+        self.on_stored = on_stored
+        self.file = None
+        self.segment = None
+        self.pending = []
+        self.pending_tags = []
+        self.last_frame = time.monotonic()
+        self.bytes_raw = 0
+        self.bytes_written = 0
+
+    def open(self):
+        os.makedirs(segments_dir(self.directory), exist_ok=True)
+        existing = list_segments(self.directory)
+        # Jamais d'ajout à un segment existant : sa dernière trame peut être incomplète
+        self._start_segment(existing[-1] + 1 if existing else 1)
+
+    def append(self, record, tag=None):
+        self.pending.append(json.dumps(record, ensure_ascii=False, default=str, separators=(',', ':')).encode('utf-8'))
+        if tag is not None:
+            self.pending_tags.append(tag)
+        if len(self.pending) >= self.frame_records:
+            self.write_frame()
+
+    def flush_if_due(self):
+        if self.pending and time.monotonic() - self.last_frame >= self.frame_interval:
+            self.write_frame()
+
+    def write_frame(self):
+        self.last_frame = time.monotonic()
+        if not self.pending:
+            return
+        raw = b'\n'.join(self.pending)
+        payload = zlib.compress(raw, self.compresslevel)
+        records = len(self.pending)
+        tags = self.pending_tags
+        self.pending = []
+        self.pending_tags = []
+        self.file.write(HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+        self.bytes_raw += len(raw)
+        self.bytes_written += HEADER.size + len(payload)
+        self._inc('frames')
+        self._inc('records', records)
+        if tags and self.on_stored:
+            self.on_stored(tags)
+        if self.file.tell() >= self.segment_bytes:
+            self._close_segment()
+            self._start_segment(self.segment + 1)
+
+    def close(self):
+        if self.file is None:
+            return
+        self.write_frame()
+        self._close_segment()
+        ratio = self.bytes_raw / self.bytes_written if self.bytes_written else 0.0
+        if self.stats is not None:
+            self.stats.set_value(f'{self.stats_prefix}/bytes_raw', self.bytes_raw)
+            self.stats.set_value(f'{self.stats_prefix}/bytes_written', self.bytes_written)
+            self.stats.set_value(f'{self.stats_prefix}/compression_ratio', round(ratio, 2))
+        if self.logger:
+            self.logger.info(
+                f"[SpoolWriter] {self.bytes_raw / 1e6:.1f} Mo d'items écrits en {self.bytes_written / 1e6:.1f} Mo "
+                f"(compression x{ratio:.1f}) dans {self.directory}"
+            )
+
+    def _start_segment(self, number):
+        self.segment = number
+        self.file = open(segment_path(self.directory, number), 'ab')
+        if self.fsync:
+            _fsync_dir(segments_dir(self.directory))
+        self._inc('segments')
+
+    def _close_segment(self):
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+        self.file.close()
+        self.file = None
+
+    def _inc(self, key, count=1):
+        if self.stats is not None:
+            self.stats.inc_value(f'{self.stats_prefix}/{key}', count)
+
+
+def read_frames(directory, segment, position):
+    """
+    Trames du segment à partir de l'octet `position` : (enregistrements, position
+    suivante). S'arrête à la fin du segment ou sur une trame incomplète.
+    """
+    with open(segment_path(directory, segment), 'rb') as f:
+        f.seek(position)
+        while True:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return
+            length, checksum = HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                return
+            if zlib.crc32(payload) != checksum:
+                raise SpoolError(f"Trame corrompue dans le segment {segment} à l'octet {position}")
+            try:
+                records = [json.loads(line) for line in zlib.decompress(payload).split(b'\n')]
+            except (zlib.error, ValueError) as e:
+                raise SpoolError(f"Trame illisible dans le segment {segment} à l'octet {position}: {e}")
+            position += HEADER.size + length
+            yield records, position
+
+
+class SpoolOffsets:
+    """Offset d'un sink dans le spool, enregistré de façon atomique (fichier temporaire puis renommage)."""
+
+    def __init__(self, directory, sink):
+        self.directory = os.path.join(directory, 'offsets')
+        self.path = os.path.join(self.directory, f'{sink}.json')
+
+    def load(self):
+        """{'segment', 'position', 'crawl', 'crawl_start'} ; segment 0 si le sink n'a encore rien lu."""
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'segment': 0, 'position': 0, 'crawl': None, 'crawl_start': None}
+
+    def save(self, state):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        _fsync_dir(self.directory)
+
+
+def _first_needed_segment(state):
+    # Un crawl en cours peut être relu depuis son début : son premier segment est conservé
+    if state.get('crawl') and state.get('crawl_start'):
+        return state['crawl_start']['segment']
+    return state['segment']
+
+
+def purge(directory, sinks):
+    """Supprime les segments entièrement lus par tous les `sinks` ; renvoie leur nombre."""
+    if not sinks:
+        return 0
+    oldest = min(_first_needed_segment(SpoolOffsets(directory, sink).load()) for sink in sinks)
+    removed = 0
+    for number in list_segments(directory):
+        if number >= oldest:
+            break
+        os.remove(segment_path(directory, number))
+        removed += 1
+    return removed
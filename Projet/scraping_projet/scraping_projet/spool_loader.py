@@ -0,0 +1,271 @@
+"""
+Chargement du spool (spool.py) dans une base, hors du crawl :
+`scrapy load_spool mongodb|elasticsearch`.
+
+Les enregistrements sont rejoués dans le pipeline de la base (MongoDBPipeline,
+ElasticsearchPipeline) comme pendant le crawl : un marqueur de début ouvre le
+pipeline, un marqueur de fin le ferme (recalcul des scores, bascule d'alias).
+Après chaque trame, les écritures en attente sont envoyées puis l'offset de la
+base est enregistré ; si elle est injoignable, l'offset n'avance pas et la
+trame est rejouée à la reprise. Le chargement est donc « au moins une fois » :
+les upserts par produit et les _id Elasticsearch rendent la relecture d'un
+crawl complet idempotente, mais les nouveaux avis d'un crawl incrémental
+peuvent être ajoutés deux fois si une trame est rejouée après une écriture
+partielle.
+"""
+import logging
+import os
+import sys
+import time
+
+from scrapy import signals
+from scrapy.signalmanager import SignalManager
+from scrapy.statscollectors import MemoryStatsCollector
+
+from .pipelines import ElasticsearchPipeline, MongoDBPipeline
+from .spool import SpoolError, SpoolOffsets, list_segments, purge, read_frames, segment_path
+
+
+class SinkUnavailable(Exception):
+    """La base n'a rien accepté : l'offset n'avance pas, la trame sera rejouée."""
+
+
+class MongoSink:
+    name = 'mongodb'
+    pipeline_class = MongoDBPipeline
+    # Upserts par clé produit : un crawl interrompu reprend à l'offset
+    resumable = True
+
+    @staticmethod
+    def check(pipeline):
+        if pipeline.writer is None:
+            raise SinkUnavailable("connexion à MongoDB impossible")
+
+    @staticmethod
+    def counters(pipeline):
+        return pipeline.writer.docs_failed
+
+    @staticmethod
+    def drain(pipeline, counters):
+        writer = pipeline.writer
+        # Une seule tentative : les reprises avec délai sont celles du loader, depuis l'offset de la trame
+        writer.flush()
+        if writer.backlog() or writer.docs_failed > counters:
+            raise SinkUnavailable("écriture MongoDB impossible, trame conservée pour une nouvelle tentative")
+
+
+class ElasticsearchSink:
+    name = 'elasticsearch'
+    pipeline_class = ElasticsearchPipeline
+    # Une reprise ouvrirait une nouvelle génération d'index : le crawl est relu depuis son début
+    resumable = False
+
+    @staticmethod
+    def check(pipeline):
+        pass
+
+    @staticmethod
+    def counters(pipeline):
+        return pipeline.indexer.docs_indexed, pipeline.indexer.docs_failed
+
+    @staticmethod
+    def drain(pipeline, counters):
+        indexer = pipeline.indexer
+        while indexer.buffer:
+            wait = indexer.retry_wait()
+            if wait > 0:
+                time.sleep(wait)
+            indexer.flush()
+        indexed, failed = counters
+        # BulkIndexer abandonne les documents après ses retries : aucun indexé signifie une base indisponible
+        if indexer.docs_failed > failed and indexer.docs_indexed == indexed:
+            raise SinkUnavailable(f"{indexer.docs_failed - failed} documents refusés, aucun indexé")
+
+
+SINKS = {sink.name: sink for sink in (MongoSink, ElasticsearchSink)}
+
+
+class _LoaderCrawler:
+    """Réglages, signaux et stats passés à `from_crawler` des pipelines en dehors d'un crawl."""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.signals = SignalManager(self)
+        self.stats = MemoryStatsCollector(self)
+
+
+class _LoaderSpider:
+    """Nom et logger utilisés par les pipelines."""
+
+    def __init__(self, name):
+        self.name = name
+        self.logger = logging.getLogger(name)
+
+
+class SpoolLoader:
+
+    def __init__(self, sink, settings, directory, purge_sinks=(), poll_interval=1.0, retry_delay=5.0,
+                 max_retry_delay=60.0):
+        self.sink = SINKS[sink]
+        self.settings = settings
+        self.directory = directory
+        self.offsets = SpoolOffsets(directory, sink)
+        self.purge_sinks = list(purge_sinks)
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.spider = _LoaderSpider(f'spool.{sink}')
+        self.logger = self.spider.logger
+        self.crawler = None
+        self.pipeline = None
+        self.crawl = None
+        self.crawl_start = None
+        # Compteurs de la base au début de la trame, pour savoir si elle a accepté des écritures
+        self.frame_counters = None
+        self.loaded = 0
+
+    def reset(self):
+        """Relit tout le spool conservé depuis le début au prochain chargement."""
+        segments = list_segments(self.directory)
+        self.offsets.save({'segment': segments[0] if segments else 0, 'position': 0, 'crawl': None, 'crawl_start': None})
+
+    def run(self, follow=False):
+        """
+        Charge les trames jusqu'à la fin du spool (ou indéfiniment avec `follow`) ;
+        une base indisponible est réessayée avec un délai croissant. Renvoie le
+        nombre d'items chargés.
+        """
+        delay = self.retry_delay
+        while True:
+            try:
+                self._load(follow)
+                # Crawl en cours : l'offset enregistré permet de le reprendre au prochain chargement
+                self._discard()
+                return self.loaded
+            except SpoolError:
+                raise
+            except Exception as e:
+                self.logger.warning(f"[SpoolLoader] {self.sink.name} indisponible ({e}), reprise dans {delay:.0f} s")
+                self._discard()
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+
+    def _load(self, follow):
+        state = self.offsets.load()
+        skip = 0
+        if state.get('crawl') and not self.sink.resumable:
+            start = state['crawl_start']
+            state = {'segment': start['segment'], 'position': start['position'], 'crawl': None, 'crawl_start': None}
+            skip = start.get('record', 0)
+        elif state.get('crawl'):
+            self._open(state['crawl'], state['crawl_start'])
+        segment, position = state['segment'], state['position']
+
+        while True:
+            segments = list_segments(self.directory)
+            if segment not in segments:
+                later = [number for number in segments if number > segment]
+                if not later:
+                    if not follow:
+                        return
+                    time.sleep(self.poll_interval)
+                    continue
+                segment, position = later[0], 0
+            # Lu avant les trames : si un segment plus récent existe déjà, celui-ci ne grandira plus
+            later = [number for number in segments if number > segment]
+            for records, next_position in read_frames(self.directory, segment, position):
+                self.frame_counters = self.sink.counters(self.pipeline) if self.pipeline else None
+                for index, record in enumerate(records[skip:], start=skip):
+                    self._apply(record, segment, position, index)
+                skip = 0
+                if self.pipeline:
+                    self.sink.drain(self.pipeline, self.frame_counters)
+                position = next_position
+                self._save(segment, position)
+            if later:
+                size = os.path.getsize(segment_path(self.directory, segment))
+                if position < size:
+                    self.logger.warning(f"[SpoolLoader] Fin incomplète du segment {segment} ignorée ({size - position} octets)")
+                segment, position = later[0], 0
+                self._save(segment, position)
+            self._purge()
+            if later:
+                continue
+            if not follow:
+                return
+            time.sleep(self.poll_interval)
+
+    def _apply(self, record, segment, position, index):
+        kind = record.get('type')
+        if kind == 'start':
+            if self.pipeline:
+                # Crawl précédent sans marqueur de fin (processus tué) : pas de bascule d'alias
+                self._close('spool_interrupted')
+            self._open(record, {'segment': segment, 'position': position, 'record': index})
+        elif kind == 'end':
+            if self.pipeline:
+                self._close(record.get('reason') or 'finished')
+        elif kind == 'item':
+            if self.pipeline is None:
+                self.logger.warning("[SpoolLoader] Items sans marqueur de début de crawl, ouverture implicite")
+                self._open({'type': 'start', 'crawl_id': None, 'incremental': self.settings.getbool('INCREMENTAL_CRAWL')},
+                           {'segment': segment, 'position': position, 'record': index})
+            self.pipeline.write_item(record['item'], self.spider)
+            self.loaded += 1
+
+    def _open(self, marker, crawl_start):
+        settings = self.settings.copy()
+        settings.set('SPOOL_ENABLED', False)
+        # Le mode du crawl écrit dans le spool, pas celui du loader
+        settings.set('INCREMENTAL_CRAWL', bool(marker.get('incremental')))
+        # Les envois sont déclenchés par le loader après chaque trame (une erreur y remonte et l'offset
+        # n'avance pas), jamais par add() dont write_item se contente de journaliser les erreurs
+        settings.set('MONGO_BATCH_SIZE', sys.maxsize)
+        # Pas de reactor dans le loader : envois Elasticsearch synchrones
+        settings.set('ES_BULK_THREADED', False)
+        self.crawler = _LoaderCrawler(settings)
+        self.pipeline = self.sink.pipeline_class.from_crawler(self.crawler)
+        self.pipeline.open_spider(self.spider)
+        self.sink.check(self.pipeline)
+        self.frame_counters = self.sink.counters(self.pipeline)
+        self.crawl = marker
+        self.crawl_start = crawl_start
+        self.logger.info(f"[SpoolLoader] Chargement du crawl {marker.get('crawl_id')} dans {self.sink.name}")
+
+    def _close(self, reason):
+        self.sink.drain(self.pipeline, self.frame_counters)
+        self.pipeline.close_spider(self.spider)
+        # Recalcul des scores et bascule d'alias (ElasticsearchPipeline.spider_closed)
+        self.crawler.signals.send_catch_log(signal=signals.spider_closed, spider=self.spider, reason=reason)
+        self.logger.info(f"[SpoolLoader] Crawl {self.crawl.get('crawl_id')} chargé dans {self.sink.name} ({reason}), "
+                         f"{self.loaded} items depuis le lancement")
+        self.pipeline = None
+        self.crawler = None
+        self.crawl = None
+        self.crawl_start = None
+
+    def _discard(self):
+        # Pipeline abandonné après une erreur : rouvert depuis l'offset enregistré
+        pipeline, self.pipeline = self.pipeline, None
+        self.crawler = None
+        self.crawl = None
+        self.crawl_start = None
+        if pipeline is None:
+            return
+        flush_loop = getattr(pipeline, 'flush_loop', None)
+        if flush_loop and flush_loop.running:
+            flush_loop.stop()
+        for attribute in ('client', 'mongo_client', 'es'):
+            client = getattr(pipeline, attribute, None)
+            if client is not None:
+                client.close()
+
+    def _purge(self):
+        if not self.purge_sinks:
+            return
+        removed = purge(self.directory, self.purge_sinks)
+        if removed:
+            self.logger.info(f"[SpoolLoader] {removed} segment(s) lus par toutes les bases supprimés")
+
+    def _save(self, segment, position):
+        self.offsets.save({'segment': segment, 'position': position, 'crawl': self.crawl, 'crawl_start': self.crawl_start})
@@ -0,0 +1,42 @@
+from scrapy import signals
+
+# Signaux envoyés par les pipelines de stockage : un item n'est considéré comme
+# écrit qu'une fois acquitté par chacune des bases ouvertes
+sink_opened = object()      # sink : nom de la base (mongodb, elasticsearch, spool)
+items_stored = object()     # sink, urls : URL des items dont l'écriture a été acquittée
+
+
+class StoredItems:
+    """
+    Suit les acquittements des bases pour le compte d'un composant du crawl.
+
+    `on_stored(url)` est appelé quand chacune des bases ouvertes (signal
+    `sink_opened`) a acquitté l'item de la page `url` (signal `items_stored`),
+    ou dès `item_scraped` si aucune base n'est ouverte. Un item resté dans un
+    tampon d'écriture, ou abandonné par une base, n'est jamais signalé.
+    """
+
+    def __init__(self, crawler, on_stored):
+        self.on_stored = on_stored
+        self.sinks = set()
+        # URL -> bases qui ont déjà acquitté l'item
+        self.acked = {}
+        crawler.signals.connect(self.sink_opened, signal=sink_opened)
+        crawler.signals.connect(self.items_stored, signal=items_stored)
+        crawler.signals.connect(self.item_scraped, signal=signals.item_scraped)
+
+    def sink_opened(self, sink, **kwargs):
+        self.sinks.add(sink)
+
+    def items_stored(self, sink, urls, **kwargs):
+        for url in urls:
+            acked = self.acked.setdefault(url, set())
+            acked.add(sink)
+            if acked >= self.sinks:
+                del self.acked[url]
+                self.on_stored(url)
+
+    def item_scraped(self, item, spider, **kwargs):
+        if not self.sinks and item.get('url'):
+            # Aucune base ouverte : rien à attendre
+            self.on_stored(item['url'])
@@ -0,0 +1,53 @@
+from scraping_projet.category_stats import CategoryStats
+
+
+class FakeCollection:
+    def __init__(self):
+        self.operations = []
+
+    def bulk_write(self, operations, ordered=True):
+        self.operations.extend(operations)
+
+
+def increments(collection):
+    return {operation._filter['_id']: operation._doc['$inc'] for operation in collection.operations}
+
+
+KEY = (('product_id', '1'),)
+PRODUCT = {'product_id': '1', 'category_hierarchy': ['Produits', 'Meubles'], 'review_count': 2, 'rating': 4.0,
+           'commercial_message': []}
+
+
+def test_new_product_counts_in_every_level():
+    collection = FakeCollection()
+    assert CategoryStats(collection).apply({}, {KEY: PRODUCT}) == 2
+    assert increments(collection) == {
+        'Produits': {'products': 1, 'reviews': 2, 'rating_sum': 4, 'rating_count': 1},
+        'Produits > Meubles': {'products': 1, 'reviews': 2, 'rating_sum': 4, 'rating_count': 1},
+    }
+
+
+def test_updated_product_applies_only_the_difference():
+    collection = FakeCollection()
+    # $set partiel : la hiérarchie et la note viennent de la version précédente
+    CategoryStats(collection).apply({KEY: PRODUCT}, {KEY: {'product_id': '1', 'review_count': 5, 'rating': 4.5}})
+    assert increments(collection) == {
+        'Produits': {'reviews': 3, 'rating_sum': 0.5},
+        'Produits > Meubles': {'reviews': 3, 'rating_sum': 0.5},
+    }
+
+
+def test_unchanged_product_writes_nothing():
+    collection = FakeCollection()
+    assert CategoryStats(collection).apply({KEY: PRODUCT}, {KEY: dict(PRODUCT)}) == 0
+    assert collection.operations == []
+
+
+def test_moved_product_leaves_its_old_category():
+    collection = FakeCollection()
+    moved = {**PRODUCT, 'category_hierarchy': ['Produits', 'Rangement']}
+    CategoryStats(collection).apply({KEY: PRODUCT}, {KEY: moved})
+    assert increments(collection) == {
+        'Produits > Meubles': {'products': -1, 'reviews': -2, 'rating_sum': -4, 'rating_count': -1},
+        'Produits > Rangement': {'products': 1, 'reviews': 2, 'rating_sum': 4, 'rating_count': 1},
+    }
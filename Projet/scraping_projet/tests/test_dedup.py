@@ -0,0 +1,53 @@
+from scraping_projet.dedup import FingerprintSet
+
+
+def test_add_reports_known_keys(tmp_path):
+    seen = FingerprintSet(str(tmp_path / 'dedup.bin'), capacity=16)
+    assert seen.add('40299345')
+    assert not seen.add('40299345')
+    assert '40299345' in seen
+    assert 'inconnu' not in seen
+    assert len(seen) == 1
+    seen.close()
+
+
+def test_table_grows_past_max_load(tmp_path):
+    seen = FingerprintSet(str(tmp_path / 'dedup.bin'), capacity=8)
+    keys = [f'produit-{i}' for i in range(1000)]
+    assert all(seen.add(key) for key in keys)
+    assert seen.capacity >= 1024
+    assert all(key in seen for key in keys)
+    assert not any(f'autre-{i}' in seen for i in range(1000))
+    assert len(seen) == 1000
+    seen.close()
+
+
+def test_bloom_filter_is_optional(tmp_path):
+    with_bloom = FingerprintSet(str(tmp_path / 'bloom.bin'), capacity=64, bloom_bits_per_key=10)
+    without = FingerprintSet(str(tmp_path / 'plain.bin'), capacity=64, bloom_bits_per_key=0)
+    assert with_bloom.bloom_bits and not without.bloom_bits
+    for seen in (with_bloom, without):
+        for i in range(40):
+            seen.add(f'produit-{i}')
+        assert all(f'produit-{i}' in seen for i in range(40))
+        assert not any(f'autre-{i}' in seen for i in range(40))
+        seen.close()
+    # Le filtre de Bloom est à l'avant du fichier, devant la table
+    assert with_bloom.table_offset > without.table_offset
+
+
+def test_reopen_keeps_keys_and_clear_empties(tmp_path):
+    path = str(tmp_path / 'dedup.bin')
+    seen = FingerprintSet(path, capacity=8)
+    for i in range(20):
+        seen.add(f'produit-{i}')
+    seen.close()
+
+    reopened = FingerprintSet(path, capacity=8)
+    assert len(reopened) == 20
+    assert 'produit-7' in reopened
+    capacity = reopened.capacity
+    reopened.clear()
+    assert len(reopened) == 0 and 'produit-7' not in reopened
+    assert reopened.capacity == capacity
+    reopened.close()
@@ -0,0 +1,72 @@
+from twisted.internet import defer
+
+from scraping_projet import es_bulk
+from scraping_projet.es_bulk import BulkIndexer
+
+
+def fake_bulk(monkeypatch, outcomes):
+    """Remplace streaming_bulk : chaque envoi consomme la liste de résultats suivante."""
+    sent = []
+
+    def streaming_bulk(client, actions, **kwargs):
+        actions = list(actions)
+        sent.append(actions)
+        return outcomes.pop(0)[:len(actions)]
+
+    monkeypatch.setattr(es_bulk.helpers, 'streaming_bulk', streaming_bulk)
+    return sent
+
+
+def failure(status):
+    return False, {'index': {'status': status, 'error': 'refusé'}}
+
+
+def test_transient_failure_is_retried_then_indexed(monkeypatch):
+    sent = fake_bulk(monkeypatch, [[failure(429)], [(True, {})]])
+    indexer = BulkIndexer(None, max_retries=2, retry_backoff=0)
+    indexer.add({'_index': 'products', '_id': '1'})
+    indexer.flush()
+    assert len(indexer.buffer) == 1 and indexer.buffer[0][2] == 1
+    indexer.flush()
+    assert indexer.buffer == []
+    assert indexer.docs_indexed == 1 and indexer.docs_failed == 0
+    assert len(sent) == 2
+
+
+def test_transient_failure_is_abandoned_after_max_retries(monkeypatch):
+    fake_bulk(monkeypatch, [[failure(503)], [failure(503)]])
+    indexer = BulkIndexer(None, max_retries=1, retry_backoff=0)
+    indexer.add({'_index': 'products', '_id': '1'})
+    indexer.flush()
+    indexer.flush()
+    assert indexer.buffer == []
+    assert indexer.docs_failed == 1 and indexer.docs_indexed == 0
+
+
+def test_permanent_failure_is_not_retried(monkeypatch):
+    fake_bulk(monkeypatch, [[failure(400), (True, {})]])
+    indexer = BulkIndexer(None, max_retries=3, retry_backoff=0)
+    indexer.extend([{'_index': 'products', '_id': '1'}, {'_index': 'products', '_id': '2'}])
+    indexer.flush()
+    assert indexer.buffer == []
+    assert indexer.docs_failed == 1 and indexer.docs_indexed == 1
+
+
+def test_retry_waits_for_backoff(monkeypatch):
+    fake_bulk(monkeypatch, [[failure(429)]])
+    indexer = BulkIndexer(None, max_retries=3, retry_backoff=60)
+    indexer.add({'_index': 'products', '_id': '1'})
+    indexer.flush()
+    assert indexer.retry_wait() > 0
+    # Rien n'est prêt : aucun envoi avant la fin du délai
+    indexer.flush()
+    assert len(indexer.buffer) == 1
+
+
+def test_buffer_is_overloaded_while_a_flush_is_in_flight():
+    indexer = BulkIndexer(None, max_docs=2, threaded=True)
+    indexer.in_flight = defer.Deferred()
+    indexer.extend([{'_index': 'products', '_id': str(i)} for i in range(3)])
+    assert not indexer.overloaded()
+    indexer.add({'_index': 'products', '_id': '3'})
+    assert indexer.overloaded()
@@ -0,0 +1,53 @@
+from datetime import datetime, timezone
+
+from scraping_projet.history import PriceHistory
+
+
+class FakeCollection:
+    def __init__(self):
+        self.operations = []
+
+    def bulk_write(self, operations, ordered=True):
+        self.operations.extend(operations)
+
+
+NOW = datetime(2024, 5, 14, tzinfo=timezone.utc)
+KEY = (('product_id', '1'),)
+PRODUCT = {'product_id': '1', 'url': 'u1', 'name': 'BILLY', 'category_hierarchy': ['Produits', 'Rangement'],
+           'price': 59.0, 'rating': 4.5, 'review_count': 10, 'commercial_message': ['Nouveau']}
+
+
+def point(operation):
+    return operation._doc[0]['$set']['points']['$concatArrays'][1][0]['$literal']
+
+
+def test_unchanged_product_adds_no_point():
+    collection = FakeCollection()
+    # Ordre des messages différent : pas un changement
+    written = {**PRODUCT, 'commercial_message': ['Nouveau']}
+    assert PriceHistory(collection).apply({KEY: PRODUCT}, {KEY: written}, now=NOW) == 0
+    assert collection.operations == []
+
+
+def test_changed_price_adds_a_point_with_that_field_only():
+    collection = FakeCollection()
+    written = {'product_id': '1', 'price': 49.0}
+    assert PriceHistory(collection).apply({KEY: PRODUCT}, {KEY: written}, now=NOW) == 1
+    [operation] = collection.operations
+    assert operation._filter == {'_id': '1|2024-05'}
+    assert point(operation) == {'t': NOW, 'price': 49.0}
+    opening = operation._doc[0]['$set']['opening']['$ifNull'][1]['$literal']
+    assert opening['price'] == 59.0
+
+
+def test_new_product_records_every_tracked_field():
+    collection = FakeCollection()
+    assert PriceHistory(collection).apply({}, {KEY: PRODUCT}, now=NOW) == 1
+    assert set(point(collection.operations[0])) == {'t', 'price', 'rating', 'review_count', 'commercial_message', 'discount'}
+
+
+def test_price_drop_is_a_percentage():
+    collection = FakeCollection()
+    PriceHistory(collection).apply({KEY: PRODUCT}, {KEY: {'product_id': '1', 'price': 49.0}}, now=NOW)
+    price_drop_pct = collection.operations[0]._doc[1]['$set']['price_drop_pct']['$cond'][1]
+    assert price_drop_pct['$multiply'][1] == 100
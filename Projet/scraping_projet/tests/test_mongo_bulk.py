@@ -0,0 +1,126 @@
+from pymongo.errors import AutoReconnect
+
+from scraping_projet.mongo_bulk import BulkUpserter
+
+
+class FakeResult:
+    def __init__(self, count):
+        self.upserted_count = count
+        self.matched_count = 0
+
+
+class FakeCollection:
+    """Collection qui échoue `failures` fois (erreur de connexion) puis enregistre les lots."""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.batches = []
+
+    def bulk_write(self, operations, ordered=True):
+        if self.failures:
+            self.failures -= 1
+            raise AutoReconnect('connexion perdue')
+        self.batches.append(operations)
+        return FakeResult(len(operations))
+
+    def find(self, query, projection=None):
+        return []
+
+
+def written_ids(operations):
+    return sorted(operation._filter['product_id'] for operation in operations)
+
+
+def test_batch_is_retried_after_connection_error():
+    stored = []
+    collection = FakeCollection(failures=1)
+    writer = BulkUpserter(collection, batch_size=2, retry_backoff=0, on_stored=stored.extend)
+    writer.add({'product_id': '1', 'url': 'u1'})
+    writer.add({'product_id': '2', 'url': 'u2'})
+    assert collection.batches == [] and writer.backlog() == 2
+    writer.flush()
+    assert written_ids(collection.batches[0]) == ['1', '2']
+    assert writer.backlog() == 0 and writer.docs_failed == 0
+    assert sorted(stored) == ['u1', 'u2']
+
+
+def test_abandon_drops_only_the_attempted_batch():
+    stored = []
+    collection = FakeCollection(failures=2)
+    writer = BulkUpserter(collection, batch_size=2, max_retries=1, retry_backoff=0, on_stored=stored.extend)
+    writer.add({'product_id': '1', 'url': 'u1'})
+    writer.add({'product_id': '2', 'url': 'u2'})
+    # Ajouté pendant la panne : ne fait pas partie du lot envoyé
+    writer.add({'product_id': '3', 'url': 'u3'})
+    writer.flush()
+    assert writer.docs_failed == 2
+    assert writer.backlog() == 1
+    writer.flush()
+    assert written_ids(collection.batches[0]) == ['3']
+    assert stored == ['u3']
+
+
+def test_documents_added_during_retry_are_sent_after_the_batch():
+    collection = FakeCollection(failures=1)
+    writer = BulkUpserter(collection, batch_size=10, retry_backoff=0)
+    writer.add({'product_id': '1'})
+    writer.flush()
+    writer.add({'product_id': '2'})
+    writer.flush()
+    writer.flush()
+    assert [written_ids(batch) for batch in collection.batches] == [['1'], ['2']]
+
+
+def test_overloaded_until_the_retry_succeeds():
+    collection = FakeCollection(failures=1)
+    writer = BulkUpserter(collection, batch_size=2, retry_backoff=60)
+    writer.add({'product_id': '1'})
+    writer.add({'product_id': '2'})
+    writer.add({'product_id': '3'})
+    assert not writer.overloaded()
+    writer.add({'product_id': '4'})
+    assert writer.overloaded()
+    writer.retry_at = 0.0
+    d = writer.wait_for_capacity()
+    assert d.called
+    assert not writer.overloaded()
+    assert written_ids(collection.batches[0]) == ['1', '2']
+
+
+def incremental(reviews, count, total):
+    return {'product_id': '1', 'price': count, 'reviews_watermark': '2024-01-01', 'reviews': reviews,
+            'review_stats': {'count': count, 'sum': total}}
+
+
+def test_incremental_updates_of_a_product_are_merged():
+    collection = FakeCollection()
+    writer = BulkUpserter(collection, batch_size=10)
+    writer.add(incremental([{'id': 'a'}], 1, 4.0))
+    writer.add(incremental([{'id': 'b'}, {'id': 'c'}], 2, 9.0))
+    writer.flush()
+    [operation] = collection.batches[0]
+    assert operation._doc['$set']['price'] == 2
+    assert operation._doc['$push']['reviews']['$each'] == [{'id': 'b'}, {'id': 'c'}, {'id': 'a'}]
+    assert operation._doc['$inc'] == {'review_stats.count': 3, 'review_stats.sum': 13.0}
+
+
+def test_new_reviews_after_a_full_version_stay_in_set():
+    collection = FakeCollection()
+    writer = BulkUpserter(collection, batch_size=10)
+    writer.add({'product_id': '1', 'reviews': [{'id': 'a'}], 'review_stats': {'count': 1, 'sum': 4.0, 'mean': 4.0}})
+    writer.add(incremental([{'id': 'b'}], 1, 5.0))
+    writer.flush()
+    [operation] = collection.batches[0]
+    assert '$push' not in operation._doc and '$inc' not in operation._doc
+    assert operation._doc['$set']['reviews'] == [{'id': 'b'}, {'id': 'a'}]
+    assert operation._doc['$set']['review_stats'] == {'count': 2, 'sum': 9.0, 'mean': 4.0}
+
+
+def test_full_version_replaces_earlier_updates():
+    collection = FakeCollection()
+    writer = BulkUpserter(collection, batch_size=10)
+    writer.add(incremental([{'id': 'b'}], 1, 5.0))
+    writer.add({'product_id': '1', 'reviews': [{'id': 'b'}, {'id': 'a'}]})
+    writer.flush()
+    [operation] = collection.batches[0]
+    assert operation._doc == {'$set': {'product_id': '1', 'reviews': [{'id': 'b'}, {'id': 'a'}]}}
@@ -0,0 +1,84 @@
+import os
+
+import pytest
+
+from scraping_projet.spool import HEADER, SpoolError, SpoolOffsets, SpoolWriter, list_segments, purge, read_frames, segment_path
+
+
+def write_spool(directory, records, **kwargs):
+    writer = SpoolWriter(str(directory), fsync=False, **kwargs)
+    writer.open()
+    for record in records:
+        writer.append(record)
+    writer.close()
+    return writer
+
+
+def test_frames_round_trip(tmp_path):
+    records = [{'type': 'item', 'item': {'product_id': str(i), 'name': 'Étagère'}} for i in range(5)]
+    write_spool(tmp_path, records, frame_records=2)
+    frames = list(read_frames(str(tmp_path), 1, 0))
+    assert [len(frame) for frame, _ in frames] == [2, 2, 1]
+    assert [record for frame, _ in frames for record in frame] == records
+    assert frames[-1][1] == os.path.getsize(segment_path(str(tmp_path), 1))
+
+
+def test_tags_are_acknowledged_after_each_frame(tmp_path):
+    stored = []
+    writer = SpoolWriter(str(tmp_path), frame_records=2, fsync=False, on_stored=stored.append)
+    writer.open()
+    writer.append({'type': 'item'}, tag='u1')
+    assert stored == []
+    writer.append({'type': 'item'}, tag='u2')
+    assert stored == [['u1', 'u2']]
+    writer.append({'type': 'end'})
+    writer.close()
+    assert stored == [['u1', 'u2']]
+
+
+def test_corrupted_frame_fails_the_checksum(tmp_path):
+    write_spool(tmp_path, [{'type': 'item', 'item': {'product_id': '1'}}])
+    path = segment_path(str(tmp_path), 1)
+    with open(path, 'r+b') as f:
+        f.seek(HEADER.size + 2)
+        byte = f.read(1)
+        f.seek(HEADER.size + 2)
+        f.write(bytes([byte[0] ^ 0xFF]))
+    with pytest.raises(SpoolError):
+        list(read_frames(str(tmp_path), 1, 0))
+
+
+def test_torn_tail_is_not_read(tmp_path):
+    write_spool(tmp_path, [{'type': 'item', 'item': {'product_id': str(i)}} for i in range(3)], frame_records=1)
+    path = segment_path(str(tmp_path), 1)
+    complete = [position for _, position in read_frames(str(tmp_path), 1, 0)]
+    # Dernière trame coupée au milieu (processus tué pendant l'écriture)
+    with open(path, 'r+b') as f:
+        f.truncate(complete[-1] - 3)
+    frames = list(read_frames(str(tmp_path), 1, 0))
+    assert [position for _, position in frames] == complete[:2]
+    # Reprise depuis l'offset de la dernière trame complète
+    assert list(read_frames(str(tmp_path), 1, complete[1])) == []
+
+
+def test_segments_are_purged_once_every_sink_has_read_them(tmp_path):
+    write_spool(tmp_path, [{'type': 'item', 'item': {'product_id': str(i)}} for i in range(4)],
+                frame_records=1, segment_bytes=1)
+    # Une trame par segment, plus le segment vide ouvert après la dernière
+    assert list_segments(str(tmp_path)) == [1, 2, 3, 4, 5]
+    SpoolOffsets(str(tmp_path), 'mongodb').save({'segment': 3, 'position': 0, 'crawl': None, 'crawl_start': None})
+    # Base qui n'a encore rien lu : aucun segment supprimé
+    assert purge(str(tmp_path), ['mongodb', 'elasticsearch']) == 0
+    SpoolOffsets(str(tmp_path), 'elasticsearch').save({'segment': 2, 'position': 0, 'crawl': None, 'crawl_start': None})
+    assert purge(str(tmp_path), ['mongodb', 'elasticsearch']) == 1
+    assert list_segments(str(tmp_path)) == [2, 3, 4, 5]
+    assert SpoolOffsets(str(tmp_path), 'mongodb').load()['segment'] == 3
+
+
+def test_crawl_in_progress_keeps_its_first_segment(tmp_path):
+    write_spool(tmp_path, [{'type': 'item'} for _ in range(3)], frame_records=1, segment_bytes=1)
+    SpoolOffsets(str(tmp_path), 'elasticsearch').save({
+        'segment': 3, 'position': 0, 'crawl': 'ikea-1', 'crawl_start': {'segment': 2, 'position': 0, 'record': 0}
+    })
+    assert purge(str(tmp_path), ['elasticsearch']) == 1
+    assert list_segments(str(tmp_path)) == [2, 3, 4]
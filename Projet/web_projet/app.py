@@ -1,19 +1,159 @@
-from flask import Flask, render_template, request
+from flask import Flask, Response, g, jsonify, make_response, render_template, request, stream_with_context
 from pymongo import MongoClient
 from elasticsearch import Elasticsearch
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+import base64
+import json
 import os
+import threading
+import time
 
 app = Flask(__name__)
 
 # Configuration MongoDB
 MONGO_URI = os.environ.get('MONGO_URI', 'mongodb://localhost:27017/')
-client = MongoClient(MONGO_URI)
+# Connexions MongoDB ouvertes au plus par le processus (partagées par les threads des requêtes et du pool)
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '50'))
+client = MongoClient(MONGO_URI, maxPoolSize=MONGO_MAX_POOL_SIZE)
 db = client['ikea_db']
 collection = db['products']
 
 # Configuration Elasticsearch
 ES_HOSTS = os.environ.get('ELASTICSEARCH_HOSTS', 'http://elasticsearch:9200')
-es = Elasticsearch(ES_HOSTS)
+# Connexions HTTP gardées ouvertes par nœud Elasticsearch
+ES_MAX_CONNECTIONS = int(os.environ.get('ES_MAX_CONNECTIONS', '25'))
+es = Elasticsearch(ES_HOSTS, maxsize=ES_MAX_CONNECTIONS)
+# Alias basculé par le scraping en fin de crawl : on ne lit jamais un index en cours de construction
+ES_INDEX = os.environ.get('ES_INDEX_ALIAS', 'ikea_reviews')
+# Index des avis à plat (un document par avis, avec le nom et la catégorie du produit)
+ES_REVIEW_INDEX = os.environ.get('ES_REVIEW_INDEX_ALIAS', 'ikea_review_docs')
+
+# Moteur des agrégations de /page1 à /page3 : 'mongo' (collection vivante, par défaut) ou 'parquet'
+# (dernier instantané écrit par `scrapy snapshot_parquet` dans PARQUET_SNAPSHOT_DIR, pyarrow requis)
+DASHBOARD_BACKEND = os.environ.get('DASHBOARD_BACKEND', 'mongo')
+parquet_snapshot = None
+if DASHBOARD_BACKEND == 'parquet':
+    import parquet_backend
+    parquet_snapshot = parquet_backend.ParquetSnapshot(os.environ.get('PARQUET_SNAPSHOT_DIR', 'snapshots'))
+
+# Pool partagé pour lancer en parallèle les requêtes indépendantes d'une même page :
+# la latence d'une page est celle de sa requête la plus lente, pas la somme des allers-retours
+QUERY_POOL_SIZE = int(os.environ.get('QUERY_POOL_SIZE', '32'))
+query_pool = ThreadPoolExecutor(max_workers=QUERY_POOL_SIZE, thread_name_prefix='dashboard-query')
+
+
+def run_concurrently(**queries):
+    """
+    Exécute les fonctions sans argument `queries` sur query_pool et renvoie {nom: résultat}
+    (les valeurs None sont ignorées). Ne pas appeler depuis une tâche du pool lui-même.
+    """
+    futures = {name: query_pool.submit(query) for name, query in queries.items() if query is not None}
+    return {name: future.result() for name, future in futures.items()}
+
+# Cache des pages calculées : une entrée par route et paramètres, valable tant que le compteur de
+# génération des données (incrémenté par les pipelines du scraping après chaque écriture) n'a pas bougé
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', '256'))
+CACHE_TTL = float(os.environ.get('CACHE_TTL', '600'))
+# Le compteur est relu au plus une fois par intervalle (secondes)
+CACHE_GENERATION_POLL_INTERVAL = float(os.environ.get('CACHE_GENERATION_POLL_INTERVAL', '1.0'))
+data_generation = db[os.environ.get('DATA_GENERATION_COLLECTION', 'dashboard_meta')]
+
+
+class ResponseCache:
+    """Cache LRU borné en nombre d'entrées et en durée, invalidé par la génération des données."""
+
+    def __init__(self, max_entries, ttl, poll_interval):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        # Clé -> (génération, date d'expiration, page)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.current_generation = None
+        self.generation_checked = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def generation(self):
+        """Génération courante des données, ou None si MongoDB ne répond pas (cache contourné)."""
+        now = time.monotonic()
+        with self.lock:
+            if self.generation_checked is not None and now - self.generation_checked < self.poll_interval:
+                return self.current_generation
+            self.generation_checked = now
+        try:
+            doc = data_generation.find_one({'_id': 'generation'}, {'generation': 1})
+            generation = doc.get('generation', 0) if doc else 0
+        except Exception as e:
+            print(f"Erreur MongoDB (génération des données): {e}")
+            generation = None
+        with self.lock:
+            self.current_generation = generation
+        return generation
+
+    def get(self, key, generation):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or generation is None or entry[0] != generation or entry[1] < time.monotonic():
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key, generation, value):
+        if generation is None:
+            return
+        with self.lock:
+            self.entries[key] = (generation, time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'generation': self.current_generation,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else None,
+                'evictions': self.evictions
+            }
+
+
+response_cache = ResponseCache(CACHE_MAX_ENTRIES, CACHE_TTL, CACHE_GENERATION_POLL_INTERVAL)
+
+
+def cached(*arg_names):
+    """
+    Sert la page depuis response_cache, la clé étant la route et les paramètres `arg_names`.
+    Une vue peut positionner `g.no_cache` (page d'erreur) pour ne pas être mise en cache.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = (request.endpoint, tuple(sorted(kwargs.items())), tuple(request.args.get(name) for name in arg_names))
+            generation = response_cache.generation()
+            page = response_cache.get(key, generation)
+            status = 'HIT'
+            if page is None:
+                status = 'MISS'
+                page = view(*args, **kwargs)
+                if not g.get('no_cache'):
+                    response_cache.put(key, generation, page)
+            response = make_response(page)
+            response.headers['X-Cache'] = status
+            return response
+        return wrapper
+    return decorator
 
 
 # Dashboard landing page
@@ -23,144 +163,185 @@ def dashboard():
 
 
 # Page 1: statistiques messages commerciaux
+REDUCTION_LABEL = 'Réduction'
+
+
+def is_reduction_expr(message):
+    # Message « Réduction NN% » : même test que messages.is_reduction côté scraping, sans regex
+    return {"$and": [
+        {"$eq": [{"$indexOfCP": [{"$trim": {"input": message}}, "Réduction"]}, 0]},
+        {"$gte": [{"$indexOfCP": [message, "%"]}, 0]}
+    ]}
+
+
+# Classement des messages recalculé dans l'agrégation pour les produits écrits avant `message_class`
+MESSAGE_CLASS_FALLBACK = {"$let": {
+    "vars": {"messages": {"$filter": {
+        "input": {"$cond": [
+            {"$isArray": "$commercial_message"}, "$commercial_message",
+            {"$cond": [{"$eq": [{"$type": "$commercial_message"}, "string"]}, ["$commercial_message"], []]}
+        ]},
+        "as": "m",
+        "cond": {"$eq": [{"$type": "$$m"}, "string"]}
+    }}},
+    "in": {"$let": {
+        "vars": {"others": {"$filter": {"input": "$$messages", "as": "m", "cond": {"$not": [is_reduction_expr("$$m")]}}}},
+        "in": {
+            "reductions": {"$map": {
+                "input": {"$filter": {"input": "$$messages", "as": "m", "cond": is_reduction_expr("$$m")}},
+                "as": "m",
+                "in": {"$trim": {"input": "$$m"}}
+            }},
+            "combined": {"$eq": [{"$size": "$$others"}, 2]},
+            "label": {"$switch": {
+                "branches": [
+                    {"case": {"$eq": [{"$size": "$$others"}, 1]}, "then": {"$arrayElemAt": ["$$others", 0]}},
+                    {"case": {"$eq": [{"$size": "$$others"}, 2]}, "then": {"$concat": [
+                        {"$min": "$$others"}, " & ", {"$max": "$$others"}
+                    ]}}
+                ],
+                "default": None
+            }}
+        }
+    }}
+}}
+
+# Une seule agrégation : seule la matrice des comptes (catégorie x label) revient de MongoDB
+PAGE1_PIPELINE = [
+    {"$project": {
+        "_id": 0,
+        "category": {"$arrayElemAt": ["$category_hierarchy", 1]},
+        "message_class": {"$ifNull": ["$message_class", MESSAGE_CLASS_FALLBACK]}
+    }},
+    {"$facet": {
+        "labels": [
+            {"$match": {"category": {"$nin": [None, ""]}, "message_class.label": {"$ne": None}}},
+            {"$group": {
+                "_id": {"category": "$category", "label": "$message_class.label", "combined": "$message_class.combined"},
+                "count": {"$sum": 1}
+            }}
+        ],
+        "reduced_products": [
+            {"$match": {"category": {"$nin": [None, ""]}, "message_class.reductions.0": {"$exists": True}}},
+            {"$group": {"_id": "$category", "count": {"$sum": 1}}}
+        ],
+        "reductions": [
+            {"$unwind": "$message_class.reductions"},
+            {"$group": {"_id": "$message_class.reductions", "count": {"$sum": 1}}}
+        ],
+        "categories": [
+            {"$match": {"category": {"$nin": [None, ""]}}},
+            {"$group": {"_id": "$category"}}
+        ]
+    }}
+]
+
+
 @app.route('/page1')
+@cached()
 def index():
-    categories = db.products.distinct('category_hierarchy.1')
-    categories = [c for c in categories if c]
-    categories.sort()
-
-    # Prépare les labels et les comptes par catégorie
-    from collections import defaultdict
-    label_set = set()
-    combined_label_set = set()
-    # Dictionnaire : {cat: {label: count}}
-    category_label_counts = defaultdict(lambda: defaultdict(int))
-
-    for doc in db.products.find({"category_hierarchy.1": {"$in": categories}}):
-        cat = doc.get('category_hierarchy', [None, None])[1]
-        if not cat:
-            continue
-        messages = doc.get('commercial_message', [])
-        # Ajout du label 'Réduction' si un message correspond à 'Réduction XX%'
-        reduction_found = False
-        reduction_label = 'Réduction'
-        filtered_messages = []
-        if isinstance(messages, list):
-            for msg in messages:
-                if isinstance(msg, str) and msg.strip().startswith('Réduction') and '%' in msg:
-                    reduction_found = True
-                else:
-                    filtered_messages.append(msg)
-            if reduction_found:
-                label_set.add(reduction_label)
-                category_label_counts[cat][reduction_label] += 1
-            # Traite les autres messages normalement
-            if len(filtered_messages) == 1:
-                label = filtered_messages[0]
-                label_set.add(label)
-                category_label_counts[cat][label] += 1
-            elif len(filtered_messages) == 2:
-                msgs_sorted = sorted(filtered_messages)
-                label = f'{msgs_sorted[0]} & {msgs_sorted[1]}'
-                combined_label_set.add(label)
-                category_label_counts[cat][label] += 1
-        elif isinstance(messages, str):
-            if messages.strip().startswith('Réduction') and '%' in messages:
-                label_set.add(reduction_label)
-                category_label_counts[cat][reduction_label] += 1
-            else:
-                label = messages
-                label_set.add(label)
-                category_label_counts[cat][label] += 1
+    if parquet_snapshot:
+        return render_template('page1.html', **parquet_backend.page1(parquet_snapshot))
+    result = next(db.products.aggregate(PAGE1_PIPELINE), {})
+    categories = sorted(doc['_id'] for doc in result.get('categories', []) if isinstance(doc['_id'], str))
+
+    # Dictionnaire : {label: {cat: count}}
+    label_counts = {}
+    combined_label_counts = {}
+    for doc in result.get('labels', []):
+        key = doc['_id']
+        target = combined_label_counts if key.get('combined') else label_counts
+        target.setdefault(key['label'], {})[key['category']] = doc['count']
+    # Produits ayant au moins une réduction, regroupés sous le label 'Réduction'
+    for doc in result.get('reduced_products', []):
+        counts = label_counts.setdefault(REDUCTION_LABEL, {})
+        counts[doc['_id']] = counts.get(doc['_id'], 0) + doc['count']
 
     # Prépare les listes pour le frontend
-    message_types = sorted(label_set)
-    combined_labels = sorted(combined_label_set)
-    data_counts = []
-    for msg in message_types:
-        data_counts.append([category_label_counts[cat].get(msg, 0) for cat in categories])
-    combined_data_counts = []
-    for label in combined_labels:
-        combined_data_counts.append([category_label_counts[cat].get(label, 0) for cat in categories])
+    message_types = sorted(label_counts)
+    combined_labels = sorted(combined_label_counts)
+    data_counts = [[label_counts[msg].get(cat, 0) for cat in categories] for msg in message_types]
+    combined_data_counts = [[combined_label_counts[label].get(cat, 0) for cat in categories] for label in combined_labels]
 
     # Données pour le camembert des réductions
-    reduction_counts = defaultdict(int)
-    # Cherche les messages qui commencent par "Réduction" et se terminent par "%"
-    for doc in db.products.find({"commercial_message": {"$regex": "^Réduction \\d+%"}}):
-        messages = doc.get('commercial_message', [])
-        # Assure que 'messages' est une liste pour l'itération
-        if not isinstance(messages, list):
-            messages = [messages]
-        for msg in messages:
-            if isinstance(msg, str) and msg.strip().startswith('Réduction') and '%' in msg:
-                reduction_counts[msg.strip()] += 1
-    
-    reduction_labels = sorted(reduction_counts.keys())
+    reduction_counts = {doc['_id']: doc['count'] for doc in result.get('reductions', [])}
+    reduction_labels = sorted(reduction_counts)
     reduction_data = [reduction_counts[label] for label in reduction_labels]
 
     return render_template('page1.html', categories=categories, message_types=message_types, data_counts=data_counts, combined_labels=combined_labels, combined_data_counts=combined_data_counts, reduction_labels=reduction_labels, reduction_data=reduction_data)
 
+# Statistiques par catégorie tenues à jour par le scraping (un document par catégorie et par niveau)
+category_stats = db[os.environ.get('MONGO_CATEGORY_STATS_COLLECTION', 'category_stats')]
+UNKNOWN_CATEGORY = 'Non renseigné'
+
+
+def category_parents_query(level, parent_name):
+    # Catégories de niveau `level - 1` nommées `parent_name` (un même nom peut apparaître sous plusieurs parents)
+    return lambda: list(category_stats.find({"level": level - 1, "name": parent_name}, {"products": 1, "reviews": 1}))
+
+
+def category_children_query(level, parent_name, parent_index):
+    return lambda: list(category_stats.find(
+        {"level": level, f"path.{parent_index}": parent_name, "products": {"$gt": 0}},
+        {"name": 1, "products": 1, "reviews": 1}
+    ))
+
+
+def category_children(parents, child_docs):
+    """
+    Sous-catégories triées par nombre de produits, avec les produits des catégories parentes
+    sans sous-catégorie sous 'Non renseigné' : (labels, produits, avis).
+    """
+    children = {}
+    for doc in child_docs:
+        counts = children.setdefault(doc['name'], [0, 0])
+        counts[0] += doc['products']
+        counts[1] += doc.get('reviews', 0)
+    unknown_products = sum(doc.get('products', 0) for doc in parents) - sum(c[0] for c in children.values())
+    unknown_reviews = sum(doc.get('reviews', 0) for doc in parents) - sum(c[1] for c in children.values())
+    if unknown_products > 0:
+        children[UNKNOWN_CATEGORY] = [unknown_products, unknown_reviews]
+    ordered = sorted(children.items(), key=lambda entry: entry[1][0], reverse=True)
+    return [name for name, _ in ordered], [c[0] for _, c in ordered], [c[1] for _, c in ordered]
+
+
 # Page 2 : Nombre de reviews 
 @app.route('/page2')
+@cached('first_category', 'second_category')
 def page2():
     selected_first = request.args.get('first_category')
     selected_second = request.args.get('second_category')
+    if parquet_snapshot:
+        return render_template('page2.html', **parquet_backend.page2(parquet_snapshot, selected_first, selected_second))
 
-    firsts = db.products.distinct('category_hierarchy.1')
-    firsts = [f for f in firsts if f]
-    firsts.sort()
+    # Lectures indépendantes de category_stats, lancées en parallèle
+    results = run_concurrently(
+        # Catégories de premier niveau (category_hierarchy.1)
+        firsts=lambda: list(category_stats.find({"level": 1, "products": {"$gt": 0}},
+                                                {"name": 1, "products": 1, "reviews": 1}).sort("name", 1)),
+        seconds=(lambda: category_stats.distinct('name', {"level": 2, "path.1": selected_first, "products": {"$gt": 0}}))
+        if selected_first else None,
+        pie_parents=category_parents_query(3, selected_second) if selected_second else None,
+        pie_children=category_children_query(3, selected_second, 2) if selected_second else None,
+        pie2_parents=category_parents_query(2, selected_first) if selected_first else None,
+        pie2_children=category_children_query(2, selected_first, 1) if selected_first else None,
+    )
 
-    seconds = []
-    if selected_first:
-        seconds = db.products.distinct('category_hierarchy.2', {'category_hierarchy.1': selected_first})
-        seconds = [s for s in seconds if s]
-        seconds.sort()
-
-    pipeline_bar = [
-        {"$match": {"category_hierarchy.1": {"$ne": None}}},
-        {"$group": {
-            "_id": { "$arrayElemAt": ["$category_hierarchy", 1] },
-            "count": { "$sum": 1 },
-            "total_reviews": { "$sum": { "$toInt": "$review_count" } }
-        }},
-        {"$sort": { "_id": 1 }}
-    ]
-    category_counts = list(db.products.aggregate(pipeline_bar))
-    labels_bar = [item['_id'] if item['_id'] else 'Non renseigné' for item in category_counts]
-    data_bar = [item['count'] for item in category_counts]
-    reviews_bar = [item['total_reviews'] for item in category_counts]
+    firsts_stats = results['firsts']
+    firsts = [doc['name'] for doc in firsts_stats]
+    labels_bar = firsts
+    data_bar = [doc['products'] for doc in firsts_stats]
+    reviews_bar = [doc.get('reviews', 0) for doc in firsts_stats]
+
+    seconds = sorted(results.get('seconds', []))
 
     pie_labels, pie_data, pie_reviews = [], [], []
     if selected_second:
-        pipeline_pie = [
-            {"$match": {"category_hierarchy.2": selected_second}},
-            {"$group": {
-                "_id": { "$arrayElemAt": ["$category_hierarchy", 3] },
-                "count": { "$sum": 1 },
-                "total_reviews": { "$sum": { "$toInt": "$review_count" } }
-            }},
-            {"$sort": { "count": -1 }}
-        ]
-        pie_counts = list(db.products.aggregate(pipeline_pie))
-        pie_labels = [item['_id'] if item['_id'] else 'Non renseigné' for item in pie_counts]
-        pie_data = [item['count'] for item in pie_counts]
-        pie_reviews = [item.get('total_reviews', 0) for item in pie_counts]
+        pie_labels, pie_data, pie_reviews = category_children(results['pie_parents'], results['pie_children'])
 
     pie2_labels, pie2_data, pie2_reviews = [], [], []
     if selected_first:
-        pipeline_pie2 = [
-            {"$match": {"category_hierarchy.1": selected_first}},
-            {"$group": {
-                "_id": { "$arrayElemAt": ["$category_hierarchy", 2] },
-                "count": { "$sum": 1 },
-                "total_reviews": { "$sum": { "$toInt": "$review_count" } }
-            }},
-            {"$sort": { "count": -1 }}
-        ]
-        pie2_counts = list(db.products.aggregate(pipeline_pie2))
-        pie2_labels = [item['_id'] if item['_id'] else 'Non renseigné' for item in pie2_counts]
-        pie2_data = [item['count'] for item in pie2_counts]
-        pie2_reviews = [item.get('total_reviews', 0) for item in pie2_counts]
+        pie2_labels, pie2_data, pie2_reviews = category_children(results['pie2_parents'], results['pie2_children'])
 
     return render_template('page2.html', labels=labels_bar, data=data_bar,
                            reviews=reviews_bar,
@@ -171,23 +352,45 @@ def page2():
 
 # Page 3 : ranking moyen
 @app.route('/page3')
+@cached()
 def page3():
-    # Premier graphique : ranking moyen par catégorie
-    pipeline = [
-        {"$match": {"category_hierarchy.1": {"$ne": None}, "rating": {"$ne": None, "$gt": 0}}},
-        {"$addFields": {"rating_float": {"$toDouble": "$rating"}}},
-        {"$group": {"_id": {"$arrayElemAt": ["$category_hierarchy", 1]}, "avg_rating": {"$avg": "$rating_float"}}},
-        {"$sort": {"_id": 1}}
-    ]
-    results = list(collection.aggregate(pipeline))
-    labels = [res['_id'] for res in results]
-    data = [res['avg_rating'] for res in results]
+    if parquet_snapshot:
+        return render_template('page3.html', **parquet_backend.page3(parquet_snapshot))
+    # Premier graphique : ranking moyen par catégorie (somme et nombre des notes > 0 des produits)
+    results = category_stats.find({"level": 1, "rating_count": {"$gt": 0}},
+                                  {"name": 1, "rating_sum": 1, "rating_count": 1}).sort("name", 1)
+    labels = []
+    data = []
+    for res in results:
+        labels.append(res['name'])
+        data.append(res['rating_sum'] / res['rating_count'])
 
     return render_template('page3.html', labels=labels, data=data)
 
 
 # Page 4: Recherche de produit par nom et répartition des ratings
+# Champs du produit affichés pour le meilleur produit et dans le classement
+BEST_PRODUCT_FIELDS = ["product_id", "name", "description", "image_url", "price", "url", "category_main", "review_stats"]
+RATING_LABELS = ['1 étoile', '2 étoiles', '3 étoiles', '4 étoiles', '5 étoiles']
+
+
+def rating_histogram(field):
+    # Buckets [0.5, 1.5), [1.5, 2.5)... : note arrondie à l'étoile la plus proche
+    return {"histogram": {"field": field, "interval": 1, "offset": 0.5, "min_doc_count": 0,
+                          "extended_bounds": {"min": 0.5, "max": 5.5}}}
+
+
+def star_counts(histogram):
+    counts = {1: 0, 2: 0, 3: 0, 4: 0, 5: 0}
+    for bucket in histogram['buckets']:
+        star = int(bucket['key'] + 0.5)
+        if star in counts:
+            counts[star] += bucket['doc_count']
+    return [counts[star] for star in range(1, 6)]
+
+
 @app.route('/page4')
+@cached('product_name')
 def page4():
     product_name = request.args.get('product_name', '').strip()
     
@@ -198,14 +401,14 @@ def page4():
     error_message = None
     secondary_ratings_data = {}
     
-    import math
     best_seller = None
     search_error = None
     if product_name:
         try:
-            # Recherche des produits par nom dans Elasticsearch
+            # Histogrammes et meilleur produit calculés par Elasticsearch : aucun avis n'est renvoyé
             query = {
-                "size": 1000,  # Récupérer tous les produits correspondants
+                "size": 0,
+                "track_total_hits": True,
                 "query": {
                     "match": {
                         "name": {
@@ -213,75 +416,72 @@ def page4():
                             "operator": "and"
                         }
                     }
+                },
+                "aggs": {
+                    "reviews": {
+                        "nested": {"path": "reviews"},
+                        "aggs": {
+                            "ratings": rating_histogram("reviews.rating"),
+                            "secondary": {
+                                "nested": {"path": "reviews.secondary_ratings"},
+                                "aggs": {
+                                    "labels": {
+                                        "terms": {"field": "reviews.secondary_ratings.label", "size": 50},
+                                        "aggs": {"ratings": rating_histogram("reviews.secondary_ratings.rating")}
+                                    }
+                                }
+                            }
+                        }
+                    },
+                    # Meilleur produit : score bayésien calculé à l'ingestion (review_stats.score)
+                    "best": {
+                        "filter": {"range": {"review_stats.count": {"gt": 0}}},
+                        "aggs": {
+                            "top": {
+                                "top_hits": {
+                                    "size": 1,
+                                    "sort": [{"review_stats.score": {"order": "desc"}}],
+                                    "_source": BEST_PRODUCT_FIELDS
+                                }
+                            }
+                        }
+                    }
                 }
             }
-            
-            res = es.search(index="ikea_reviews", **query)
-            hits = res.get('hits', {}).get('hits', [])
-            # Pour les diagrammes
-            if hits:
-                product_count = len(hits)
-                rating_counts = {1: 0, 2: 0, 3: 0, 4: 0, 5: 0}
-                secondary_ratings_counts = {}
-                best_score = -1
-                best_product = None
-                for hit in hits:
-                    source = hit.get('_source', {})
-                    reviews = source.get('reviews', [])
-                    nb_reviews = 0
-                    sum_ratings = 0
-                    for review in reviews:
-                        if review and review.get('primaryRating'):
-                            rating_value = review['primaryRating'].get('ratingValue')
-                            if rating_value:
-                                nb_reviews += 1
-                                sum_ratings += rating_value
-                                # Pour les diagrammes
-                                rounded_rating = round(rating_value)
-                                if 1 <= rounded_rating <= 5:
-                                    rating_counts[rounded_rating] += 1
-                                    total_reviews += 1
-                        # Compter les secondaryRatings (pour les diagrammes)
-                        if review and review.get('secondaryRatings'):
-                            for sec_rating in review['secondaryRatings']:
-                                label = sec_rating.get('label')
-                                rating_value = sec_rating.get('ratingValue')
-                                if label and rating_value:
-                                    if label not in secondary_ratings_counts:
-                                        secondary_ratings_counts[label] = {1: 0, 2: 0, 3: 0, 4: 0, 5: 0}
-                                    rounded_rating = round(rating_value)
-                                    if 1 <= rounded_rating <= 5:
-                                        secondary_ratings_counts[label][rounded_rating] += 1
-                    # Calcul du score pondéré pour ce produit
-                    if nb_reviews > 0:
-                        avg_rating = sum_ratings / nb_reviews
-                        score = avg_rating * math.log(1 + nb_reviews)
-                        if score > best_score:
-                            best_score = score
-                            best_product = source
+
+            res = es.search(index=ES_INDEX, **query)
+            product_count = res['hits']['total']['value']
+            if product_count:
+                aggs = res['aggregations']
+                primary = star_counts(aggs['reviews']['ratings'])
+                total_reviews = sum(primary)
                 if total_reviews > 0:
                     # Préparer les données pour le graphique primary
-                    rating_labels = ['1 étoile', '2 étoiles', '3 étoiles', '4 étoiles', '5 étoiles']
-                    rating_data = [rating_counts[1], rating_counts[2], rating_counts[3], 
-                                   rating_counts[4], rating_counts[5]]
+                    rating_labels = RATING_LABELS
+                    rating_data = primary
                     
-                    # Préparer les données pour les graphiques secondaryRatings
-                    for label, counts in secondary_ratings_counts.items():
-                        secondary_ratings_data[label] = {
-                            'labels': rating_labels,
-                            'data': [counts[1], counts[2], counts[3], counts[4], counts[5]],
-                            'total': sum(counts.values())
-                        }
+                    # Préparer les données pour les graphiques des notes secondaires
+                    for bucket in aggs['reviews']['secondary']['labels']['buckets']:
+                        data = star_counts(bucket['ratings'])
+                        if sum(data):
+                            secondary_ratings_data[bucket['key']] = {
+                                'labels': rating_labels,
+                                'data': data,
+                                'total': sum(data)
+                            }
                 else:
                     error_message = f"Aucune review trouvée pour le produit '{product_name}'."
-                # Préparer le best_seller
-                if best_product:
+                # Préparer le best_seller : seuls les champs affichés sont lus
+                best_hits = aggs['best']['top']['hits']['hits']
+                if best_hits:
+                    best_product = best_hits[0]['_source']
+                    stats = best_product.get('review_stats') or {}
                     best_seller = {
                         'name': best_product.get('name', 'Inconnu'),
                         'description': best_product.get('description', 'Aucune description disponible'),
                         'image_url': best_product.get('image_url', ''),
-                        'review_count': len(best_product.get('reviews', [])),
-                        'rating': round(sum([r.get('primaryRating', {}).get('ratingValue', 0) for r in best_product.get('reviews', []) if r.get('primaryRating')])/len(best_product.get('reviews', [])), 2) if best_product.get('reviews', []) else 0,
+                        'review_count': stats.get('count', 0),
+                        'rating': round(stats.get('mean') or 0, 2),
                         'price': best_product.get('price', 0),
                         'url': best_product.get('url', '')
                     }
@@ -292,6 +492,7 @@ def page4():
         
         except Exception as e:
             error_message = f"Erreur lors de la recherche: {str(e)}"
+            g.no_cache = True
             print(f"Erreur Elasticsearch: {e}")
     
     return render_template('page4.html', 
@@ -307,42 +508,371 @@ def page4():
 
 
 #page5 : recherche de commentaires contenant un mot-clé
+REVIEW_SEARCH_PAGE_SIZE = 20
+REVIEW_SEARCH_MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(sort_values):
+    return base64.urlsafe_b64encode(json.dumps(sort_values).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Valeurs `sort` du dernier résultat de la page précédente, ou None (ValueError si le curseur est invalide)."""
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        raise ValueError(f"Curseur invalide : {cursor}")
+    # Un curseur décodable mais d'une autre forme serait refusé par Elasticsearch (erreur 502 au lieu de 400)
+    if (not isinstance(values, list) or len(values) != 2 or isinstance(values[0], bool)
+            or not isinstance(values[0], (int, float)) or not isinstance(values[1], str)):
+        raise ValueError(f"Curseur invalide : {cursor}")
+    return values
+
+
+def search_reviews(query_word, after=None, size=REVIEW_SEARCH_PAGE_SIZE, count_total=True):
+    """
+    Recherche plein texte (analysée, donc avec les formes fléchies) dans l'index des avis.
+    Seuls le produit, la catégorie et les extraits surlignés des avis qui correspondent
+    sont renvoyés ; la pagination suit le curseur `search_after` (score puis `doc_id`, copie
+    unique du _id de l'avis : deux avis de même score ne sont jamais sautés ni répétés).
+    Renvoie (total ou None, résultats, curseur de la page suivante ou None).
+    """
+    es_query = {
+        "size": size,
+        "track_total_hits": count_total,
+        "_source": ["product_name", "category_main"],
+        "query": {
+            "multi_match": {
+                "query": query_word,
+                "fields": ["text", "title"]
+            }
+        },
+        # Le texte est échappé par Elasticsearch (encoder html), seules les balises <em> sont ajoutées
+        "highlight": {
+            "encoder": "html",
+            "fields": {
+                "text": {"fragment_size": 150, "number_of_fragments": 3, "no_match_size": 150},
+                "title": {"number_of_fragments": 0}
+            }
+        },
+        "sort": [{"_score": "desc"}, {"doc_id": "asc"}]
+    }
+    if after:
+        es_query["search_after"] = after
+    es_res = es.search(index=ES_REVIEW_INDEX, **es_query)
+    hits = es_res['hits']['hits']
+    results = []
+    for hit in hits:
+        review = hit['_source']
+        highlight = hit.get('highlight', {})
+        results.append({
+            'id': hit['_id'],
+            'product': review.get('product_name') or 'Inconnu',
+            'category': review.get('category_main') or 'Inconnu',
+            'title': ' '.join(highlight.get('title', [])),
+            'snippets': highlight.get('text', [])
+        })
+    total = es_res['hits']['total']['value'] if count_total else None
+    next_cursor = encode_cursor(hits[-1]['sort']) if len(hits) == size else None
+    return total, results, next_cursor
+
+
 @app.route('/page5', methods=['GET', 'POST'])
 def search_es():
     results = []
-    query_word = ''
-    if request.method == 'POST':
-        query_word = request.form.get('query_word', '').strip()
-        if query_word:
-            es_query = {
-                "size": 20,
-                "query": {
-                    "nested": {
-                        "path": "reviews",
-                        "query": {
-                            "multi_match": {
-                                "query": query_word,
-                                "fields": ["reviews.comment", "reviews.text"]
-                            }
-                        }
-                    }
-                }
-            }
+    total_hits = 0
+    next_cursor = None
+    error_message = None
+    status = 200
+    source = request.form if request.method == 'POST' else request.args
+    query_word = source.get('query_word', '').strip()
+    if query_word:
+        try:
+            after = decode_cursor(request.args.get('after'))
+        except ValueError:
+            # Lien de page suivante tronqué ou modifié : pas la peine d'interroger Elasticsearch
+            error_message = "Le lien de pagination est invalide ou incomplet. Relancez la recherche depuis la première page."
+            status = 400
+        else:
             try:
-                es_res = es.search(index="ikea_reviews", **es_query)
-                for hit in es_res['hits']['hits']:
-                    doc = hit['_source']
-                    for review in doc.get('reviews', []):
-                        comment = review.get('comment', '') or review.get('text', '')
-                        if query_word.lower() in comment.lower():
-                            results.append({
-                                'product': doc.get('name', 'Inconnu'),
-                                'category': doc.get('category_main', 'Inconnu'),
-                                'comment': comment
-                            })
+                # Le total est calculé une fois, puis transmis de page en page
+                known_total = request.args.get('total', type=int) if after else None
+                total_hits, results, next_cursor = search_reviews(query_word, after, count_total=known_total is None)
+                if known_total is not None:
+                    total_hits = known_total
             except Exception as e:
                 print(f"Erreur Elasticsearch: {e}")
-    return render_template('page5.html', results=results, query_word=query_word)
+                error_message = "La recherche est momentanément indisponible, réessayez plus tard."
+    return render_template('page5.html', results=results, total_hits=total_hits, query_word=query_word,
+                           next_cursor=next_cursor, error_message=error_message), status
+
+
+@app.route('/api/reviews/search')
+def api_search_reviews():
+    query_word = request.args.get('q', '').strip()
+    if not query_word:
+        return jsonify({"error": "paramètre q manquant"}), 400
+    size = min(max(request.args.get('size', REVIEW_SEARCH_PAGE_SIZE, type=int), 1), REVIEW_SEARCH_MAX_PAGE_SIZE)
+    try:
+        after = decode_cursor(request.args.get('after'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        total, results, next_cursor = search_reviews(query_word, after, size, count_total=after is None)
+    except Exception as e:
+        print(f"Erreur Elasticsearch: {e}")
+        return jsonify({"error": str(e)}), 502
+    return jsonify({"query": query_word, "total": total, "results": results, "next": next_cursor})
+
+
+# Export NDJSON : une ligne JSON par produit ou par avis, écrite au fil du curseur MongoDB
+# (mémoire constante quelle que soit la taille de l'export). Pagination par clé : `after` = dernier
+# product_id reçu, `limit` = nombre maximal de produits.
+EXPORT_BATCH_SIZE = 500
+PRODUCT_EXPORT_FIELDS = ('product_id', 'name', 'price', 'description', 'url', 'image_url', 'category_hierarchy',
+                         'rating', 'review_count', 'is_new', 'commercial_message', 'review_stats', 'message_class')
+REVIEW_EXPORT_FIELDS = ('id', 'title', 'text', 'rating', 'secondary_ratings', 'language', 'country',
+                        'submitted_at', 'updated_at')
+
+
+def export_fields(allowed):
+    """Champs demandés (`fields=a,b`) parmi `allowed` ; ValueError pour un champ inconnu."""
+    requested = [field for field in request.args.get('fields', '').split(',') if field]
+    unknown = [field for field in requested if field not in allowed]
+    if unknown:
+        raise ValueError(f"Champs inconnus : {', '.join(unknown)} (disponibles : {', '.join(allowed)})")
+    return requested or list(allowed)
+
+
+def export_match():
+    """Filtre commun : `category_<niveau>=<nom>` sur category_hierarchy et curseur `after` sur product_id."""
+    # La condition $type reprend le filtre de l'index partiel unique sur product_id : MongoDB peut l'utiliser
+    match = {'product_id': {'$type': 'string'}}
+    after = request.args.get('after')
+    if after:
+        match['product_id']['$gt'] = after
+    for key, value in request.args.items():
+        if key.startswith('category_'):
+            level = key[len('category_'):]
+            if not level.isdigit():
+                raise ValueError(f"Paramètre invalide : {key} (category_<niveau> attendu)")
+            match[f'category_hierarchy.{int(level)}'] = value
+    return match
+
+
+def export_limit():
+    limit = request.args.get('limit', 0, type=int)
+    if limit < 0:
+        raise ValueError("limit doit être positif")
+    return limit
+
+
+def ndjson_response(docs):
+    # Premier document lu avant d'envoyer les en-têtes : une base injoignable donne une erreur 502, pas un export vide
+    docs = iter(docs)
+    try:
+        first = next(docs, None)
+    except Exception as e:
+        print(f"Erreur MongoDB: {e}")
+        return jsonify({"error": str(e)}), 502
+
+    def generate():
+        if first is None:
+            return
+        yield json.dumps(first, ensure_ascii=False, default=str) + '\n'
+        for doc in docs:
+            yield json.dumps(doc, ensure_ascii=False, default=str) + '\n'
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+@app.route('/api/products')
+def api_products():
+    try:
+        fields = export_fields(PRODUCT_EXPORT_FIELDS)
+        match = export_match()
+        limit = export_limit()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    projection = {'_id': 0, 'product_id': 1, **{field: 1 for field in fields}}
+    cursor = collection.find(match, projection, batch_size=EXPORT_BATCH_SIZE).sort('product_id', 1).limit(limit)
+    return ndjson_response(cursor)
+
+
+@app.route('/api/reviews')
+def api_reviews():
+    try:
+        fields = export_fields(REVIEW_EXPORT_FIELDS)
+        match = export_match()
+        limit = export_limit()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    # Un avis par ligne avec le product_id de son produit ; `limit` compte les produits pour
+    # que la page suivante (after = dernier product_id) ne coupe jamais les avis d'un produit
+    pipeline = [{'$match': match}, {'$sort': {'product_id': 1}}]
+    if limit:
+        pipeline.append({'$limit': limit})
+    pipeline += [
+        {'$project': {'_id': 0, 'product_id': 1, 'reviews': 1}},
+        {'$unwind': '$reviews'},
+        {'$project': {'product_id': 1, **{field: f'$reviews.{field}' for field in fields}}},
+    ]
+    return ndjson_response(collection.aggregate(pipeline, batchSize=EXPORT_BATCH_SIZE))
+
+
+# Classement des produits d'une catégorie : tri sur le score bayésien stocké à l'ingestion
+LEADERBOARD_MAX_SIZE = 100
+
+
+@app.route('/api/leaderboard/<path:category_main>')
+def leaderboard(category_main):
+    size = min(max(request.args.get('size', 10, type=int), 1), LEADERBOARD_MAX_SIZE)
+    search = request.args.get('q', '').strip()
+    filters = [{"term": {"category_main": category_main}}, {"range": {"review_stats.count": {"gt": 0}}}]
+    query = {"bool": {"filter": filters}}
+    if search:
+        query["bool"]["must"] = {"match": {"name": {"query": search, "operator": "and"}}}
+    try:
+        res = es.search(index=ES_INDEX, size=size, query=query,
+                        sort=[{"review_stats.score": {"order": "desc"}}],
+                        _source=BEST_PRODUCT_FIELDS)
+    except Exception as e:
+        print(f"Erreur Elasticsearch: {e}")
+        return jsonify({"error": str(e)}), 502
+    products = []
+    for rank, hit in enumerate(res['hits']['hits'], start=1):
+        product = hit['_source']
+        stats = product.pop('review_stats', None) or {}
+        products.append({
+            **product,
+            'rank': rank,
+            'score': stats.get('score'),
+            'rating': stats.get('mean'),
+            'review_count': stats.get('count', 0)
+        })
+    return jsonify({"category_main": category_main, "products": products})
+
+
+# Historique mensuel des prix et des remises (collection product_history, écrite par MongoDBPipeline :
+# un document par produit et par mois, un point par changement)
+product_history = db[os.environ.get('MONGO_HISTORY_COLLECTION', 'product_history')]
+HISTORY_MAX_SIZE = 100
+HISTORY_TREND_MAX_MONTHS = 36
+
+
+def history_month(value, default=None):
+    """Mois AAAA-MM du paramètre `value` (mois courant par défaut) ; ValueError s'il est mal formé."""
+    if not value:
+        return default or time.strftime('%Y-%m', time.gmtime())
+    try:
+        year, month = (int(part) for part in value.split('-'))
+    except ValueError:
+        raise ValueError(f"Mois invalide : {value} (AAAA-MM attendu)")
+    if not 1 <= month <= 12:
+        raise ValueError(f"Mois invalide : {value} (AAAA-MM attendu)")
+    return f'{year:04d}-{month:02d}'
+
+
+def months_before(month, count):
+    """Premier des `count` mois se terminant par `month` (AAAA-MM)."""
+    year, number = (int(part) for part in month.split('-'))
+    index = year * 12 + number - 1 - (count - 1)
+    return f'{index // 12:04d}-{index % 12 + 1:02d}'
+
+
+@app.route('/api/history/<path:product_id>')
+def api_product_history(product_id):
+    # Tous les mois du produit en une requête sur l'index (product_id, month)
+    try:
+        since = history_month(request.args.get('since'), default='0000-01')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        buckets = list(product_history.find({'product_id': product_id, 'month': {'$gte': since}}, {'_id': 0})
+                       .sort('month', 1))
+    except Exception as e:
+        print(f"Erreur MongoDB: {e}")
+        return jsonify({"error": str(e)}), 502
+    if not buckets:
+        return jsonify({"error": f"Aucun historique pour {product_id}"}), 404
+    return jsonify({"product_id": product_id, "months": buckets})
+
+
+@app.route('/api/price_drops')
+@cached('month', 'category_main', 'min_pct', 'size')
+def api_price_drops():
+    """
+    Plus fortes baisses de prix du mois (prix au premier changement du mois -> dernier prix).
+    `min_pct` et `price_drop_pct` sont en pourcentage : min_pct=10 pour les baisses de plus de 10 %.
+    """
+    try:
+        month = history_month(request.args.get('month'))
+    except ValueError as e:
+        g.no_cache = True
+        return {"error": str(e)}, 400
+    min_pct = request.args.get('min_pct', 0.0, type=float)
+    size = min(max(request.args.get('size', 20, type=int), 1), HISTORY_MAX_SIZE)
+    match = {'month': month, 'price_drop_pct': {'$gt': min_pct}}
+    category_main = request.args.get('category_main')
+    if category_main:
+        match['category_main'] = category_main
+    projection = {'_id': 0, 'product_id': 1, 'name': 1, 'url': 1, 'category_main': 1, 'price_open': 1,
+                  'price_last': 1, 'price_min': 1, 'price_drop': 1, 'price_drop_pct': 1, 'discount_max': 1}
+    try:
+        drops = list(product_history.find(match, projection).sort('price_drop_pct', -1).limit(size))
+    except Exception as e:
+        print(f"Erreur MongoDB: {e}")
+        g.no_cache = True
+        return {"error": str(e)}, 502
+    return {"month": month, "category_main": category_main, "products": drops}
+
+
+@app.route('/api/discount_trend')
+@cached('category_main', 'months', 'until')
+def api_discount_trend():
+    """
+    Par mois : produits dont un champ suivi a changé, dont ceux en remise à la fin du
+    mois (remise moyenne et maximale) et ceux dont le prix a baissé (baisse moyenne
+    `avg_price_drop_pct`, en pourcentage comme les remises).
+    """
+    try:
+        until = history_month(request.args.get('until'))
+    except ValueError as e:
+        g.no_cache = True
+        return {"error": str(e)}, 400
+    months = min(max(request.args.get('months', 12, type=int), 1), HISTORY_TREND_MAX_MONTHS)
+    match = {'month': {'$gte': months_before(until, months), '$lte': until}}
+    category_main = request.args.get('category_main')
+    if category_main:
+        match['category_main'] = category_main
+    pipeline = [
+        {'$match': match},
+        {'$group': {
+            '_id': '$month',
+            'changed_products': {'$sum': 1},
+            'discounted_products': {'$sum': {'$cond': [{'$gt': ['$last.discount', 0]}, 1, 0]}},
+            'avg_discount': {'$avg': '$last.discount'},
+            'max_discount': {'$max': '$discount_max'},
+            'price_drops': {'$sum': {'$cond': [{'$gt': ['$price_drop_pct', 0]}, 1, 0]}},
+            'avg_price_drop_pct': {'$avg': {'$cond': [{'$gt': ['$price_drop_pct', 0]}, '$price_drop_pct', None]}},
+        }},
+        {'$sort': {'_id': 1}},
+        {'$project': {'_id': 0, 'month': '$_id', 'changed_products': 1, 'discounted_products': 1,
+                      'avg_discount': 1, 'max_discount': 1, 'price_drops': 1, 'avg_price_drop_pct': 1}},
+    ]
+    try:
+        trend = list(product_history.aggregate(pipeline))
+    except Exception as e:
+        print(f"Erreur MongoDB: {e}")
+        g.no_cache = True
+        return {"error": str(e)}, 502
+    return {"category_main": category_main, "months": trend}
+
+
+@app.route('/api/cache_stats')
+def cache_stats():
+    return jsonify(response_cache.stats())
 
 
 if __name__ == '__main__':
@@ -0,0 +1 @@
+# Racine des tests : rend app.py importable sans installation (python -m pytest)
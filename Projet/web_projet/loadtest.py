@@ -0,0 +1,85 @@
+"""
+Test de charge du dashboard : `--users` utilisateurs simultanés enchaînent des
+requêtes GET sur les URL données pendant `--duration` secondes ; affiche le débit
+(requêtes/s) et les latences (médiane, 95e centile, maximum).
+
+Exemple :
+    python loadtest.py http://localhost:5000/page2?first_category=Meubles --users 20 --duration 30
+"""
+import argparse
+import itertools
+import json
+import threading
+import time
+import urllib.request
+
+
+def run(urls, users, duration, timeout=30.0):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def user(offset):
+        # Chaque utilisateur parcourt les URL dans un ordre décalé
+        for url in itertools.islice(itertools.cycle(urls), offset, None):
+            if time.monotonic() >= deadline:
+                return
+            start = time.monotonic()
+            try:
+                with urllib.request.urlopen(url, timeout=timeout) as response:
+                    response.read()
+                ok = response.status < 400
+            except Exception:
+                ok = False
+            elapsed = time.monotonic() - start
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=user, args=(i % len(urls),)) for i in range(users)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.monotonic() - start
+
+    latencies.sort()
+
+    def percentile(p):
+        return round(latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1000, 1) if latencies else None
+
+    return {
+        'users': users,
+        'requests': len(latencies),
+        'errors': errors[0],
+        'requests_per_s': round(len(latencies) / wall, 1),
+        'latency_ms_p50': percentile(0.5),
+        'latency_ms_p95': percentile(0.95),
+        'latency_ms_max': round(latencies[-1] * 1000, 1) if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge du dashboard Flask")
+    parser.add_argument('urls', nargs='+', help='URL interrogées à tour de rôle')
+    parser.add_argument('--users', type=int, default=10, help='Nombre d\'utilisateurs simultanés')
+    parser.add_argument('--duration', type=float, default=20.0, help='Durée du test (secondes)')
+    parser.add_argument('--json', dest='json_output', default=None, help='Écrit aussi le rapport JSON dans ce fichier')
+    args = parser.parse_args()
+
+    report = run(args.urls, args.users, args.duration)
+    print(f"{report['users']} utilisateurs : {report['requests']} requêtes, {report['errors']} erreurs, "
+          f"{report['requests_per_s']} req/s")
+    print(f"Latence : médiane {report['latency_ms_p50']} ms, p95 {report['latency_ms_p95']} ms, "
+          f"max {report['latency_ms_max']} ms")
+    if args.json_output:
+        with open(args.json_output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""
+Calcul des pages /page1 à /page3 sur le dernier instantané Parquet écrit par
+`scrapy snapshot_parquet` (DASHBOARD_BACKEND=parquet), avec pyarrow.compute :
+les regroupements parcourent quelques colonnes compactes au lieu des documents
+BSON de MongoDB, qui reste réservé aux écritures du scraping.
+
+Chaque fonction renvoie les variables du template de la page correspondante.
+"""
+import os
+import threading
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+UNKNOWN_CATEGORY = 'Non renseigné'
+REDUCTION_LABEL = 'Réduction'
+# Colonnes des produits utilisées par les pages
+PRODUCT_COLUMNS = ['category_main', 'category_2', 'category_3', 'review_count', 'rating',
+                   'message_label', 'message_combined', 'reductions']
+
+
+class ParquetSnapshot:
+    """
+    Table des produits du dernier instantané, rechargée quand un instantané plus
+    récent apparaît ou que le dernier est réécrit (nouveau répertoire `crawl_date=`).
+    """
+
+    def __init__(self, directory):
+        self.directory = os.path.join(directory, 'products')
+        self.lock = threading.Lock()
+        self.crawl_date = None
+        self.version = None
+        self.table = None
+
+    def latest_date(self):
+        dates = [name.split('=', 1)[1] for name in os.listdir(self.directory) if name.startswith('crawl_date=')]
+        if not dates:
+            raise FileNotFoundError(f"Aucun instantané dans {self.directory}")
+        return max(dates)
+
+    def products(self):
+        crawl_date = self.latest_date()
+        path = os.path.join(self.directory, f'crawl_date={crawl_date}')
+        # snapshot_parquet supprime puis recrée le répertoire d'une date réécrite
+        stat = os.stat(path)
+        version = (crawl_date, stat.st_ino, stat.st_mtime_ns)
+        with self.lock:
+            if version != self.version:
+                dataset = ds.dataset(path, format='parquet',
+                                     partitioning=ds.partitioning(pa.schema([pa.field('category_main', pa.string())]),
+                                                                  flavor='hive'))
+                self.table = dataset.to_table(columns=PRODUCT_COLUMNS)
+                self.crawl_date = crawl_date
+                self.version = version
+            return self.table
+
+
+def _counts(table, keys, value_column=None):
+    """{clé(s): (nombre de lignes, somme de value_column)} regroupé par `keys`."""
+    aggregations = [(keys[0], 'count', pc.CountOptions(mode='all'))]
+    if value_column:
+        aggregations.append((value_column, 'sum'))
+    grouped = table.group_by(keys).aggregate(aggregations).to_pylist()
+    result = {}
+    for row in grouped:
+        key = tuple(row[k] for k in keys) if len(keys) > 1 else row[keys[0]]
+        result[key] = (row[f'{keys[0]}_count'], (row.get(f'{value_column}_sum') or 0) if value_column else 0)
+    return result
+
+
+def page1(snapshot):
+    products = snapshot.products()
+    table = products.filter(pc.is_valid(products['category_main']))
+    categories = sorted(pc.unique(table['category_main']).to_pylist())
+
+    labelled = table.filter(pc.is_valid(table['message_label']))
+    label_counts = {}
+    combined_label_counts = {}
+    for (category, label, combined), (count, _) in _counts(labelled, ['category_main', 'message_label', 'message_combined']).items():
+        target = combined_label_counts if combined else label_counts
+        target.setdefault(label, {})[category] = count
+    reduced = table.filter(pc.greater(pc.list_value_length(table['reductions']), 0))
+    for category, (count, _) in _counts(reduced, ['category_main']).items():
+        counts = label_counts.setdefault(REDUCTION_LABEL, {})
+        counts[category] = counts.get(category, 0) + count
+
+    message_types = sorted(label_counts)
+    combined_labels = sorted(combined_label_counts)
+    # Camembert des réductions : tous les produits, catégorisés ou non
+    reductions = pc.value_counts(pc.list_flatten(products['reductions'])).to_pylist()
+    reduction_counts = {entry['values']: entry['counts'] for entry in reductions}
+    reduction_labels = sorted(reduction_counts)
+    return {
+        'categories': categories,
+        'message_types': message_types,
+        'data_counts': [[label_counts[msg].get(cat, 0) for cat in categories] for msg in message_types],
+        'combined_labels': combined_labels,
+        'combined_data_counts': [[combined_label_counts[label].get(cat, 0) for cat in categories] for label in combined_labels],
+        'reduction_labels': reduction_labels,
+        'reduction_data': [reduction_counts[label] for label in reduction_labels],
+    }
+
+
+def _pie(table, key):
+    counts = _counts(table, [key], 'review_count')
+    ordered = sorted(counts.items(), key=lambda entry: entry[1][0], reverse=True)
+    return ([name if name else UNKNOWN_CATEGORY for name, _ in ordered],
+            [count for _, (count, _) in ordered],
+            [reviews for _, (_, reviews) in ordered])
+
+
+def page2(snapshot, selected_first, selected_second):
+    table = snapshot.products()
+    firsts_table = table.filter(pc.is_valid(table['category_main']))
+    bar = sorted(_counts(firsts_table, ['category_main'], 'review_count').items())
+    firsts = [name for name, _ in bar]
+
+    seconds = []
+    pie_labels, pie_data, pie_reviews = [], [], []
+    pie2_labels, pie2_data, pie2_reviews = [], [], []
+    if selected_first:
+        in_first = table.filter(pc.equal(table['category_main'], selected_first))
+        seconds = sorted(name for name in pc.unique(in_first['category_2']).to_pylist() if name)
+        pie2_labels, pie2_data, pie2_reviews = _pie(in_first, 'category_2')
+    if selected_second:
+        pie_labels, pie_data, pie_reviews = _pie(table.filter(pc.equal(table['category_2'], selected_second)), 'category_3')
+
+    return {
+        'labels': firsts,
+        'data': [count for _, (count, _) in bar],
+        'reviews': [reviews for _, (_, reviews) in bar],
+        'firsts': firsts, 'selected_first': selected_first,
+        'seconds': seconds, 'selected_second': selected_second,
+        'pie_labels': pie_labels, 'pie_data': pie_data, 'pie_reviews': pie_reviews,
+        'pie2_labels': pie2_labels, 'pie2_data': pie2_data, 'pie2_reviews': pie2_reviews,
+    }
+
+
+def page3(snapshot):
+    table = snapshot.products()
+    rated = table.filter(pc.and_(pc.is_valid(table['category_main']), pc.greater(table['rating'], 0)))
+    rows = sorted(rated.group_by(['category_main']).aggregate([('rating', 'mean')]).to_pylist(),
+                  key=lambda row: row['category_main'])
+    return {
+        'labels': [row['category_main'] for row in rows],
+        'data': [row['rating_mean'] for row in rows],
+    }
@@ -0,0 +1,37 @@
+import base64
+import json
+
+import pytest
+
+from app import decode_cursor, encode_cursor
+
+
+def raw_cursor(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode('utf-8')).decode('ascii')
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor([12.5, '40299345-a1b2'])) == [12.5, '40299345-a1b2']
+    assert decode_cursor(encode_cursor([3, 'h-0f1e2d'])) == [3, 'h-0f1e2d']
+
+
+def test_missing_cursor_starts_at_the_first_page():
+    assert decode_cursor(None) is None
+    assert decode_cursor('') is None
+
+
+@pytest.mark.parametrize('cursor', [
+    'pas du base64 !',
+    'é',
+    base64.urlsafe_b64encode(b'{pas du json').decode('ascii'),
+    raw_cursor({'score': 1.0, 'doc_id': 'a'}),
+    raw_cursor([1.0]),
+    raw_cursor([1.0, 'a', 'b']),
+    raw_cursor([True, 'a']),
+    raw_cursor(['1.0', 'a']),
+    raw_cursor([1.0, None]),
+    raw_cursor([1.0, 42]),
+])
+def test_invalid_cursor_is_rejected(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)